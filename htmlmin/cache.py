@@ -0,0 +1,111 @@
+"""
+Copyright (c) 2013, Dave Mankoff
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Dave Mankoff nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL DAVE MANKOFF BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import unicode_literals
+import collections
+import threading
+
+class MinifiedCache(object):
+  """A least recently used cache of minified responses.
+
+  :param max_bytes: The most characters, or bytes for compressed responses,
+    of response bodies to hold. Least recently used entries are evicted to
+    stay within it. Bodies larger than this are never cached.
+
+  Safe to use from several threads at once.
+  """
+
+  def __init__(self, max_bytes=16 << 20):
+    self.max_bytes = max_bytes
+    self.bytes = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, key):
+    """Returns the value stored under ``key``, or None."""
+    with self._lock:
+      entry = self._entries.pop(key, None)
+      if entry is None:
+        self.misses += 1
+        return None
+      self._entries[key] = entry  # now the most recently used
+      self.hits += 1
+      return entry[0]
+
+  def put(self, key, value, size):
+    """Stores ``value``, which takes up ``size`` bytes, under ``key``."""
+    if size > self.max_bytes:
+      return
+    with self._lock:
+      old = self._entries.pop(key, None)
+      if old is not None:
+        self.bytes -= old[1]
+      self._entries[key] = (value, size)
+      self.bytes += size
+      while self.bytes > self.max_bytes:
+        _, (_, evicted_size) = self._entries.popitem(last=False)
+        self.bytes -= evicted_size
+        self.evictions += 1
+
+  def stats(self):
+    """Returns ``hits``, ``misses``, ``evictions``, ``entries`` and
+    ``bytes`` in a dict."""
+    with self._lock:
+      return {
+        'hits': self.hits,
+        'misses': self.misses,
+        'evictions': self.evictions,
+        'entries': len(self._entries),
+        'bytes': self.bytes,
+      }
+
+  def prometheus(self):
+    """Returns the stats in the Prometheus text exposition format."""
+    stats = self.stats()
+    lines = []
+    for name, kind, help, value in (
+        ('htmlmin_cache_hits_total', 'counter', 'Responses served from cache.',
+         stats['hits']),
+        ('htmlmin_cache_misses_total', 'counter',
+         'Cacheable responses not found in the cache.', stats['misses']),
+        ('htmlmin_cache_evictions_total', 'counter',
+         'Responses evicted to stay within the byte budget.',
+         stats['evictions']),
+        ('htmlmin_cache_entries', 'gauge', 'Responses in the cache.',
+         stats['entries']),
+        ('htmlmin_cache_bytes', 'gauge', 'Size of the cached responses.',
+         stats['bytes'])):
+      lines.append('# HELP %s %s' % (name, help))
+      lines.append('# TYPE %s %s' % (name, kind))
+      lines.append('%s %d' % (name, value))
+    return '\n'.join(lines) + '\n'
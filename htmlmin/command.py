@@ -30,10 +30,12 @@ import argparse
 import codecs
 import locale
 import io
+import json
 import sys
 
 #import htmlmin
 from . import Minifier
+from . import report
 
 parser = argparse.ArgumentParser(
   description='Minify HTML',
@@ -93,6 +95,103 @@ parser.add_argument('--keep-optional-attribute-quotes',
   help=(
 '''When set, this keeps all attribute quotes, even if they are optional.
 
+'''),
+  action='store_true')
+
+parser.add_argument('--remove-optional-tags',
+  help=(
+'''When set, start and end tags that the HTML specification allows to be left
+out are removed where it is safe to, such as '</li>' before another '<li>',
+'</td>' and '</tr>' at the end of a table row, and '<html>', '<head>' and
+'<body>' when they have no attributes.
+
+'''),
+  action='store_true')
+
+parser.add_argument('--remove-redundant-attributes',
+  help=(
+'''When set, attributes whose value is the default are removed, such as
+type="text/javascript" on scripts, method="get" on forms and type="text" on
+inputs, as are empty class, id and style attributes. This will break CSS
+selectors and scripts that look for these attributes.
+
+'''),
+  action='store_true')
+
+parser.add_argument('--canonicalize-attributes',
+  help=(
+'''When set, the attributes of every tag are put in the same order and space
+and repeated names are removed from class attributes, so that repeated
+elements compress better.
+
+'''),
+  action='store_true')
+
+parser.add_argument('--sort-class-names',
+  help=(
+'''When set, the names in class attributes are sorted.
+
+'''),
+  action='store_true')
+
+parser.add_argument('--minify-json',
+  help=(
+'''When set, space is taken out of the JSON in scripts with a JSON type, such
+as application/json and application/ld+json.
+
+'''),
+  action='store_true')
+
+parser.add_argument('--minify-css',
+  help=(
+'''When set, comments and needless space and semicolons are taken out of the
+CSS in style elements and style attributes.
+
+'''),
+  action='store_true')
+
+parser.add_argument('--minify-svg',
+  help=(
+'''When set, the numbers in the path data, point lists, view boxes and
+transforms of inline SVG are compacted, and metadata and drawing editor
+elements and attributes are left out.
+
+'''),
+  action='store_true')
+
+parser.add_argument('--svg-precision',
+  help=(
+'''The number of decimal places that --minify-svg rounds numbers to. Defaults
+to 3.
+
+'''),
+  metavar='PLACES',
+  type=int,
+  default=3)
+
+parser.add_argument('--base-url',
+  help=(
+'''The URL the HTML is served from. When set, absolute links are shortened to
+the shortest equivalent relative form.
+
+'''),
+  metavar='URL',
+  default=None)
+
+parser.add_argument('--shorten-charrefs',
+  help=(
+'''When set, character references in text are written in their shortest form,
+which is the character itself where the output encoding can encode it.
+
+'''),
+  action='store_true')
+
+parser.add_argument('--remove-block-space',
+  help=(
+'''When set, space that is not rendered because it is next to a block element,
+such as a div or li, or between the children of elements such as ul and table,
+is removed. This assumes elements keep their default CSS display.
+
 '''),
   action='store_true')
 
@@ -133,6 +232,28 @@ tags are always left unmininfied.
 '''),
   nargs='*',
   default=['pre', 'textarea'])
+parser.add_argument('--engine',
+  help=(
+'''The minification engine to use. 'fast' is considerably quicker but only
+suitable for well formed HTML, such as your own templates. Defaults to 'full'.
+
+'''),
+  choices=['full', 'fast'],
+  default='full')
+parser.add_argument('--report',
+  help=(
+'''When set, a report of how many characters each transformation saved and how
+long it took is written to stderr. Requires the full engine.
+
+'''),
+  action='store_true')
+parser.add_argument('--report-format',
+  help=(
+'''How --report is written: as a 'table' or as 'json'. Defaults to 'table'.
+
+'''),
+  choices=['table', 'json'],
+  default='table')
 parser.add_argument('-e', '--encoding',
   help=("Encoding to read and write with. Default 'utf-8'."
         " When reading from stdin, attempts to use the system's"
@@ -142,15 +263,36 @@ parser.add_argument('-e', '--encoding',
 
 def main():
   args = parser.parse_args()
-  minifier = Minifier(
+  default_encoding = args.encoding or 'utf-8'
+  if args.output_file:
+    output_encoding = default_encoding
+  else:
+    output_encoding = args.encoding or sys.stdout.encoding \
+      or locale.getpreferredencoding() or default_encoding
+
+  if args.report and args.engine == 'fast':
+    parser.error('--report requires the full engine')
+
+  options = dict(
     remove_comments=args.remove_comments,
     remove_empty_space=args.remove_empty_space,
     remove_optional_attribute_quotes=not args.keep_optional_attribute_quotes,
+    remove_optional_tags=args.remove_optional_tags,
+    remove_redundant_attributes=args.remove_redundant_attributes,
+    canonicalize_attributes=args.canonicalize_attributes,
+    sort_class_names=args.sort_class_names,
+    minify_json=args.minify_json,
+    minify_css=args.minify_css,
+    minify_svg=args.minify_svg,
+    svg_precision=args.svg_precision,
+    base_url=args.base_url,
+    shorten_charrefs=args.shorten_charrefs,
+    output_encoding=output_encoding,
+    remove_block_space=args.remove_block_space,
     pre_tags=args.pre_tags,
     keep_pre=args.keep_pre_attr,
     pre_attr=args.pre_attr,
     )
-  default_encoding = args.encoding or 'utf-8'
 
   if args.input_file:
     inp = codecs.open(args.input_file, encoding=default_encoding)
@@ -159,16 +301,27 @@ def main():
       or locale.getpreferredencoding() or default_encoding
     inp = io.open(sys.stdin.fileno(), encoding=encoding)
 
-  for line in inp.readlines():
-    minifier.input(line)
+  if args.report:
+    output, savings = report.minify(inp.read(), **options)
+  else:
+    minifier = Minifier(engine=args.engine, **options)
+    for line in inp.readlines():
+      minifier.input(line)
+    output = minifier.finalize()
 
   if args.output_file:
     codecs.open(
-      args.output_file, 'w', encoding=default_encoding).write(minifier.output)
+      args.output_file, 'w', encoding=output_encoding).write(output)
   else:
-    encoding = args.encoding or sys.stdout.encoding \
-      or locale.getpreferredencoding() or default_encoding
-    io.open(sys.stdout.fileno(), 'w', encoding=encoding).write(minifier.output)
+    io.open(sys.stdout.fileno(), 'w',
+            encoding=output_encoding).write(output)
+
+  if args.report:
+    if args.report_format == 'json':
+      text = json.dumps(savings.to_dict(), indent=2, sort_keys=True)
+    else:
+      text = savings.format_table()
+    sys.stderr.write(text + '\n')
 
 if __name__ == '__main__':
   main()
@@ -0,0 +1,143 @@
+"""
+Copyright (c) 2013, Dave Mankoff
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Dave Mankoff nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL DAVE MANKOFF BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import unicode_literals
+import re
+
+from .cache import MinifiedCache
+
+# Token kinds, which are also the group numbers in TOKEN_RE.
+STRING = 1
+COMMENT = 2
+URL = 3
+SPACE = 4
+OTHER = 5
+
+# Every character of the input belongs to exactly one match. Strings,
+# unquoted urls and escapes are matched whole, so that nothing inside them
+# is mistaken for a comment, space or punctuation.
+TOKEN_RE = re.compile(
+  r'("(?:[^"\\\n]|\\[\s\S])*"?|\'(?:[^\'\\\n]|\\[\s\S])*\'?)'      # 1: string
+  r'|(/\*[\s\S]*?(?:\*/|$))'                                     # 2: comment
+  r'|(url\([\x20\t\n\r\f]*[^\x20\t\n\r\f"\'()\\]*[\x20\t\n\r\f]*\))'  # 3
+  r'|([\x20\t\n\r\f]+)'                                          # 4: space
+  r'|((?:[^"\'/\x20\t\n\r\f\\uU]|\\[\s\S]|[uU](?!rl\())+|[uU]|/|\\)',  # 5
+  re.I)
+# Space can go on either side of these.
+SPACE_AROUND = '{};,'
+# Semicolons, outside of escapes, that end the input or a block, or that
+# follow another.
+TRAILING_SEMICOLONS_RE = re.compile(r'(?<!\\);+$')
+BLOCK_END_SEMICOLONS_RE = re.compile(r'(?<!\\);+(?=})')
+REPEATED_SEMICOLONS_RE = re.compile(r'(?<!\\);;+')
+
+def minify(css, declarations=False):
+  """Takes comments and needless space and semicolons out of CSS.
+
+  :param css: A style sheet, or with ``declarations``, the declarations of a
+    ``style`` attribute.
+  :returns: The minified CSS.
+
+  This is deliberately conservative. Space is only removed at either end,
+  around ``{``, ``}``, ``;`` and ``,``, and after ``:`` (before it too with
+  ``declarations``, where there are no selectors); elsewhere, such as
+  around ``>`` and ``+``, runs of space become a single space. Strings,
+  escapes and unquoted ``url()`` values are left exactly as they are, as are
+  comments that start with ``/*!``. A comment that separates two tokens that
+  would otherwise run together is shortened to ``/**/``.
+  """
+  # Without selectors, space before a colon can go too.
+  space_before = SPACE_AROUND + ':' if declarations else SPACE_AROUND
+  out = []
+  space = comment = False
+  last_kind = None
+  for match in TOKEN_RE.finditer(css):
+    kind = match.lastindex
+    text = match.group(kind)
+    if kind == SPACE:
+      space = True
+      continue
+    if kind == COMMENT and not text.startswith('/*!'):
+      comment = True
+      continue
+
+    separated = False
+    if out and (space or comment):
+      before = out[-1][-1]
+      if out[-1][-2:-1] == '\\':
+        before = None  # escaped, or possibly so
+      after = text[0]
+      if (before is not None and (before in SPACE_AROUND or before == ':') or
+          after in space_before):
+        pass
+      elif space:
+        out.append(' ')
+        separated = True
+      elif before is None or not (before in '()' or after in '()'):
+        out.append('/**/')
+        separated = True
+    space = comment = False
+
+    if kind == OTHER:
+      if (last_kind == OTHER and not separated and text[0] in ';}' and
+          TRAILING_SEMICOLONS_RE.search(out[-1])):
+        # Semicolons that had space or a comment between them.
+        if text[0] == '}':
+          _strip_semicolons(out)
+        else:
+          text = text.lstrip(';')
+          if not text:
+            continue
+      if ';' in text:
+        text = REPEATED_SEMICOLONS_RE.sub(';',
+                                          BLOCK_END_SEMICOLONS_RE.sub('', text))
+    out.append(text)
+    last_kind = kind
+
+  if declarations and last_kind == OTHER:
+    _strip_semicolons(out)
+  return ''.join(out)
+
+def _strip_semicolons(out):
+  text = TRAILING_SEMICOLONS_RE.sub('', out[-1])
+  if text:
+    out[-1] = text
+  else:
+    out.pop()
+
+# Shared by every parser, so that a style sheet that appears on many pages is
+# only minified once per process.
+CACHE = MinifiedCache(max_bytes=4 << 20)
+
+def cached_minify(css, declarations=False):
+  """Like :func:`minify`, but remembers results in :data:`CACHE`."""
+  key = (css, declarations)
+  result = CACHE.get(key)
+  if result is None:
+    result = minify(css, declarations)
+    CACHE.put(key, result, len(css) + len(result))
+  return result
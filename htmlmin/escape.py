@@ -34,6 +34,8 @@ except ImportError:
 
 import re
 
+from .python3html import _html5, unescape
+
 NO_QUOTES = 0
 SINGLE_QUOTE = 1
 DOUBLE_QUOTE = 2
@@ -51,6 +53,59 @@ NINE = ord('9')
 # https://www.w3.org/TR/html5/syntax.html#attributes-0
 CHARS_TO_QUOTE_RE = re.compile(u'[\x20\x09\x0a\x0c\x0d=><`]')
 
+# The shortest name of each character, or pair of characters, that has one,
+# in lower case where there is a choice. Names without a semicolon are only
+# recognized for backwards compatibility.
+SHORTEST_CHARREF_NAMES = {}
+for _name, _value in sorted(_html5.items(), key=lambda item: (
+    len(item[0]), item[0].lower() != item[0], item[0])):
+  if _name.endswith(';'):
+    SHORTEST_CHARREF_NAMES.setdefault(_value, _name)
+
+# Characters that shorten_charref always leaves as references: those that
+# start a tag or a reference; space, whose references survive the removal of
+# space; controls and noncharacters; and those that could run on from text
+# in front of them to make up a new reference, such as the 'p' in
+# '&am&#112;;'.
+CHARREF_RE = re.compile(
+  u'&(?:#[0-9]+|#[xX][0-9a-fA-F]+|[a-zA-Z][a-zA-Z0-9]*);')
+KEEP_CHARREF_RE = re.compile(
+  u'[&<\x00-\x20\x7f-\x9f0-9A-Za-z#;\ufdd0-\ufdef\ufffe\uffff]')
+
+def shorten_charref(ref, encoding=None):
+  """Returns the shortest way to write the character reference ``ref``,
+  such as ``&rsquo;`` or ``&#x2019;``, in text.
+
+  That is the character itself if it is safe to write out and ``encoding``
+  can encode it, and otherwise the shortest of ``ref`` and the named,
+  decimal and hexadecimal references to the character. References that
+  aren't recognized are returned as they are.
+  """
+  value = unescape(ref)
+  if value == ref:
+    return ref
+  if encoding is not None and not KEEP_CHARREF_RE.search(value):
+    try:
+      value.encode(encoding)
+      return value
+    except UnicodeError:
+      pass
+  candidates = [ref]
+  name = SHORTEST_CHARREF_NAMES.get(value)
+  if name is not None:
+    candidates.append('&' + name)
+  if len(value) == 1:
+    candidates.extend(['&#%d;' % ord(value), '&#x%x;' % ord(value)])
+  return min(candidates, key=len)
+
+def shorten_charrefs(text, encoding=None):
+  """Shortens each character reference in ``text`` with
+  :func:`shorten_charref`. Only references that end with a semicolon are
+  recognized."""
+  if '&' not in text:
+    return text
+  return CHARREF_RE.sub(lambda m: shorten_charref(m.group(), encoding), text)
+
 def escape_tag(val):
   return escape(val)
 
@@ -0,0 +1,331 @@
+"""
+Copyright (c) 2013, Dave Mankoff
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Dave Mankoff nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL DAVE MANKOFF BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import unicode_literals
+import re
+
+from . import css
+from . import escape
+from . import parser
+from .python3html.parser import attrfind_tolerant, tagfind_tolerant
+
+START_TAG_RE = (r'<[a-zA-Z][^\t\n\r\f />\x00]*'
+                r'(?:[^>"\']|"[^"]*"|\'[^\']*\')*>')
+
+# Everything the fast engine acts on. Text that isn't whitespace never
+# matches, so the regex engine skips over it without calling back into Python.
+TOKEN_PATTERN = (
+  r'<!--([\s\S]*?)--\s*>'                                   # 1: comment
+  r'|(<(script|style)(?=[\s/>])' + START_TAG_RE[len('<[a-zA-Z]'):] +
+  r')([\s\S]*?)</\s*\3\s*>'                                 # 2-4: raw text
+  r'|(' + START_TAG_RE + ')'                                # 5: start tag
+  r'|</\s*([a-zA-Z][^\t\n\r\f />\x00]*)[^>]*>'              # 6: end tag
+  r'|(<!doctype[^>]*>)'                                     # 7: doctype
+  r'|<!\[[\s\S]*?\]>|<\?[^>]*>'                             # CDATA, PI
+  # 8: space, except single spaces between words, which are left alone.
+  r'|([\x20\x09\x0a\x0c\x0d]{2,}|[\x09\x0a\x0c\x0d]|(?<=>) | (?=<))')
+TOKEN_RE = re.compile(TOKEN_PATTERN, re.I)
+# With shorten_charrefs, character references in text are acted on too.
+CHARREF_TOKEN_RE = re.compile(
+  TOKEN_PATTERN + '|(' + escape.CHARREF_RE.pattern + ')', re.I)  # 9
+# Whatever the tokenizer of the full engine would end a run of text at.
+TOKEN_START_RE = re.compile(r'<[a-zA-Z/!?]')
+TITLE_END_RE = re.compile(r'</title[\s>]', re.I)
+LEADING_SPACE_BEFORE_DOCTYPE_RE = re.compile(
+  r'^[\x20\x09\x0a\x0c\x0d]+(?=<!doctype)', re.I)
+BASE_TAG_RE = re.compile(
+  r'<base(?=[\s/>])' + START_TAG_RE[len('<[a-zA-Z]'):], re.I)
+
+# Bounds the cache of rewritten start tags.
+MAX_CACHED_TAGS = 4096
+
+class FastMinParser(object):
+  """A regex based minifier for HTML whose structure you trust.
+
+  It has the same options as :class:`htmlmin.parser.HTMLMinParser` and the
+  same ``feed``/``close``/``reset``/``result`` interface, so it can be used
+  anywhere a parser class is accepted. Rather than running a tokenizer and a
+  tag stack, it passes over the whole document once with a single regular
+  expression that only stops at tags, comments and runs of whitespace. Start
+  tags are rewritten by the same code as in the full engine and cached, since
+  templates tend to repeat the same tags over and over.
+
+  The price is that it does not track how elements nest. ``pre_tags`` and
+  ``pre_attr`` regions are found by matching start and end tags of the same
+  name, implicitly closed elements are not recognized, ``lang`` attributes
+  that repeat the parent's are left in place, and with ``base_url``, a
+  ``<base href>`` is taken to apply to the whole document, not only to what
+  follows it. For well formed templates the output is identical to the full
+  engine; see :class:`htmlmin.Minifier` for checking that on live traffic.
+
+  Output is only produced by :meth:`close`.
+  """
+
+  def __init__(self, **kwargs):
+    if kwargs.get('remove_optional_tags'):
+      # Which tags can be left out depends on how elements nest.
+      raise ValueError('remove_optional_tags is not supported by the fast '
+                       'engine')
+    if kwargs.get('minify_svg'):
+      # Leaving elements out means knowing where they end.
+      raise ValueError('minify_svg is not supported by the fast engine')
+    if kwargs.get('remove_block_space'):
+      # Which space is next to a block depends on which tags are open.
+      raise ValueError('remove_block_space is not supported by the fast '
+                       'engine')
+    # Tags are rewritten by an idle full parser, whose tag stack stays empty.
+    self._builder = parser.HTMLMinParser(**kwargs)
+    self.convert_charrefs = self._builder.convert_charrefs
+    self._pre_tags = frozenset(self._builder.pre_tags)
+    self._tag_cache = {}
+    self._token_re = (CHARREF_TOKEN_RE if self._builder.shorten_charrefs
+                      else TOKEN_RE)
+    self.reset()
+
+  def reset(self):
+    self._chunks = []
+    self._output = []
+    self.source = None
+
+  def feed(self, data):
+    self._chunks.append(data)
+
+  def close(self):
+    self.source = ''.join(self._chunks)
+    self._chunks = []
+    self._output.append(self._minify(self.source))
+
+  def flush(self):
+    return ''
+
+  @property
+  def result(self):
+    return ''.join(self._output)
+
+  def _minify_fragments(self, fragments):
+    return [self._minify(fragment) for fragment in fragments]
+
+  def _build_start_tag(self, text):
+    """Returns ``(tag, has_pre, output, self_closing, minify_content)`` for a
+    start tag, or None if the full engine would treat it as text.
+    ``minify_content`` is the function that minifies a script or style
+    element's content, if there is one."""
+    cached = self._tag_cache.get(text)
+    if cached is not None:
+      return cached or None
+
+    tag, attrs, end = _parse_start_tag(text)
+    if end not in ('>', '/>'):
+      result = ()
+    elif end == '/>':
+      result = (tag, False, self._builder.build_tag(
+        tag, attrs, tag not in parser.NO_CLOSE_TAGS)[1], True, None)
+    else:
+      has_pre, data = self._builder.build_tag(tag, attrs, False)[:2]
+      builder = self._builder
+      minify_content = None
+      if has_pre:
+        pass
+      elif (tag == 'script' and builder.minify_json and
+            builder._is_json_script(attrs)):
+        minify_content = builder._compact_json
+      elif tag == 'style' and builder.minify_css:
+        minify_content = css.cached_minify
+      result = (tag, has_pre, data, False, minify_content)
+
+    if len(self._tag_cache) >= MAX_CACHED_TAGS:
+      self._tag_cache.clear()
+    self._tag_cache[text] = result
+    return result or None
+
+  def _use_base_tag(self, source):
+    """Makes the builder shorten URLs against the first base element of
+    ``source`` that isn't in a comment, as the full engine would from that
+    element on."""
+    builder = self._builder
+    url_base = builder._url_base
+    builder._url_base = None
+    builder._base_seen = False
+    for match in BASE_TAG_RE.finditer(source):
+      start = match.start()
+      if source.rfind('<!--', 0, start) > source.rfind('-->', 0, start):
+        continue
+      builder._set_url_base(_parse_start_tag(match.group())[1])
+      if builder._base_seen:
+        break
+    if builder._url_base != url_base:
+      # Rewritten tags depend on the base.
+      self._tag_cache.clear()
+
+  def _minify(self, source):
+    source = LEADING_SPACE_BEFORE_DOCTYPE_RE.sub('', source)
+    if self._builder.base_url:
+      self._use_base_tag(source)
+    length = len(source)
+    keep_comment = self._builder._keep_comment
+    empty_space_match = self._builder._empty_space_re.match
+    pre_tags = self._pre_tags
+    build_start_tag = self._build_start_tag
+    output_encoding = self._builder.output_encoding
+    end_tags = {}
+
+    # The state carried between matches. pre_stack holds the name of the tag
+    # that opened the current pre region once for each time it is open.
+    state = {
+      'pre_stack': [],
+      'in_head': False,
+      'in_title': False,
+      'title_start': -1,     # where the text of the current title starts
+      'after_doctype': False,
+      'token_end': 0,        # where the last match other than space ended
+      'space_end': -1,       # where the last space written out ended
+    }
+
+    def start_tag(text, end):
+      built = build_start_tag(text)
+      if built is None:
+        return text
+      tag, has_pre, data, self_closing = built[:4]
+      state['after_doctype'] = False
+      if self_closing:
+        return data
+      if tag == 'head':
+        state['in_head'] = True
+      elif tag == 'title' and state['in_head']:
+        state['in_title'] = True
+        state['title_start'] = end
+      pre_stack = state['pre_stack']
+      if pre_stack:
+        if tag == pre_stack[-1]:
+          pre_stack.append(tag)
+      elif has_pre or tag in pre_tags:
+        pre_stack.append(tag)
+      return data
+
+    def replace(match):
+      start, end = match.span()
+      space = match.group(8)
+      if space is not None:
+        if state['pre_stack']:
+          if space[-1] == ' ':
+            state['space_end'] = end
+          return space
+        whole = start == state['token_end'] and (
+          end == length or TOKEN_START_RE.match(source, end))
+        if whole and (state['in_head'] or state['after_doctype'] or
+                      empty_space_match(space)):
+          drop = True
+        elif state['in_title'] and (start == state['title_start'] or
+                                    TITLE_END_RE.match(source, end)):
+          drop = True
+        else:
+          drop = start == state['space_end']
+        if drop:
+          if state['space_end'] == start:
+            state['space_end'] = end
+          return ''
+        state['space_end'] = end
+        return ' '
+
+      if match.lastindex == 9:
+        # A character reference. Text around it still counts as one run.
+        if state['pre_stack']:
+          return match.group(9)
+        return escape.shorten_charref(match.group(9), output_encoding)
+
+      state['token_end'] = end
+      if match.group(5) is not None:
+        return start_tag(match.group(5), end)
+
+      tag = match.group(6)
+      if tag is not None:
+        tag = tag.lower()
+        pre_stack = state['pre_stack']
+        if pre_stack and tag == pre_stack[-1]:
+          pre_stack.pop()
+        if tag == 'head':
+          state['in_head'] = False
+        elif tag == 'title':
+          state['in_title'] = False
+        end_tag = end_tags.get(tag)
+        if end_tag is None:
+          end_tag = end_tags[tag] = ('' if tag in parser.NO_CLOSE_TAGS else
+                                     '</%s>' % escape.escape_tag(tag))
+        if not end_tag and state['space_end'] == start:
+          state['space_end'] = end
+        return end_tag
+
+      comment = match.group(1)
+      if comment is not None:
+        if not keep_comment(comment):
+          # Let space on either side of the comment collapse together, as
+          # with end tags that are dropped.
+          if state['space_end'] == start:
+            state['space_end'] = end
+          return ''
+        if comment[:1] == '!':
+          comment = comment[1:]
+        return '<!--%s-->' % comment
+
+      if match.group(2) is not None:
+        raw_tag = match.group(3).lower()
+        pre_stack = state['pre_stack']
+        in_pre = bool(pre_stack)
+        data = start_tag(match.group(2), end)
+        content = match.group(4)
+        built = build_start_tag(match.group(2))
+        if built is not None and built[4] is not None and not in_pre:
+          content = built[4](content)
+        if pre_stack and pre_stack[-1] == raw_tag:
+          pre_stack.pop()
+        return '%s%s</%s>' % (data, content, raw_tag)
+
+      if match.group(7) is not None:
+        state['after_doctype'] = True
+      return match.group(0)
+
+    return self._token_re.sub(replace, source)
+
+def _parse_start_tag(text):
+  """Returns ``(tag, attrs, end)`` for a start tag, where ``end`` is what
+  follows the attributes. This follows HTMLParser.parse_starttag."""
+  match = tagfind_tolerant.match(text, 1)
+  tag = match.group(1).lower()
+  k = match.end()
+  attrs = []
+  while k < len(text):
+    m = attrfind_tolerant.match(text, k)
+    if not m:
+      break
+    name, rest, value = m.group(1, 2, 3)
+    if not rest:
+      value = None
+    elif value[:1] == '\'' == value[-1:] or value[:1] == '"' == value[-1:]:
+      value = value[1:-1]
+    attrs.append((name.lower(), value))
+    k = m.end()
+  return tag, attrs, text[k:].strip()
@@ -26,8 +26,15 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 import cgi
+import logging
+import random
+import re
 
+from . import fast
+from . import parallel
 from . import parser
+from . import tokens
+from .stats import Instrumentation, timer
 
 def minify(input,
            remove_comments=False,
@@ -40,7 +47,20 @@ def minify(input,
            keep_pre=False,
            pre_tags=parser.PRE_TAGS,
            pre_attr='pre',
-           cls=parser.HTMLMinParser):
+           remove_optional_tags=False,
+           remove_redundant_attributes=False,
+           canonicalize_attributes=False,
+           sort_class_names=False,
+           minify_json=False,
+           minify_css=False,
+           minify_svg=False,
+           svg_precision=3,
+           base_url=None,
+           shorten_charrefs=False,
+           output_encoding='utf-8',
+           remove_block_space=False,
+           cls=parser.HTMLMinParser,
+           engine=None):
   """Minifies HTML in one shot.
 
   :param input: A string containing the HTML to be minified.
@@ -71,8 +91,9 @@ def minify(input,
     attributes are removed. When False, all attribute quotes are left intact.
     Defaults to True.
   :param conver_charrefs: Decode character references such as &amp; and &#46;
-    to their single charater values where safe. This currently only applies to
-    attributes. Data content between tags will be left encoded.
+    to their single charater values where safe. This only applies to
+    attributes. Data content between tags is left encoded; see
+    ``shorten_charrefs``.
   :param keep_pre: By default, htmlmin uses the special attribute ``pre`` to
     allow you to demarcate areas of HTML that should not be minified. It removes
     this attribute as it finds it. Setting this value to ``True`` tells htmlmin
@@ -86,12 +107,81 @@ def minify(input,
     ``pre``. You can also prefix individual tag attributes with 
     ``{pre_attr}-`` to prevent the contents of the individual attribute from
     being changed.
+  :param remove_optional_tags: Leave out start and end tags wherever the HTML
+    specification allows it, for instance ``</li>`` in front of another
+    ``<li>``, ``</td>`` at the end of a row and ``<html>``, ``<head>`` and
+    ``<body>`` tags without attributes. Whether a tag can go depends on what
+    follows it, including space, so this removes more when combined with
+    ``remove_empty_space``. End tags other than ``</html>`` and ``</body>``
+    are kept at the very end of the input, in case it is part of a larger
+    document. Not supported by the fast engine.
+  :param remove_redundant_attributes: Leave out attributes whose value is the
+    default, such as ``type="text/javascript"`` on scripts,
+    ``method="get"`` on forms and ``type="text"`` on inputs, as well as empty
+    ``class``, ``id`` and ``style`` attributes. See
+    ``htmlmin.parser.REDUNDANT_ATTRIBUTES`` for the full list. Only turn this
+    on if no CSS selectors or scripts look for these attributes, as in
+    ``input[type=text]``.
+  :param canonicalize_attributes: Put the attributes of every tag in the
+    same order, that of ``htmlmin.parser.ATTRIBUTE_ORDER`` followed by the
+    rest in alphabetical order, and collapse space in and remove repeated
+    names from ``class`` attributes. The same element written with its
+    attributes in a different order then comes out byte for byte the same,
+    which helps gzip and other compression. Scripts that depend on the order
+    of attributes will see it change.
+  :param sort_class_names: Also sort the names in ``class`` attributes.
+    Scripts that compare ``className`` against a string will see it change.
+  :param minify_json: Take the space out of the JSON in scripts with a JSON
+    type, such as ``application/json``, ``application/ld+json`` and
+    ``importmap``. Strings and numbers are left exactly as they are. Scripts
+    that don't hold valid JSON, or that have the ``pre_attr`` attribute, are
+    left alone.
+  :param minify_css: Take comments and needless space and semicolons out of
+    the CSS in style elements and style attributes. This is conservative, see
+    :func:`htmlmin.css.minify`. Style elements and attributes with the
+    ``pre_attr`` attribute, or inside a pre region, are left alone.
+  :param minify_svg: Inside inline ``<svg>`` elements, compact the numbers in
+    ``d``, ``points``, ``viewBox`` and transform attributes, and leave out
+    ``<metadata>`` elements and the elements and attributes that drawing
+    editors such as Inkscape add. Elements with the ``pre_attr`` attribute
+    are left alone. Not supported by the fast engine.
+  :param svg_precision: With ``minify_svg``, the number of decimal places
+    that numbers are rounded to, or None to keep them as they are. The
+    rounding errors of relative path commands add up, so paths drawn at a
+    small scale may need more.
+  :param base_url: The URL the HTML is served from. Absolute ``http`` and
+    ``https`` URLs in attributes such as ``href``, ``src``, ``action`` and
+    ``srcset`` (see ``htmlmin.urls.URL_ATTRIBUTES``) are shortened to the
+    shortest scheme relative, path absolute or relative form that points to
+    the same place, taking the first ``<base href>`` into account from where
+    it appears. Only set this for HTML that is served from that one URL.
+  :param shorten_charrefs: Write character references in text, such as
+    ``&rsquo;`` and ``&#8217;``, in their shortest form: the character itself
+    where ``output_encoding`` can encode it and it is safe to, and otherwise
+    the shortest of its named, decimal and hexadecimal references. ``&amp;``,
+    ``&lt;`` and references to space and ASCII letters and digits stay
+    references. Text in pre regions is left alone.
+  :param output_encoding: The encoding the minified HTML will be written in,
+    which decides which characters ``shorten_charrefs`` can write out. None
+    keeps them all as references. Defaults to ``'utf-8'``.
+  :param remove_block_space: Remove space that browsers don't render because
+    of how elements are laid out: next to the start and end tags of block
+    elements such as ``div``, ``p``, ``li`` and ``td`` and next to ``br``,
+    and between the children of elements such as ``ul``, ``table``,
+    ``select`` and ``head``. Space between inline elements is collapsed but
+    kept. This assumes elements keep their default ``display``; don't use it
+    where CSS makes a block inline or the other way around. Not supported by
+    the fast engine.
+  :param engine: Set to ``'fast'`` to use :class:`htmlmin.fast.FastMinParser`
+    instead of ``cls``. It is considerably faster but only suitable for well
+    formed HTML, such as your own templates. ``'full'`` selects the default
+    :class:`htmlmin.parser.HTMLMinParser`.
   :return: A string containing the minified HTML.
 
   If you are going to be minifying multiple HTML documents, each with the same
   settings, consider using :class:`.Minifier`.
   """
-  minifier = cls(
+  minifier = _engine_cls(engine, cls)(
       remove_comments=remove_comments,
       remove_empty_space=remove_empty_space,
       remove_all_empty_space=remove_all_empty_space,
@@ -101,11 +191,140 @@ def minify(input,
       convert_charrefs=convert_charrefs,
       keep_pre=keep_pre,
       pre_tags=pre_tags,
-      pre_attr=pre_attr)
+      pre_attr=pre_attr,
+      remove_optional_tags=remove_optional_tags,
+      remove_redundant_attributes=remove_redundant_attributes,
+      canonicalize_attributes=canonicalize_attributes,
+      sort_class_names=sort_class_names,
+      minify_json=minify_json,
+      minify_css=minify_css,
+      minify_svg=minify_svg,
+      svg_precision=svg_precision,
+      base_url=base_url,
+      shorten_charrefs=shorten_charrefs,
+      output_encoding=output_encoding,
+      remove_block_space=remove_block_space)
   minifier.feed(input)
   minifier.close()
   return minifier.result
 
+ENGINES = {
+  'full': parser.HTMLMinParser,
+  'fast': fast.FastMinParser,
+}
+
+def _engine_cls(engine, cls):
+  if engine is None:
+    return cls
+  try:
+    return ENGINES[engine]
+  except KeyError:
+    raise ValueError('Unknown engine: {!r}'.format(engine))
+
+def _log_divergence(input, result, expected):
+  i = 0
+  for i, (a, b) in enumerate(zip(result, expected)):
+    if a != b:
+      break
+  else:
+    i = min(len(result), len(expected))
+  logging.warning('Fast engine diverged from the full engine at offset %d: '
+                  '%r != %r', i, result[i:i + 40], expected[i:i + 40])
+
+MINIFIED_MARKER = '<!--htmlmin-->'
+
+# How much input is fed at a time when minifying against a deadline.
+DEADLINE_SLICE = 1 << 16
+
+def _minifiable_res(options):
+  """Returns regexes that find anything minifying with ``options`` might
+  change. They err on the side of finding too much.
+
+  Each regex starts with a single character or character class, which lets
+  the regex engine skip ahead to candidate positions without backtracking
+  into Python.
+  """
+  no_close_tags = '|'.join(parser.NO_CLOSE_TAGS)
+  after_space = [
+    r'(?<=[\x09\x0a\x0c\x0d])',             # space that collapses
+    r'[\x20\x09\x0a\x0c\x0d=]|/?>',          # or space inside of tags
+    r'[^\s=>]*[A-Z][^\s=>]*=',               # upper case attribute names
+    r'</title>',
+    r'%s[\s=/>]' % re.escape(options['pre_attr']),
+    r'lang=[\s\S]*\slang=',                  # possibly redundant lang
+  ]
+  after_lt = [
+    r'!--|/?\s',                              # comments, space in tags
+    r'/?[a-z0-9]*[A-Z]',                       # upper case tag names
+    r'(?:%s)\b[^>]*/>|/(?:%s)\s*>' % (no_close_tags, no_close_tags),
+    r'title>\x20',
+    r'![^-\[][^>]*>\x20',                     # space after a doctype
+    # Space between tags in the head. This stops looking at </head>.
+    r'head(?=[\s>])(?:(?!</head)[\s\S])*?>\x20(?:<|$)',
+  ]
+  after_eq = [
+    r'\s',
+    r'(?:"[^"]*|\'[^\']*|[^\s>"\']*)&',        # character references
+  ]
+  if options['reduce_empty_attributes']:
+    after_eq.append(r'""|\'\'')
+  if options['remove_optional_attribute_quotes']:
+    after_eq.append(r'"[^\s"\'=<>`]+"|\'[^\s"\'=<>`]+\'')
+  else:
+    after_eq.append(r'[^"]')
+  if options['reduce_boolean_attributes']:
+    names = set()
+    for attrs in parser.BOOLEAN_ATTRIBUTES.values():
+      names.update(attrs)
+    after_space.append(r'(?:%s)=' % '|'.join(sorted(names)))
+  if options['remove_redundant_attributes']:
+    names = set()
+    for attrs in parser.REDUNDANT_ATTRIBUTES.values():
+      names.update(attr for attr, values in attrs.items() if values != ('',))
+    after_space.append(r'(?:%s)=' % '|'.join(sorted(names)))
+    empty_names = '|'.join(sorted(parser.REDUNDANT_ATTRIBUTES['*']))
+    after_space.append(r'(?:%s)(?:=""|=\'\')?[\s/>]' % empty_names)
+  if options['canonicalize_attributes'] or options['sort_class_names']:
+    after_space.append(r'class=(?:"[^"]*\s|\'[^\']*\s)')
+  if options['canonicalize_attributes']:
+    # Any tag with more than one attribute.
+    after_lt.append(r'[a-zA-Z][^\s>]*\s+[^\s=>]+'
+                    r'(?:=(?:"[^"]*"|\'[^\']*\'|[^\s>"\']*))?\s+[^\s>/]')
+  if options['minify_json']:
+    # Any script with a type other than JavaScript, which is close enough.
+    after_lt.append(r'script\s[^>]*type=')
+  if options['minify_css']:
+    after_lt.append(r'style[\s>]')
+    after_space.append(r'style=')
+  if options['minify_svg']:
+    # Any SVG, and then anything that minify_svg could take out, is close
+    # enough.
+    after_lt.append(r'svg[\s>]')
+  if options['base_url']:
+    after_eq.append(r'["\']?https?://')
+
+  res = [
+    r'^\x20<!',                              # space before a doctype
+    r'\s(?:%s)' % '|'.join(after_space),
+    r'<(?:%s)' % '|'.join(after_lt),
+    r'=(?:%s)' % '|'.join(after_eq),
+  ]
+  if options['remove_all_empty_space']:
+    res.append(r'>\x20(?:<|$)')
+  if options['remove_optional_tags']:
+    res.append(r'<(?:/(?:%s)\s*|(?:%s))>' % (
+      '|'.join(sorted(set(parser.OPTIONAL_END_TAGS) |
+                      set(parser.OPTIONAL_END_TAGS_UNLESS_FOLLOWED))),
+      '|'.join(parser.OPTIONAL_START_TAGS)))
+  if options['remove_block_space']:
+    blocks = '|'.join(sorted(parser.BLOCK_TAGS))
+    res.append(r'\s</?(?:%s)[\s/>]' % blocks)
+    res.append(r'</?(?:%s)(?:\s[^>]*)?>\s' % blocks)
+  if options['shorten_charrefs']:
+    # Any reference but the two that always stay, which is close enough.
+    res.append(r'&(?!amp;|lt;)[a-zA-Z#]')
+  return [re.compile(r) for r in res]
+
 class Minifier(object):
   """An object that supports HTML Minification.
 
@@ -115,6 +334,36 @@ class Minifier(object):
   :class:`htmlmin.minify`.
 
   See :class:`htmlmin.minify` for an explanation of options.
+
+  With ``engine='fast'``, a sample of documents can also be run through the
+  full engine to check that both agree before relying on the fast one:
+
+  :param verify_rate: The fraction of documents, between 0 and 1, to verify.
+    Verification happens in :meth:`minify` and :meth:`finalize`. When the
+    engines disagree, the output of the full engine is returned.
+  :param on_divergence: Called as ``on_divergence(input, result, expected)``
+    with the fast and full engine output whenever they disagree. By default
+    a warning is logged.
+
+  The ``verified`` and ``diverged`` entries of :attr:`counters` keep count.
+
+  HTML that has already been minified can be passed through :meth:`minify`
+  unchanged instead of being parsed again:
+
+  :param minified_marker: A string, such as a comment, that is appended to
+    the output of :meth:`minify` and :meth:`finalize`. Input that ends with
+    it is returned as is. ``True`` uses ``<!--htmlmin-->``.
+  :param detect_minified: Scan input for anything minification could
+    change: runs of whitespace, comments, quotes that could be dropped and
+    so on. If none is found, the input is returned as is. The scan is a
+    single regular expression search and errs on the side of minifying.
+
+  The ``skipped_marker`` and ``skipped_detected`` entries of
+  :attr:`counters` count how often each of these applied.
+  :param stats: Collect a :class:`htmlmin.stats.MinifyStats` for each
+    document minified with :meth:`minify`, :meth:`finalize` or
+    :meth:`minify_tokens`, and keep the latest in :attr:`last_stats`. This
+    slows minification down somewhat; when off, it costs nothing.
   """
 
   def __init__(self,
@@ -128,12 +377,39 @@ class Minifier(object):
                keep_pre=False,
                pre_tags=parser.PRE_TAGS,
                pre_attr='pre',
-               cls=parser.HTMLMinParser):
+               remove_optional_tags=False,
+               remove_redundant_attributes=False,
+               canonicalize_attributes=False,
+               sort_class_names=False,
+               minify_json=False,
+               minify_css=False,
+               minify_svg=False,
+               svg_precision=3,
+               base_url=None,
+               shorten_charrefs=False,
+               output_encoding='utf-8',
+               remove_block_space=False,
+               cls=parser.HTMLMinParser,
+               engine=None,
+               verify_rate=0,
+               on_divergence=_log_divergence,
+               minified_marker=None,
+               detect_minified=False,
+               stats=False):
     """Initialize the Minifier.
 
     See :class:`htmlmin.minify` for an explanation of options.
     """
-    self._parser = cls(
+    cls = _engine_cls(engine, cls)
+    if verify_rate and cls is not fast.FastMinParser:
+      raise ValueError('verify_rate requires engine=\'fast\'')
+    self._cls = cls
+    self._verify_rate = verify_rate
+    self._on_divergence = on_divergence
+    self._full_parser = None
+    self.counters = {'verified': 0, 'diverged': 0, 'skipped_marker': 0,
+                     'skipped_detected': 0, 'deadline_exceeded': 0}
+    self._options = dict(
       remove_comments=remove_comments,
       remove_empty_space=remove_empty_space,
       remove_all_empty_space=remove_all_empty_space,
@@ -143,14 +419,41 @@ class Minifier(object):
       convert_charrefs=convert_charrefs,
       keep_pre=keep_pre,
       pre_tags=pre_tags,
-      pre_attr=pre_attr)
+      pre_attr=pre_attr,
+      remove_optional_tags=remove_optional_tags,
+      remove_redundant_attributes=remove_redundant_attributes,
+      canonicalize_attributes=canonicalize_attributes,
+      sort_class_names=sort_class_names,
+      minify_json=minify_json,
+      minify_css=minify_css,
+      minify_svg=minify_svg,
+      svg_precision=svg_precision,
+      base_url=base_url,
+      shorten_charrefs=shorten_charrefs,
+      output_encoding=output_encoding,
+      remove_block_space=remove_block_space)
+    self._parser = cls(**self._options)
+    if minified_marker is True:
+      minified_marker = MINIFIED_MARKER
+    self._minified_marker = minified_marker or ''
+    self._minifiable_res = (_minifiable_res(self._options) if detect_minified
+                            else None)
+    self._instrumentation = Instrumentation(self._parser) if stats else None
+    self.last_stats = None
 
-  def minify(self, *input):
+  def minify(self, *input, **kwargs):
     """Runs HTML through the minifier in one pass.
 
     :param input: HTML to be fed into the minimizer. Multiple chunks of HTML
       can be provided, and they are fed in sequentially as if they were
       concatenated.
+    :param deadline: A time budget, in seconds. Input is fed to the parser
+      a slice at a time, and once the budget has been used up, the output so
+      far is returned followed by the rest of the input as is, so that no
+      single document can hold the caller up for long. The
+      ``deadline_exceeded`` entry of :attr:`counters` counts how often that
+      happens. The fast engine minifies the whole document in a single pass,
+      which can't be interrupted, so it ignores this.
     :returns: A string containing the minified HTML.
 
     This is the simplest way to use an existing ``Minifier`` instance. This
@@ -158,9 +461,155 @@ class Minifier(object):
     method resets the internal state of  the parser before it does any work. If
     there is pending HTML in the buffers, it will be lost.
     """
+    deadline = kwargs.pop('deadline', None)
+    if kwargs:
+      raise TypeError('minify() got an unexpected keyword argument %r' %
+                      next(iter(kwargs)))
+    return self._minify(input, deadline)[0]
+
+  def _minify(self, input, deadline=None):
+    """Does the work of :meth:`minify`. Returns the result and whether the
+    deadline was exceeded, which the shared counters can't tell a caller when
+    several threads use the same instance."""
     self._parser.reset()
+    if self._instrumentation is not None:
+      self._instrumentation.reset()
+    marker = self._minified_marker
+    if marker or self._minifiable_res is not None:
+      html = ''.join(input)
+      if marker and html.endswith(marker):
+        self.counters['skipped_marker'] += 1
+        return self._skipped(html), False
+      if (self._minifiable_res is not None and
+          not any(r.search(html) for r in self._minifiable_res)):
+        self.counters['skipped_detected'] += 1
+        return self._skipped(html + marker), False
+    if deadline is not None and self._interruptible:
+      return self._minify_within(''.join(input), timer() + deadline)
     self.input(*input)
-    return self.finalize()
+    return self.finalize(), False
+
+  @property
+  def _interruptible(self):
+    """Whether minification can stop part way through a document, which
+    a ``deadline`` relies on. The fast engine can't."""
+    return not isinstance(self._parser, fast.FastMinParser)
+
+  def _minify_within(self, html, give_up):
+    for pos in range(0, len(html), DEADLINE_SLICE):
+      if timer() > give_up:
+        return self._give_up(html[pos:], len(html)), True
+      self.input(html[pos:pos + DEADLINE_SLICE])
+    if timer() > give_up:
+      return self._give_up('', len(html)), True
+    return self.finalize(), False
+
+  def _give_up(self, rest, bytes_in):
+    """Stops minifying part way through a document and returns the output
+    so far, then the input the parser has not processed yet and ``rest``."""
+    self.counters['deadline_exceeded'] += 1
+    result = self._parser.result + self._parser.rawdata + rest
+    self._parser.reset()
+    if self._instrumentation is not None:
+      stats = self._instrumentation.reset()
+      stats.bytes_in = bytes_in
+      stats.bytes_out += len(result)
+      self.last_stats = stats
+    return result
+
+  def _skipped(self, html):
+    if self._instrumentation is not None:
+      stats = self._instrumentation.reset()
+      stats.bytes_in = stats.bytes_out = len(html)
+      self.last_stats = stats
+    return html
+
+  def minify_fragments(self, fragments):
+    """Minifies many small, independent pieces of HTML.
+
+    :param fragments: An iterable of strings, each containing HTML.
+    :returns: A list with the minified HTML of each fragment, in order.
+
+    The result is the same as calling :meth:`minify` on each fragment, but
+    the per-call overhead is much lower, which matters for fragments of only a
+    few hundred bytes, such as rendered components. With ``minified_marker``,
+    ``detect_minified``, ``stats`` or ``verify_rate``, which apply to each
+    document, this does call :meth:`minify` on each fragment, so the
+    :attr:`counters` and :attr:`last_stats` end up the same too.
+    """
+    if (self._minified_marker or self._minifiable_res is not None or
+        self._instrumentation is not None or self._verify_rate):
+      return [self.minify(fragment) for fragment in fragments]
+    self._parser.reset()
+    results = self._parser._minify_fragments(fragments)
+    self._parser.reset()
+    return results
+
+  def minify_parallel(self, input, processes=None,
+                      segment_size=parallel.DEFAULT_SEGMENT_SIZE, pool=None):
+    """Minifies one large HTML document using several processes.
+
+    :param input: A string containing the HTML to be minified.
+    :param processes: The number of worker processes to start. Defaults to the
+      number of CPUs. Ignored if ``pool`` is given.
+    :param segment_size: The approximate size, in characters, of the pieces the
+      document is split into.
+    :param pool: An existing :class:`multiprocessing.Pool` to run on.
+    :returns: A string containing the minified HTML. It is always identical to
+      the result of :meth:`minify`.
+
+    See :func:`htmlmin.parallel.minify` for how the document is split. This
+    only pays off for documents that are several megabytes in size. The fast
+    engine can't resume from a split, so with it the document is minified in
+    this process.
+    """
+    if self._cls is fast.FastMinParser:
+      return self.minify(input)
+    return parallel.minify(input, processes=processes,
+                           segment_size=segment_size, pool=pool,
+                           cls=self._cls, **self._options)
+
+  def tokenize(self, *input):
+    """Tokenizes HTML without minifying it.
+
+    :param input: HTML to be tokenized. Multiple chunks of HTML can be
+      provided, and they are treated as if they were concatenated.
+    :returns: A :class:`htmlmin.tokens.TokenStream`.
+
+    Tokenizing is the first half of minification. The resulting stream can be
+    stored and later passed to :meth:`minify_tokens`, on this instance or on
+    any other ``Minifier`` with the same ``convert_charrefs`` setting, which
+    skips the tokenizer entirely.
+    """
+    return tokens.tokenize(''.join(input),
+                           convert_charrefs=self._parser.convert_charrefs)
+
+  def minify_tokens(self, stream):
+    """Minifies a token stream produced by :meth:`tokenize`.
+
+    :param stream: A :class:`htmlmin.tokens.TokenStream`.
+    :returns: A string containing the minified HTML.
+
+    Like :meth:`minify`, this resets the internal state of the parser first.
+    """
+    self._parser.reset()
+    instrumentation = self._instrumentation
+    if instrumentation is None:
+      tokens.replay(stream, self._parser)
+      self._parser.close()
+      result = self._parser.result
+    else:
+      instrumentation.reset()
+      start = timer()
+      tokens.replay(stream, self._parser)
+      self._parser.close()
+      instrumentation.stats.parse_time += timer() - start
+      instrumentation.stats.bytes_in = len(stream.source)
+      result = instrumentation.result()
+      instrumentation.stats.bytes_out = len(result)
+      self.last_stats = instrumentation.reset()
+    self._parser.reset()
+    return result
 
   def input(self, *input):
     """Feed more HTML into the input stream
@@ -170,8 +619,58 @@ class Minifier(object):
       concatenated. You can also call this method multiple times to achieve
       the same effect.
     """
+    feed = (self._parser.feed if self._instrumentation is None
+            else self._instrumentation.feed)
     for i in input:
-      self._parser.feed(i)
+      feed(i)
+
+  def snapshot(self):
+    """Captures the state of the minifier part way through a document.
+
+    :returns: An opaque, immutable snapshot to pass to :meth:`restore`.
+
+    Use this to minify a prefix shared by many documents, such as a common
+    layout, only once::
+
+      layout = Minifier()
+      layout.input(LAYOUT_HEAD)
+      snapshot = layout.snapshot()
+
+      def render(page_body):
+        minifier = Minifier()
+        minifier.restore(snapshot)
+        minifier.input(page_body)
+        return minifier.finalize()
+
+    The snapshot includes the output produced so far and any input that has
+    been fed but not yet processed, so ``render`` returns exactly what feeding
+    ``LAYOUT_HEAD`` and then ``page_body`` to :meth:`input` would. That isn't
+    always what minifying ``LAYOUT_HEAD + page_body`` in one go gives, since
+    whitespace at the end of one chunk is handled before the next arrives.
+    A snapshot can be restored any number of times, on any ``Minifier`` with
+    the same options, including from several threads at once.
+    """
+    return self._parser.snapshot()
+
+  def restore(self, snapshot):
+    """Resumes minification from a snapshot taken with :meth:`snapshot`.
+
+    Any state the minifier currently holds is discarded.
+    """
+    self._parser.restore(snapshot)
+
+  def flush(self):
+    """Returns the output generated since the last flush.
+
+    Use this to pass output on while input is still being fed in. Output that
+    has been flushed is no longer included in :attr:`output` or the result of
+    :meth:`finalize`. The fast engine only produces output in
+    :meth:`finalize`, so this always returns an empty string for it.
+    """
+    output = self._parser.flush()
+    if self._instrumentation is not None:
+      self._instrumentation.stats.bytes_out += len(output)
+    return output
 
   @property
   def output(self):
@@ -187,7 +686,34 @@ class Minifier(object):
     new HTML can be minified. Be sure to call this method before you reuse
     the ``Minifier`` instance on a new HTML document.
     """
-    self._parser.close()
-    result = self._parser.result
+    instrumentation = self._instrumentation
+    if instrumentation is None:
+      self._parser.close()
+      result = self._parser.result
+    else:
+      instrumentation.close()
+      result = instrumentation.result()
+    if self._verify_rate and random.random() < self._verify_rate:
+      result = self._verify(self._parser.source, result)
     self._parser.reset()
+    result += self._minified_marker
+    if instrumentation is not None:
+      instrumentation.stats.bytes_out += len(result)
+      self.last_stats = instrumentation.reset()
     return result
+
+  def _verify(self, input, result):
+    if self._full_parser is None:
+      self._full_parser = parser.HTMLMinParser(**self._options)
+    full_parser = self._full_parser
+    full_parser.feed(input)
+    full_parser.close()
+    expected = full_parser.result
+    full_parser.reset()
+
+    self.counters['verified'] += 1
+    if result == expected:
+      return result
+    self.counters['diverged'] += 1
+    self._on_divergence(input, result, expected)
+    return expected
@@ -0,0 +1,217 @@
+"""
+Copyright (c) 2013, Dave Mankoff
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Dave Mankoff nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL DAVE MANKOFF BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import unicode_literals
+import bisect
+import threading
+
+# Upper bounds, in seconds, of the minification time histogram buckets.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5)
+
+class Histogram(object):
+  """A histogram with fixed buckets, in the style of Prometheus."""
+
+  def __init__(self, buckets=DEFAULT_BUCKETS):
+    self.buckets = tuple(buckets)
+    self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+    self.sum = 0.0
+    self.count = 0
+
+  def observe(self, value):
+    self.counts[bisect.bisect_left(self.buckets, value)] += 1
+    self.sum += value
+    self.count += 1
+
+  def quantile(self, q):
+    """Estimates the ``q`` quantile, for ``0 <= q <= 1``, by interpolating
+    within the bucket it falls in, as Prometheus' ``histogram_quantile``
+    does. Returns None if nothing has been observed."""
+    if not self.count:
+      return None
+    rank = q * self.count
+    seen = 0
+    for i, count in enumerate(self.counts):
+      if count and seen + count >= rank:
+        if i == len(self.buckets):
+          return self.buckets[-1]
+        lower = self.buckets[i - 1] if i else 0.0
+        return lower + (self.buckets[i] - lower) * (rank - seen) / count
+      seen += count
+    return self.buckets[-1]
+
+class RouteMetrics(object):
+  def __init__(self, buckets):
+    self.minified = 0
+    self.cached = 0
+    self.deadline_exceeded = 0
+    self.skipped = {}
+    self.bytes_in = 0
+    self.bytes_out = 0
+    self.seconds = Histogram(buckets)
+
+def _escape_label(value):
+  return (value.replace('\\', '\\\\').replace('"', '\\"')
+          .replace('\n', '\\n'))
+
+class Metrics(object):
+  """Counters and minification time histograms, kept per route.
+
+  Safe to update from several threads at once.
+  """
+
+  def __init__(self, buckets=DEFAULT_BUCKETS):
+    self.buckets = buckets
+    self.routes = {}
+    self._lock = threading.Lock()
+
+  def _route(self, route):
+    metrics = self.routes.get(route)
+    if metrics is None:
+      metrics = self.routes[route] = RouteMetrics(self.buckets)
+    return metrics
+
+  def record_minified(self, route, bytes_in, bytes_out, seconds,
+                      deadline_exceeded=False):
+    with self._lock:
+      metrics = self._route(route)
+      metrics.minified += 1
+      if deadline_exceeded:
+        metrics.deadline_exceeded += 1
+      metrics.bytes_in += bytes_in
+      metrics.bytes_out += bytes_out
+      metrics.seconds.observe(seconds)
+
+  def record_cached(self, route):
+    with self._lock:
+      self._route(route).cached += 1
+
+  def record_skipped(self, route, reason):
+    with self._lock:
+      skipped = self._route(route).skipped
+      skipped[reason] = skipped.get(reason, 0) + 1
+
+  def snapshot(self):
+    """Returns the metrics as a dict, keyed by route::
+
+      {
+        '/': {
+          'minified': 10,            # responses minified
+          'cached': 5,               # responses served from the cache
+          'deadline_exceeded': 1,    # of those minified, how many only in part
+          'skipped': {'not_html': 3},  # responses passed through, by reason
+          'bytes_in': 10240,         # characters before minification
+          'bytes_out': 9216,         # characters after minification
+          'seconds': {               # time spent minifying
+            'count': 10, 'sum': 0.05, 'p50': 0.004, 'p90': 0.009,
+            'p99': 0.01,
+          },
+        },
+      }
+
+    The percentiles are estimated from the histogram buckets and are None
+    until something has been minified.
+    """
+    with self._lock:
+      return dict((route, {
+        'minified': metrics.minified,
+        'cached': metrics.cached,
+        'deadline_exceeded': metrics.deadline_exceeded,
+        'skipped': dict(metrics.skipped),
+        'bytes_in': metrics.bytes_in,
+        'bytes_out': metrics.bytes_out,
+        'seconds': {
+          'count': metrics.seconds.count,
+          'sum': metrics.seconds.sum,
+          'p50': metrics.seconds.quantile(0.5),
+          'p90': metrics.seconds.quantile(0.9),
+          'p99': metrics.seconds.quantile(0.99),
+        },
+      }) for route, metrics in self.routes.items())
+
+  def prometheus(self):
+    """Returns the metrics in the Prometheus text exposition format."""
+    lines = []
+    def family(name, kind, help):
+      lines.append('# HELP %s %s' % (name, help))
+      lines.append('# TYPE %s %s' % (name, kind))
+
+    with self._lock:
+      routes = sorted((_escape_label(route), metrics)
+                      for route, metrics in self.routes.items())
+
+      family('htmlmin_minified_total', 'counter', 'Responses minified.')
+      for route, metrics in routes:
+        lines.append('htmlmin_minified_total{route="%s"} %d' % (
+          route, metrics.minified))
+
+      family('htmlmin_cached_total', 'counter',
+             'Minified responses served from the cache.')
+      for route, metrics in routes:
+        lines.append('htmlmin_cached_total{route="%s"} %d' % (
+          route, metrics.cached))
+
+      family('htmlmin_deadline_exceeded_total', 'counter',
+             'Responses only minified in part, for lack of time.')
+      for route, metrics in routes:
+        lines.append('htmlmin_deadline_exceeded_total{route="%s"} %d' % (
+          route, metrics.deadline_exceeded))
+
+      family('htmlmin_skipped_total', 'counter',
+             'Responses passed through unminified, by reason.')
+      for route, metrics in routes:
+        for reason, count in sorted(metrics.skipped.items()):
+          lines.append('htmlmin_skipped_total{route="%s",reason="%s"} %d' % (
+            route, _escape_label(reason), count))
+
+      family('htmlmin_input_bytes_total', 'counter',
+             'Characters of HTML before minification.')
+      for route, metrics in routes:
+        lines.append('htmlmin_input_bytes_total{route="%s"} %d' % (
+          route, metrics.bytes_in))
+
+      family('htmlmin_output_bytes_total', 'counter',
+             'Characters of HTML after minification.')
+      for route, metrics in routes:
+        lines.append('htmlmin_output_bytes_total{route="%s"} %d' % (
+          route, metrics.bytes_out))
+
+      family('htmlmin_minify_seconds', 'histogram',
+             'Time spent minifying a response.')
+      for route, metrics in routes:
+        histogram = metrics.seconds
+        cumulative = 0
+        bounds = ['%r' % b for b in histogram.buckets] + ['+Inf']
+        for bound, count in zip(bounds, histogram.counts):
+          cumulative += count
+          lines.append('htmlmin_minify_seconds_bucket{route="%s",le="%s"} %d'
+                       % (route, bound, cumulative))
+        lines.append('htmlmin_minify_seconds_sum{route="%s"} %r' % (
+          route, histogram.sum))
+        lines.append('htmlmin_minify_seconds_count{route="%s"} %d' % (
+          route, histogram.count))
+    return '\n'.join(lines) + '\n'
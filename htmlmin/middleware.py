@@ -25,7 +25,15 @@ ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
 SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
+import hashlib
+import itertools
+import zlib
+
+from .cache import MinifiedCache
 from .main import Minifier
+from .metrics import Metrics
+from .policy import AdaptivePolicy
+from .stats import timer
 
 class HTMLMinMiddleware(object):
   """WSGI Middleware that minifies html on the way out.
@@ -41,52 +49,381 @@ class HTMLMinMiddleware(object):
     to ``True`` leaves the header in tact.
   :param debug: A quick setting to turn all minification off. The middleware
     is effectively bypassed.
+  :param route: A function that takes the WSGI environ and returns the route
+    to file metrics under, such as the name of the view. Keep the number of
+    distinct routes small. By default everything is filed under ``''``.
+  :param on_minify: Called after each response with a dict describing it:
+    ``route``, ``minified`` (a bool), ``cached`` (a bool), ``reason`` (why it
+    was skipped, or None), ``bytes_in``, ``bytes_out`` and ``seconds``.
+    ``bytes_in`` is None for responses served from the cache.
+  :param metrics_path: If set, requests for this path are answered with the
+    contents of :attr:`metrics` in the Prometheus text format instead of
+    being passed to the app.
+  :param gzip: Compress minified responses for clients that accept gzip.
+    Minified output is compressed as it is produced, while the app's
+    response is still being read, rather than after the whole response has
+    been minified. Responses that already have a ``Content-Encoding`` are
+    left alone. ``Vary: Accept-Encoding`` is added to every response that is
+    minified, since its encoding then depends on the request.
+  :param gzip_level: The zlib compression level, from 1 to 9.
+  :param etag: Give minified responses a strong ``ETag`` computed from the
+    minified output, replacing any the app set, and answer ``GET`` and
+    ``HEAD`` requests whose ``If-None-Match`` matches it with a ``304 Not
+    Modified``. The headers can only be sent once the whole response has been
+    minified, so this turns off streaming for ``gzip``.
+  :param cache_bytes: If set, minified responses that came with an ``ETag``
+    or ``Last-Modified`` header are kept in a
+    :class:`htmlmin.cache.MinifiedCache` of this size, available as
+    :attr:`cache`. When the app sends the same response again, with the
+    same validator for the same URL, the cached result is used and the body
+    the app returned is not read or minified.
+  :param min_size: Responses smaller than this are not minified.
+  :param max_size: Responses larger than this are not minified. Sizes are
+    taken from the ``Content-Length`` header. Buffered responses without one
+    are measured once they have been read, but streamed gzip responses are
+    not.
+  :param min_savings_per_ms: If set, an :class:`htmlmin.policy.AdaptivePolicy`
+    with this threshold, available as :attr:`policy`, turns minification off
+    for routes where it saves fewer characters per millisecond than this.
+  :param deadline: The most time, in seconds, to spend minifying a response.
+    Whatever is left of the response once it has run out is sent on as is.
+    See the ``deadline`` parameter of :meth:`htmlmin.Minifier.minify`.
+
+  Counters and minification time histograms are kept in :attr:`metrics`, a
+  :class:`htmlmin.metrics.Metrics`. Responses are skipped for one of these
+  reasons: ``not_html``, ``encoded`` (the response has a
+  ``Content-Encoding``), ``header`` (turned off by ``X-HTML-Min-Enable``),
+  ``off_by_default``, ``too_small``, ``too_large`` or ``policy`` (turned off
+  for the route by :attr:`policy`).
 
   This simple middleware minifies any HTML content that passes through it. Any
-  additional keyword arguments beyond the three settings the middleware has are
+  additional keyword arguments beyond the settings the middleware has are
   passed on to the internal minifier. The documentation for the options can
   be found under :class:`htmlmin.minify`.
   """
   def __init__(self, app, by_default=True, keep_header=False, 
-               debug=False, **kwargs):
+               debug=False, route=None, on_minify=None, metrics_path=None,
+               gzip=False, gzip_level=6, etag=False, cache_bytes=0,
+               min_size=0, max_size=None, min_savings_per_ms=None,
+               deadline=None, **kwargs):
     self.app = app
     self.by_default = by_default
     self.debug = debug
     self.keep_header = keep_header
+    self.route = route
+    self.on_minify = on_minify
+    self.metrics_path = metrics_path
+    self.gzip = gzip
+    self.gzip_level = gzip_level
+    self.etag = etag
+    self.min_size = min_size
+    self.max_size = max_size
+    self.deadline = deadline
+    self.policy = None
+    if min_savings_per_ms is not None:
+      self.policy = AdaptivePolicy(min_savings_per_ms)
+    self.metrics = Metrics()
     self.minifier = Minifier(**kwargs)
+    self._minifier_options = kwargs
+    self.cache = MinifiedCache(cache_bytes) if cache_bytes else None
+    self._options_key = repr(sorted(kwargs.items()) + [
+      ('gzip_level', gzip_level), ('etag', etag)])
     
   def __call__(self, environ, start_response):
     if self.debug:
       return self.app(environ, start_response)
+    if (self.metrics_path is not None and
+        environ.get('PATH_INFO') == self.metrics_path):
+      start_response('200 OK', [
+        ('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')])
+      text = self.metrics.prometheus()
+      if self.cache is not None:
+        text += self.cache.prometheus()
+      return [text]
 
-    should_minify = []  # need to use a mutable object so we can change it
-                        # in a different scope.
+    skip_reason = []  # need to use a mutable object so we can change it
+    use_gzip = []     # in a different scope.
+    deferred = []
+    validator = []
+    route = self.route(environ) if self.route is not None else ''
     def minified_start_response(status, headers, exc_info=None):
-      should_minify.append(self.should_minify(headers))
+      reason = self.skip_reason(headers)
+      if (reason is None and self.policy is not None and
+          not self.policy.should_minify(route)):
+        reason = 'policy'
+      skip_reason.append(reason)
+      if self.cache is not None and reason is None:
+        validator.extend(_validator(headers))
       if not self.keep_header:
         headers = [(header, value) for header, value in 
                    headers if header != 'X-HTML-Min-Enable']
-      start_response(status, headers, exc_info)
+      if (self.gzip and reason is None and
+          not any(header.lower() == 'content-encoding'
+                  for header, value in headers)):
+        headers = _add_vary(headers)
+        if _accepts_gzip(environ.get('HTTP_ACCEPT_ENCODING', '')):
+          headers = [(header, value) for header, value in headers
+                     if header.lower() != 'content-length']
+          headers.append(('Content-Encoding', 'gzip'))
+          use_gzip.append(True)
+      if self.etag and reason is None:
+        # Sent once the ETag is known.
+        deferred.append((status, headers, exc_info))
+      else:
+        start_response(status, headers, exc_info)
+
+    app_iter = self.app(environ, minified_start_response)
+    if self.gzip or self.cache is not None:
+      # The headers, and so whether to compress or look in the cache, may
+      # only be known once the app has produced its first chunk.
+      chunks = iter(app_iter)
+      first = list(itertools.islice(chunks, 1))
+      chunks = itertools.chain(first, chunks)
+    else:
+      chunks = app_iter
+
+    cache_key = None
+    if self.cache is not None and skip_reason[0] is None and validator:
+      path = environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')
+      cache_key = (path, environ.get('QUERY_STRING', ''), validator[0],
+                   bool(use_gzip), self._options_key)
+      cached = self.cache.get(cache_key)
+      if cached is not None:
+        if hasattr(app_iter, 'close'):
+          app_iter.close()
+        body, etag = cached
+        self.metrics.record_cached(route)
+        self._report(route, None, None, sum(len(i) for i in body), 0.0,
+                     cached=True)
+        if deferred:
+          return self._respond_with_etag(environ, start_response, deferred[0],
+                                         etag, body)
+        return body
+
+    if use_gzip:
+      digest = hashlib.sha1() if deferred else None
+      exceeded = [False]
+      body = self._gzip_response(route, chunks, app_iter, exceeded, digest)
+      if deferred:
+        # The gzip representation gets an ETag of its own.
+        body = list(body)
+        etag = '"%s-gzip"' % digest.hexdigest()
+        if cache_key is not None and not exceeded[0]:
+          self.cache.put(cache_key, (body, etag), sum(len(i) for i in body))
+        return self._respond_with_etag(environ, start_response, deferred[0],
+                                       etag, body)
+      if cache_key is not None:
+        return self._cache_while_streaming(cache_key, body, exceeded)
+      return body
 
-    html = [i for i in self.app(environ, minified_start_response)]
-    if should_minify[0]:
-      return [self.minifier.minify(*html)]
+    html = [i for i in chunks]
+    bytes_in = sum(len(i) for i in html)
+    if skip_reason[0] is None:
+      skip_reason[0] = self._size_reason(bytes_in)
+      if skip_reason[0] is not None and deferred:
+        start_response(*deferred.pop())
+    if skip_reason[0] is None:
+      start = timer()
+      result, exceeded = self.minifier._minify(html, self.deadline)
+      self._record_minified(route, bytes_in, len(result), timer() - start,
+                            exceeded)
+      etag = None
+      if deferred:
+        etag = '"%s"' % hashlib.sha1(result.encode('utf-8')).hexdigest()
+      # A response cut short by the deadline isn't worth keeping.
+      if cache_key is not None and not exceeded:
+        self.cache.put(cache_key, ([result], etag), len(result))
+      if deferred:
+        return self._respond_with_etag(environ, start_response, deferred[0],
+                                       etag, [result])
+      return [result]
+    self.metrics.record_skipped(route, skip_reason[0])
+    self._report(route, skip_reason[0], bytes_in, bytes_in, 0.0)
     return html
-  
+
+  def _cache_while_streaming(self, key, body, exceeded):
+    chunks = []
+    for chunk in body:
+      chunks.append(chunk)
+      yield chunk
+    if not exceeded[0]:
+      self.cache.put(key, (chunks, None), sum(len(i) for i in chunks))
+
+  def _respond_with_etag(self, environ, start_response, response, etag, body):
+    status, headers, exc_info = response
+    headers = [(header, value) for header, value in headers
+               if header.lower() != 'etag']
+    headers.append(('ETag', etag))
+    if (status.startswith('200') and
+        environ.get('REQUEST_METHOD', 'GET') in ('GET', 'HEAD') and
+        _etag_matches(environ.get('HTTP_IF_NONE_MATCH', ''), etag)):
+      headers = [(header, value) for header, value in headers
+                 if header.lower() in NOT_MODIFIED_HEADERS]
+      start_response('304 Not Modified', headers, exc_info)
+      return []
+    start_response(status, headers, exc_info)
+    return body
+
+  def _gzip_response(self, route, chunks, app_iter, exceeded, digest=None):
+    # Each response gets its own minifier, since the server may interleave
+    # iterating over several of them.
+    minifier = Minifier(**self._minifier_options)
+    compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED,
+                                  16 + zlib.MAX_WBITS)
+    bytes_in = bytes_out = 0
+    seconds = 0.0
+    # Input fed to the fast engine can't be given back part way through.
+    deadline = self.deadline if minifier._interruptible else None
+    try:
+      for chunk in chunks:
+        bytes_in += len(chunk)
+        if exceeded[0]:
+          output = chunk
+        elif deadline is not None and seconds > deadline:
+          exceeded[0] = True
+          output = minifier._give_up(chunk, bytes_in)
+        else:
+          start = timer()
+          minifier.input(chunk)
+          output = minifier.flush()
+          seconds += timer() - start
+        bytes_out += len(output)
+        output = output.encode('utf-8')
+        if digest is not None:
+          digest.update(output)
+        data = compressor.compress(output)
+        if data:
+          yield data
+      start = timer()
+      output = '' if exceeded[0] else minifier.finalize()
+      seconds += timer() - start
+      bytes_out += len(output)
+      output = output.encode('utf-8')
+      if digest is not None:
+        digest.update(output)
+      yield compressor.compress(output) + compressor.flush()
+    finally:
+      if hasattr(app_iter, 'close'):
+        app_iter.close()
+    self._record_minified(route, bytes_in, bytes_out, seconds, exceeded[0])
+
+  def _record_minified(self, route, bytes_in, bytes_out, seconds,
+                       deadline_exceeded=False):
+    self.metrics.record_minified(route, bytes_in, bytes_out, seconds,
+                                 deadline_exceeded)
+    if self.policy is not None:
+      self.policy.record(route, bytes_in, bytes_out, seconds)
+    self._report(route, None, bytes_in, bytes_out, seconds)
+
+  def _report(self, route, reason, bytes_in, bytes_out, seconds,
+              cached=False):
+    if self.on_minify is not None:
+      self.on_minify({
+        'route': route,
+        'minified': reason is None,
+        'cached': cached,
+        'reason': reason,
+        'bytes_in': bytes_in,
+        'bytes_out': bytes_out,
+        'seconds': seconds,
+      })
+
   def should_minify(self, headers):
+    return self.skip_reason(headers) is None
+
+  def skip_reason(self, headers):
+    """Returns why a response with ``headers`` should not be minified, or
+    None if it should be."""
     is_html = False
     flag_header = None
+    encoded = False
+    size = None
     for header, value in headers:
       if not is_html and header == 'Content-Type' and value == 'text/html':
         is_html = True
-        if flag_header is not None:
-          break
 
-      if flag_header is None and header == 'X-HTML-Min-Enable':
+      elif flag_header is None and header == 'X-HTML-Min-Enable':
         flag_header = (value.lower() == 'true')
-        if is_html:
+
+      else:
+        header = header.lower()
+        if header == 'content-encoding':
+          encoded = value.strip().lower() != 'identity'
+        elif header == 'content-length' and value.strip().isdigit():
+          size = int(value)
+
+    if not is_html:
+      return 'not_html'
+    if encoded:
+      return 'encoded'
+    if flag_header is False:
+      return 'header'
+    if not self.by_default and not flag_header:
+      return 'off_by_default'
+    if size is not None:
+      return self._size_reason(size)
+    return None
+
+  def _size_reason(self, size):
+    if size < self.min_size:
+      return 'too_small'
+    if self.max_size is not None and size > self.max_size:
+      return 'too_large'
+    return None
+
+# Headers a 304 response keeps from the 200 response it stands in for.
+# https://tools.ietf.org/html/rfc7232#section-4.1
+NOT_MODIFIED_HEADERS = ('cache-control', 'content-location', 'date', 'etag',
+                        'expires', 'vary')
+
+def _validator(headers):
+  """Returns the upstream ETag, or Last-Modified date, of a response in a
+  list, or an empty list if it has neither."""
+  last_modified = []
+  for header, value in headers:
+    header = header.lower()
+    if header == 'etag':
+      return [('etag', value)]
+    if header == 'last-modified':
+      last_modified = [('last-modified', value)]
+  return last_modified
+
+def _etag_matches(if_none_match, etag):
+  """Checks ``etag`` against an If-None-Match header using the weak
+  comparison that RFC 7232 requires for it."""
+  for candidate in if_none_match.split(','):
+    candidate = candidate.strip()
+    if candidate == '*':
+      return True
+    if candidate.startswith('W/'):
+      candidate = candidate[2:]
+    if candidate == etag:
+      return True
+  return False
+
+def _accepts_gzip(accept_encoding):
+  for coding in accept_encoding.split(','):
+    params = coding.split(';')
+    if params[0].strip().lower() not in ('gzip', '*'):
+      continue
+    for param in params[1:]:
+      name, _, value = param.partition('=')
+      if name.strip() == 'q':
+        try:
+          if float(value) == 0:
+            break
+        except ValueError:
           break
+    else:
+      return True
+  return False
 
-    return is_html and (
-      (self.by_default and flag_header != False) or 
-      (not self.by_default and flag_header))
+def _add_vary(headers):
+  headers = list(headers)
+  for i, (header, value) in enumerate(headers):
+    if header.lower() == 'vary':
+      if 'accept-encoding' not in value.lower() and value.strip() != '*':
+        headers[i] = (header, value + ', Accept-Encoding')
+      return headers
+  headers.append(('Vary', 'Accept-Encoding'))
+  return headers
@@ -0,0 +1,195 @@
+"""
+Copyright (c) 2013, Dave Mankoff
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Dave Mankoff nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL DAVE MANKOFF BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import unicode_literals
+import multiprocessing
+import re
+
+from . import parser
+from . import tokens
+
+DEFAULT_SEGMENT_SIZE = 1 << 20
+
+# Candidate split points: the start of a block level tag that follows
+# whitespace or another tag.
+SPLIT_RE = re.compile(
+  r'(?<=[\s>])<(?:address|article|aside|blockquote|div|dl|fieldset|figure|'
+  r'footer|form|h[1-6]|header|hr|main|nav|ol|p|section|table|ul)[\s/>]',
+  re.I)
+
+class _StructureParser(parser.HTMLMinParser):
+  """Tracks the tag stack and flags of HTMLMinParser without producing output.
+
+  build_tag only works out what the real one reports besides the tag itself:
+  whether the pre attribute is present and the language in effect.
+  """
+
+  def build_tag(self, tag, attrs, close_tag):
+    has_pre = False
+    lang = self._tag_lang()
+    for k, v in attrs:
+      pre_prefix = k.startswith(self._pre_attr_prefix)
+      if pre_prefix:
+        k = k[len(self._pre_attr_prefix):]
+      if k == self.pre_attr:
+        has_pre = True
+      elif k == 'lang':
+        lang = v if pre_prefix or not v else self._unescape_attr(v)
+    return has_pre, '', lang
+
+def _split_points(input, segment_size):
+  points = []
+  pos = segment_size
+  while pos < len(input):
+    match = SPLIT_RE.search(input, pos)
+    if not match:
+      break
+    points.append(match.start())
+    pos = match.start() + segment_size
+  return points
+
+def _scan_segment(args):
+  """Tokenizes a segment and returns the tokens that affect the tag stack.
+
+  Also reports whether the segment ends cleanly on a token boundary, outside
+  of script and style elements, which it will not if a split point turned out
+  to be inside a tag, comment or script.
+  """
+  segment, convert_charrefs = args
+  tokenizer = tokens.Tokenizer(convert_charrefs=convert_charrefs)
+  stream = tokenizer.stream = tokens.TokenStream(segment, convert_charrefs)
+  tokenizer.feed(segment)
+  clean = not tokenizer.rawdata and tokenizer.cdata_elem is None
+  tokenizer.close()
+
+  ops = []
+  tags = iter(stream.tags)
+  for kind, start, end in zip(stream.kinds, stream.starts, stream.ends):
+    if kind in (tokens.STARTTAG, tokens.STARTENDTAG, tokens.ENDTAG):
+      ops.append((kind, next(tags)))
+    elif kind == tokens.DECL:
+      ops.append((kind, (segment[start:end],)))
+  return ops, clean
+
+def _minify_segment(args):
+  cls, options, segment, state = args
+  minifier = cls(**options)
+  if state is not None:
+    minifier._set_state(state)
+  minifier.feed(segment)
+  minifier.close()
+  return minifier.result, minifier._get_state()
+
+def minify(input, processes=None, segment_size=DEFAULT_SEGMENT_SIZE, pool=None,
+           cls=parser.HTMLMinParser, **kwargs):
+  """Minifies one large HTML document using a pool of worker processes.
+
+  The document is split in front of block level tags (``<div>``,
+  ``<section>``, ``<table>`` and so on) roughly every ``segment_size``
+  characters. Minification happens in two parallel rounds:
+
+  1. Each segment is tokenized on its own. Only the start tags, end tags and
+     declarations are sent back, and those are run through the same tag stack
+     logic :class:`htmlmin.parser.HTMLMinParser` uses to work out the state at
+     the start of each segment. Split points that land inside a tag, script,
+     style, comment, pre tag, pre attribute region or the document head are
+     dropped.
+  2. Each segment is minified starting from that state.
+
+  Because every segment starts with a tag, whitespace collapsing never needs
+  to look across a seam. As a last check, the state at the end of each segment
+  is compared with the state the next segment started from; if they differ
+  (the title whitespace flags depend on text, which round 1 does not see),
+  that segment is minified again from the correct state. The result is
+  therefore always identical to :func:`htmlmin.minify`.
+
+  Takes the same keyword arguments as :func:`htmlmin.minify`. With
+  ``remove_optional_tags``, whether a tag at the end of a segment can be left
+  out depends on the start of the next, so the document is minified in one
+  piece. The same goes for ``remove_block_space``, which takes space off the
+  end of a segment when the next one starts with a block.
+  """
+  points = _split_points(input, segment_size)
+  if (not points or kwargs.get('remove_optional_tags') or
+      kwargs.get('remove_block_space')):
+    return _minify_segment((cls, kwargs, input, None))[0]
+
+  own_pool = pool is None
+  if own_pool:
+    pool = multiprocessing.Pool(processes)
+  try:
+    bounds = [0] + points + [len(input)]
+    segments = [input[bounds[i]:bounds[i + 1]] for i in range(len(points) + 1)]
+    convert_charrefs = kwargs.get('convert_charrefs', True)
+    scans = pool.map(_scan_segment,
+                     [(segment, convert_charrefs) for segment in segments])
+
+    # Work out the state at each split point and merge segments wherever it
+    # would not be safe to split.
+    structure = _StructureParser(**kwargs)
+    handlers = {
+      tokens.STARTTAG: structure.handle_starttag,
+      tokens.STARTENDTAG: structure.handle_startendtag,
+      tokens.ENDTAG: structure.handle_endtag,
+      tokens.DECL: structure.handle_decl,
+    }
+    merged = []
+    valid = True  # whether the current segment starts on a token boundary
+    for segment, (ops, clean) in zip(segments, scans):
+      if not merged:
+        merged.append([segment, None])
+      else:
+        state = structure._get_state()
+        in_pre_tag, in_head, in_title = state[1:4]
+        if not valid or in_pre_tag or in_head or in_title:
+          merged[-1][0] += segment
+        else:
+          merged.append([segment, state])
+      # Once a split point lands inside a tag, comment or script, the scans
+      # that follow it can't be trusted either.
+      if valid:
+        for kind, args in ops:
+          handlers[kind](*args)
+        valid = clean
+
+    results = pool.map(_minify_segment, [(cls, kwargs, segment, state)
+                                         for segment, state in merged])
+  finally:
+    if own_pool:
+      pool.close()
+      pool.join()
+
+  output = [results[0][0]]
+  end_state = results[0][1]
+  for (segment, state), (result, next_end_state) in zip(merged[1:],
+                                                        results[1:]):
+    if state != end_state:
+      result, next_end_state = _minify_segment(
+        (cls, kwargs, segment, end_state))
+    output.append(result)
+    end_state = next_end_state
+  return ''.join(output)
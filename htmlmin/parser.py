@@ -26,13 +26,19 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 from __future__ import unicode_literals
+import bisect
+import json
 import logging
 import sys
 
 import re
-from .python3html.parser import HTMLParser
+from .python3html import unescape
+from .python3html.parser import HTMLParser, interesting_normal
 
+from . import css
 from . import escape
+from . import svg
+from . import urls
 
 # https://www.w3.org/TR/html5/single-page.html#space-character
 HTML_SPACE_RE = re.compile('[\x20\x09\x0a\x0c\x0d]+')
@@ -43,6 +49,17 @@ HTML_TRAILING_SPACE_RE = re.compile(
   '[\x20\x09\x0a\x0c\x0d]+$')
 HTML_LEADING_TRAILING_SPACE_RE = re.compile(
   '(^[\x20\x09\x0a\x0c\x0d]+)|([\x20\x09\x0a\x0c\x0d]+$)')
+# Empty space that contains a newline or carriage return.
+HTML_NEWLINE_SPACE_RE = re.compile(
+  '^[\x20\x09\x0c]*[\x0a\x0d][\x20\x09\x0a\x0c\x0d]*$')
+# Comments that survive remove_comments: <!--! ... --> and conditional comments.
+KEEP_COMMENT_RE = re.compile(r'^(?:!|\[if\s)')
+# A JSON string or a run of anything else other than space. Joining all the
+# matches in a JSON text takes out the space between tokens.
+JSON_TOKEN_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[^\x20\x09\x0a\x0d"]+')
+# Placeholders for option-specialised matchers, see HTMLMinParser.__init__.
+ALWAYS_MATCH_RE = re.compile('')
+NEVER_MATCH_RE = re.compile('(?!)')
 
 PRE_TAGS = ('pre', 'textarea')  # styles and scripts are never minified
 # http://www.w3.org/TR/html51/syntax.html#elements-0
@@ -74,6 +91,56 @@ BOOLEAN_ATTRIBUTES = {
   'video': ('autoplay', 'controls', 'hidden', 'loop', 'muted',),
   '*': ('hidden',),
 }
+BOOLEAN_ATTRIBUTE_SETS = dict(
+  (tag, frozenset(attrs)) for tag, attrs in BOOLEAN_ATTRIBUTES.items())
+
+# Script types whose content is JSON, besides any MIME type ending in +json.
+# https://mimesniff.spec.whatwg.org/#json-mime-type
+JSON_SCRIPT_TYPES = ('application/json', 'text/json', 'importmap',
+                     'speculationrules')
+# https://mimesniff.spec.whatwg.org/#javascript-mime-type
+JAVASCRIPT_MIME_TYPES = (
+  'application/ecmascript', 'application/javascript',
+  'application/x-ecmascript', 'application/x-javascript', 'text/ecmascript',
+  'text/javascript', 'text/javascript1.0', 'text/javascript1.1',
+  'text/javascript1.2', 'text/javascript1.3', 'text/javascript1.4',
+  'text/javascript1.5', 'text/jscript', 'text/livescript',
+  'text/x-ecmascript', 'text/x-javascript')
+# Attribute values that are the same as leaving the attribute out, compared
+# in lower case and without surrounding space. The language attribute of a
+# script only counts if it has no type, and then stands for 'text/' + value.
+# https://html.spec.whatwg.org/multipage/indices.html#attributes-3
+REDUNDANT_ATTRIBUTES = {
+  'area': {'shape': ('rect',)},
+  'button': {'type': ('submit',)},
+  'col': {'span': ('1',)},
+  'colgroup': {'span': ('1',)},
+  'form': {'autocomplete': ('on',),
+           'enctype': ('application/x-www-form-urlencoded',),
+           'method': ('get',)},
+  'input': {'type': ('text',)},
+  'link': {'media': ('all',), 'type': ('text/css',)},
+  'script': {'language': tuple(t[len('text/'):] for t in JAVASCRIPT_MIME_TYPES
+                               if t.startswith('text/')),
+             'type': ('',) + JAVASCRIPT_MIME_TYPES},
+  'style': {'media': ('all',), 'type': ('', 'text/css')},
+  'td': {'colspan': ('1',), 'rowspan': ('1',)},
+  'textarea': {'wrap': ('soft',)},
+  'th': {'colspan': ('1',), 'rowspan': ('1',)},
+  'track': {'kind': ('subtitles',)},
+  '*': {'class': ('',), 'id': ('',), 'style': ('',)},
+}
+def _redundant_attribute_sets():
+  default = dict((attr, frozenset(values)) for attr, values
+                 in REDUNDANT_ATTRIBUTES['*'].items())
+  sets = {'*': default}
+  for tag, attrs in REDUNDANT_ATTRIBUTES.items():
+    if tag != '*':
+      sets[tag] = dict(default)
+      sets[tag].update((attr, frozenset(values))
+                       for attr, values in attrs.items())
+  return sets
+REDUNDANT_ATTRIBUTE_SETS = _redundant_attribute_sets()
 
 # a list of tags and tags that they are closed by
 TAG_SETS = {
@@ -97,8 +164,147 @@ TAG_SETS['rt'] = TAG_SETS['rp']
 TAG_SETS['thead'] = TAG_SETS['tbody']
 TAG_SETS['th'] = TAG_SETS['td']
 
+def _invert_tag_sets():
+  closes_any = tuple(t for t, closers in TAG_SETS.items() if closers == '*')
+  closes = {}
+  for tag, closers in TAG_SETS.items():
+    if closers != '*':
+      for closer in closers:
+        closes[closer] = closes.get(closer, closes_any) + (tag,)
+  return closes, closes_any
+
+# The open tags that the start of each tag closes; TAG_SETS turned around.
+CLOSES, CLOSES_ANY = _invert_tag_sets()
+# Tags that only an html end tag can close out.
+BARRIER_TAGS = ('body', 'html', 'head')
+
+# Layout rules for remove_block_space. These assume that elements keep the
+# display they have by default.
+#
+# Elements that are laid out as blocks, list items or table parts. Space
+# next to their start and end tags falls at the start or end of a line,
+# where it isn't rendered, and so does space next to a br. The html, head
+# and body tags are left out, since stray ones are ignored.
+BLOCK_TAGS = frozenset((
+  'address', 'article', 'aside', 'blockquote', 'br', 'caption', 'center',
+  'dd', 'details', 'dialog', 'dir', 'div', 'dl', 'dt', 'fieldset',
+  'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5',
+  'h6', 'header', 'hgroup', 'hr', 'legend', 'li', 'main', 'menu', 'nav', 'ol',
+  'p', 'pre', 'search', 'section', 'summary', 'table', 'tbody', 'td', 'tfoot',
+  'th', 'thead', 'tr', 'ul',
+))
+# Block tags that the HTML parser ignores outside of a table.
+TABLE_PART_TAGS = frozenset(('caption', 'tbody', 'td', 'tfoot', 'th', 'thead',
+                             'tr'))
+# Elements whose children, if they are only space, aren't rendered at all.
+SPACE_IGNORING_TAGS = frozenset((
+  'colgroup', 'datalist', 'head', 'html', 'optgroup', 'select', 'table',
+  'tbody', 'tfoot', 'thead', 'tr',
+))
+
+# The order canonicalize_attributes puts attributes in, roughly from the most
+# to the least common on the web. Attributes that aren't listed follow in
+# alphabetical order.
+ATTRIBUTE_ORDER = (
+  'class', 'id', 'href', 'src', 'type', 'name', 'value', 'rel', 'content',
+  'title', 'alt', 'width', 'height', 'style', 'role', 'for', 'action',
+  'method', 'target', 'lang', 'dir', 'charset', 'media', 'property',
+  'placeholder', 'tabindex', 'srcset', 'sizes', 'loading', 'async', 'defer',
+  'crossorigin', 'integrity', 'disabled', 'checked', 'selected', 'hidden',
+)
+ATTRIBUTE_RANKS = dict((attr, i) for i, attr in enumerate(ATTRIBUTE_ORDER))
+
+def _attribute_sort_key(attr):
+  return (ATTRIBUTE_RANKS.get(attr[0], len(ATTRIBUTE_ORDER)), attr[0])
+
+def _normalize_class(value):
+  names = []
+  seen = set()
+  for name in HTML_SPACE_RE.split(value):
+    if name and name not in seen:
+      seen.add(name)
+      names.append(name)
+  return names
+
 # Tag omission rules:
 # http://www.w3.org/TR/html51/syntax.html#optional-tags
+# https://html.spec.whatwg.org/multipage/syntax.html#optional-tags
+
+# End tags that can be left out when they are followed by the start of one of
+# the given tags or, where the flag is set, by the end of the parent element.
+OPTIONAL_END_TAGS = {
+  'li': (('li',), True),
+  'dt': (('dt', 'dd'), False),
+  'dd': (('dt', 'dd'), True),
+  'p': (('address', 'article', 'aside', 'blockquote', 'details', 'dialog',
+         'div', 'dl', 'fieldset', 'figcaption', 'figure', 'footer', 'form',
+         'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hgroup', 'hr', 'main',
+         'menu', 'nav', 'ol', 'p', 'pre', 'search', 'section', 'table', 'ul'),
+        True),
+  'rt': (('rt', 'rp'), True),
+  'rp': (('rt', 'rp'), True),
+  'optgroup': (('optgroup', 'hr'), True),
+  'option': (('option', 'optgroup', 'hr'), True),
+  'thead': (('tbody', 'tfoot'), False),
+  'tbody': (('tbody', 'tfoot'), True),
+  'tfoot': ((), True),
+  'tr': (('tr',), True),
+  'td': (('td', 'th'), True),
+  'th': (('td', 'th'), True),
+}
+# End tags that can be left out unless they are followed by a comment or,
+# where the flag is set, by space.
+OPTIONAL_END_TAGS_UNLESS_FOLLOWED = {
+  'html': False,
+  'body': False,
+  'head': True,
+  'colgroup': True,
+  'caption': True,
+}
+# Elements a p element's end tag can't be left out at the end of.
+P_END_TAG_PARENTS = ('a', 'audio', 'del', 'ins', 'map', 'noscript', 'video')
+# Start tags that can be left out when they have no attributes.
+OPTIONAL_START_TAGS = ('html', 'head', 'body', 'tbody')
+# Elements that need the body start tag in front of them.
+BODY_START_TAG_KEEPERS = ('link', 'meta', 'noscript', 'script', 'style',
+                          'template')
+
+def _may_omit_end_tag(tag, parent, kind, next_tag):
+  """Returns whether the end tag of ``tag``, inside ``parent``, can be left
+  out in front of a token of ``kind``. See HTMLMinParser._resolve_pending."""
+  if tag in OPTIONAL_END_TAGS_UNLESS_FOLLOWED:
+    if kind == 'comment' or (
+        kind == 'space' and OPTIONAL_END_TAGS_UNLESS_FOLLOWED[tag]):
+      return False
+    if kind == 'text' and (tag == 'caption' or tag == 'colgroup'):
+      # The text would end up inside the element.
+      return False
+    # The input may be a fragment of a larger document, so only the end of
+    # the document itself is taken to be the end.
+    return kind is not None or tag == 'html' or tag == 'body'
+  followers, at_parent_end = OPTIONAL_END_TAGS[tag]
+  if kind == 'start':
+    return next_tag in followers
+  if kind == 'end' and at_parent_end and next_tag == parent:
+    return tag != 'p' or (parent not in P_END_TAG_PARENTS and
+                          '-' not in parent)
+  return False
+
+def _may_omit_start_tag(tag, omitted, kind, next_tag):
+  """Returns whether the start tag of ``tag``, which follows the left out
+  end tag ``omitted``, if any, can be left out in front of a token of
+  ``kind``."""
+  if tag == 'html':
+    # Space that follows might come before a comment.
+    return kind is not None and kind != 'comment' and kind != 'space'
+  if tag == 'head':
+    return kind == 'start' or (kind == 'end' and next_tag == 'head')
+  if tag == 'body':
+    if kind == 'start':
+      return next_tag not in BODY_START_TAG_KEEPERS
+    return kind == 'text' or (kind == 'end' and next_tag == 'body')
+  return (kind == 'start' and next_tag == 'tr' and
+          omitted not in ('tbody', 'thead', 'tfoot'))
 
 class HTMLMinError(Exception): pass
 class ParseError(HTMLMinError): pass
@@ -115,7 +321,19 @@ class HTMLMinParser(HTMLParser):
                convert_charrefs=True,
                keep_pre=False,
                pre_tags=PRE_TAGS,
-               pre_attr='pre'):
+               pre_attr='pre',
+               remove_optional_tags=False,
+               remove_redundant_attributes=False,
+               canonicalize_attributes=False,
+               sort_class_names=False,
+               minify_json=False,
+               minify_css=False,
+               minify_svg=False,
+               svg_precision=3,
+               base_url=None,
+               shorten_charrefs=False,
+               output_encoding='utf-8',
+               remove_block_space=False):
     if sys.version_info[0] >= 3 and sys.version_info[1] >= 4:
       # convert_charrefs is True by default in Python 3.5.0 and newer. It was
       # introduced in 3.4.
@@ -132,42 +350,187 @@ class HTMLMinParser(HTMLParser):
     self.remove_optional_attribute_quotes = remove_optional_attribute_quotes
     self.convert_charrefs = convert_charrefs
     self.pre_attr = pre_attr
+    self.remove_optional_tags = remove_optional_tags
+    self.remove_redundant_attributes = remove_redundant_attributes
+    self.canonicalize_attributes = canonicalize_attributes
+    self.sort_class_names = sort_class_names
+    self.minify_json = minify_json
+    self.minify_css = minify_css
+    self.minify_svg = minify_svg
+    self.svg_precision = svg_precision
+    self.base_url = base_url
+    self.shorten_charrefs = shorten_charrefs
+    self.output_encoding = output_encoding
+    self.remove_block_space = remove_block_space
+
+    # Options never change after construction, so resolve them here into
+    # lookup tables and matchers. This keeps option tests out of the per-token
+    # handlers below.
+    self._pre_attr_prefix = pre_attr + '-'
+    if reduce_boolean_attributes:
+      self._boolean_attributes = BOOLEAN_ATTRIBUTE_SETS
+      self._default_boolean_attributes = BOOLEAN_ATTRIBUTE_SETS['*']
+    else:
+      self._boolean_attributes = {}
+      self._default_boolean_attributes = frozenset()
+    if remove_redundant_attributes:
+      self._redundant_attributes = REDUNDANT_ATTRIBUTE_SETS
+      self._default_redundant_attributes = REDUNDANT_ATTRIBUTE_SETS['*']
+    else:
+      self._redundant_attributes = {}
+      self._default_redundant_attributes = {}
+    self._unescape_attr = unescape if convert_charrefs else self.unescape
+    self._double_quote_attrs = not remove_optional_attribute_quotes
+    self._canonicalize_class = canonicalize_attributes or sort_class_names
+    self._url_attributes = urls.URL_ATTRIBUTE_SETS if base_url else {}
+    if remove_block_space:
+      self._block_tags = BLOCK_TAGS
+      self._space_ignoring_tags = SPACE_IGNORING_TAGS
+    else:
+      self._block_tags = self._space_ignoring_tags = frozenset()
+    self._keep_comment = (KEEP_COMMENT_RE if remove_comments
+                          else ALWAYS_MATCH_RE).match
+    if remove_all_empty_space:
+      self._empty_space_re = HTML_ALL_SPACE_RE
+    elif remove_empty_space:
+      self._empty_space_re = HTML_NEWLINE_SPACE_RE
+    else:
+      self._empty_space_re = NEVER_MATCH_RE
+    if remove_optional_tags:
+      self._optional_end_tags = frozenset(
+        list(OPTIONAL_END_TAGS) + list(OPTIONAL_END_TAGS_UNLESS_FOLLOWED))
+      self._optional_start_tags = frozenset(OPTIONAL_START_TAGS)
+    else:
+      self._optional_end_tags = self._optional_start_tags = frozenset()
     self.reset()
 
   def _tag_lang(self):
-    return self._tag_stack[0][2] if self._tag_stack else None
+    return self._tag_stack[-1][2] if self._tag_stack else None
+
+  # The tag stack holds (tag, start_pre, lang) for each open tag, innermost
+  # last. _tag_positions maps each tag to where it is open in the stack, so
+  # that finding the innermost open element of a tag doesn't mean walking
+  # the stack, which can be as deep as the document is long.
+
+  def _push_tag(self, entry):
+    self._tag_positions.setdefault(entry[0], []).append(len(self._tag_stack))
+    self._tag_stack.append(entry)
+
+  def _truncate_tags(self, i):
+    """Closes every tag from position ``i`` of the stack inwards."""
+    positions = self._tag_positions
+    for t in self._tag_stack[i:]:
+      positions[t[0]].pop()
+    del self._tag_stack[i:]
+
+  def _remove_tag(self, i):
+    """Closes only the tag at position ``i`` of the stack."""
+    stack = self._tag_stack
+    positions = self._tag_positions
+    tag_positions = positions[stack.pop(i)[0]]
+    del tag_positions[bisect.bisect_left(tag_positions, i)]
+    for j in range(i, len(stack)):
+      tag_positions = positions[stack[j][0]]
+      tag_positions[bisect.bisect_left(tag_positions, j + 1)] = j
+
+  def _innermost(self, tags):
+    """Returns the stack position of the innermost of ``tags``, or -1."""
+    innermost = -1
+    positions = self._tag_positions
+    for tag in tags:
+      tag_positions = positions.get(tag)
+      if tag_positions and tag_positions[-1] > innermost:
+        innermost = tag_positions[-1]
+    return innermost
+
+  # With remove_optional_tags, a tag that might be left out is held back in
+  # _pending as (kind, tag, context) until the next token that produces
+  # output shows whether it can be. It is already in the output buffer, as
+  # the last chunk, so that it is kept if the document stops there.
+
+  def _resolve_pending(self, kind, tag=None):
+    """Drops the held back tag if a token of ``kind`` can follow without it.
+
+    ``kind`` is 'start' or 'end' for tags named ``tag``, 'text', 'space' for
+    text that might start with space, 'comment' for comments and anything
+    else that isn't text or a tag, and None for the end of the document.
+    Returns the tag that was left out, if any.
+    """
+    pending_kind, pending_tag, context = self._pending
+    self._pending = None
+    if pending_kind == 'end':
+      omit = _may_omit_end_tag(pending_tag, context, kind, tag)
+    else:
+      omit = _may_omit_start_tag(pending_tag, context, kind, tag)
+    if omit:
+      self._data_buffer.pop()
+      return pending_tag
+    return None
 
   def build_tag(self, tag, attrs, close_tag):
     has_pre = False
+    bool_attrs = self._boolean_attributes.get(
+      tag, self._default_boolean_attributes)
+    redundant = self._redundant_attributes.get(
+      tag, self._default_redundant_attributes)
+    if tag == 'script' and redundant and self._keeps_language(attrs):
+      # Browsers only look at language when there is no type, so a type
+      # has to stay with a language that does.
+      redundant = dict(redundant)
+      del redundant['type']
+    url_attrs = self._url_attributes.get(tag, ())
+    pre_attr = self.pre_attr
+    pre_attr_prefix = self._pre_attr_prefix
+    double_quote = self._double_quote_attrs
 
-    if self.reduce_boolean_attributes:
-      bool_attrs = BOOLEAN_ATTRIBUTES.get(tag, BOOLEAN_ATTRIBUTES['*'])
+    lang = parent_lang = self._tag_lang()
+    if self.canonicalize_attributes:
+      # Python's sort is stable, so where an attribute is repeated, the first
+      # one, which is the only one that counts, stays first. The rest go.
+      attrs = sorted(attrs, key=_attribute_sort_key)
+      attrs = [a for i, a in enumerate(attrs)
+               if not i or a[0] != attrs[i - 1][0]]
     else:
-      bool_attrs = False
-
-    lang = self._tag_lang()
-    attrs = list(attrs)  # We're modifying it in place
+      attrs = list(attrs)  # We're modifying it in place
     last_quoted = last_no_slash = i = -1
     for k, v in attrs:
-      pre_prefix = k.startswith("{}-".format(self.pre_attr))
+      pre_prefix = k.startswith(pre_attr_prefix)
       if pre_prefix:
-        k = k[len(self.pre_attr)+1:]
-      if k == self.pre_attr:
+        k = k[len(pre_attr_prefix):]
+      if k == pre_attr:
         has_pre = True
         if not self.keep_pre and not pre_prefix:
           continue
-      if v and self.convert_charrefs and not pre_prefix:
-        v = HTMLParser.unescape(self, v)
+      if v and not pre_prefix:
+        v = self._unescape_attr(v)
+        if k == 'class' and self._canonicalize_class:
+          names = _normalize_class(v)
+          if self.sort_class_names:
+            names.sort()
+          v = ' '.join(names)
+        elif (k == 'style' and self.minify_css and
+              (self.convert_charrefs or '&' not in v)):
+          # Unconverted charrefs could hide quotes from the CSS minifier.
+          v = css.cached_minify(v, True)
+        elif k in url_attrs and (self.convert_charrefs or '&' not in v):
+          base = self._url_base or self.base_url
+          if k == 'srcset':
+            v = urls.shorten_srcset(v, base)
+          else:
+            v = urls.shorten(v, base)
+      if (k in redundant and not pre_prefix and
+          (v or '').strip(' \t\n\x0c\r').lower() in redundant[k]):
+        continue
       if k == 'lang':
         lang = v
-        if v == self._tag_lang():
+        if v == parent_lang:
           continue
 
       i += 1
       if not pre_prefix:
         k = escape.escape_attr_name(k)
       if (v is None or (not v and self.reduce_empty_attributes) or
-          (bool_attrs and k in bool_attrs)):
+          k in bool_attrs):
         # For our use case, we treat boolean attributes as quoted because they
         # don't require space between them and "/>" in closing tags.
         attrs[i] = k
@@ -185,11 +548,9 @@ class HTMLMinParser(HTMLParser):
             q = escape.SINGLE_QUOTES
           else:
             logging.error('Unsafe content found in pre-attribute. Escaping.')
-            (v, q) = escape.escape_attr_value(
-              v, double_quote=not self.remove_optional_attribute_quotes)
+            (v, q) = escape.escape_attr_value(v, double_quote=double_quote)
         else:
-          (v, q) = escape.escape_attr_value(
-            v, double_quote=not self.remove_optional_attribute_quotes)
+          (v, q) = escape.escape_attr_value(v, double_quote=double_quote)
         if q == escape.NO_QUOTES:
           attrs[i] = '%s=%s' % (k, v)
           if v[-1] != '/':
@@ -232,32 +593,124 @@ class HTMLMinParser(HTMLParser):
                                       space_maybe,
                                       '/' if close_tag else ''), lang
 
+  def _keeps_language(self, attrs):
+    """Returns whether remove_redundant_attributes leaves the language
+    attribute of a script with ``attrs`` in."""
+    for k, v in attrs:
+      if k == 'language':
+        v = self._unescape_attr(v) if v else ''
+        return (v.strip(' \t\n\x0c\r').lower() not in
+                REDUNDANT_ATTRIBUTE_SETS['script']['language'])
+    return False
+
+  def _is_json_script(self, attrs):
+    """Returns whether a script with ``attrs`` holds JSON."""
+    for k, v in attrs:
+      if k == 'type':
+        if not v:
+          return False
+        mime_type = self._unescape_attr(v).split(';')[0]
+        mime_type = mime_type.strip(' \t\n\x0c\r').lower()
+        return (mime_type in JSON_SCRIPT_TYPES or
+                mime_type.endswith('+json'))
+    return False
+
+  def _compact_json(self, text):
+    """Takes the space between tokens out of JSON text. Text that isn't
+    valid JSON is returned as is.
+
+    Strings and numbers are copied over character for character, so nothing
+    that could end the script early, such as ``</script``, can appear that
+    wasn't there already.
+    """
+    try:
+      json.loads(text)
+    except (ValueError, RuntimeError):
+      # RuntimeError covers nesting too deep to parse.
+      return text
+    return ''.join(JSON_TOKEN_RE.findall(text))
+
+  def _set_url_base(self, attrs):
+    """Takes the URLs that base_url shortens to be relative to the href of
+    a base element, if it has one, from then on."""
+    for k, v in attrs:
+      if k == 'href':
+        # Only the first base element with an href counts.
+        self._base_seen = True
+        self._url_base = urls.urljoin(
+          self.base_url, unescape(v or '').strip(' \t\n\x0c\r'))
+        return
+
+  def _svg_starttag(self, tag, attrs):
+    """Returns the attributes of a start tag inside an svg element with
+    their numbers compacted and those of drawing editors left out, or None
+    if the element is to be left out along with its content."""
+    if any(k == self.pre_attr for k, v in attrs):
+      return attrs
+    if tag in svg.DROPPED_ELEMENTS or svg.is_editor_name(tag):
+      return None
+    precision = self.svg_precision
+    result = []
+    for k, v in attrs:
+      if svg.is_editor_name(k):
+        continue
+      if v and '&' not in v:
+        if k in svg.PATH_ATTRIBUTES:
+          v = svg.compact_path(v, precision)
+        elif k in svg.NUMBER_LIST_ATTRIBUTES:
+          v = svg.compact_numbers(v, precision)
+        elif k in svg.TRANSFORM_ATTRIBUTES:
+          v = svg.compact_transform(v, precision)
+      result.append((k, v))
+    return result
+
   def handle_decl(self, decl):
-    if (len(self._data_buffer) == 1 and 
-        HTML_SPACE_RE.match(self._data_buffer[0][0])):
+    if self._svg_drop >= 0:
+      return
+    if self._pending is not None:
+      self._resolve_pending('comment')
+    if (len(self._data_buffer) == 1 and
+        HTML_SPACE_RE.match(self._data_buffer[0])):
       self._data_buffer = []
     self._data_buffer.append('<!' + decl + '>')
     self._after_doctype = True
 
   def _close_tags_up_to(self, tag):
+    # If the tag isn't open at all, everything is closed.
+    positions = self._tag_positions
+    tag_positions = positions.get(tag)
+    i = tag_positions[-1] if tag_positions else -1
+    # Only the html tag can close out everything. Put on the brakes if
+    # we encounter a closing tag that we didn't recognize.
+    if tag != 'html':
+      barrier = self._innermost(BARRIER_TAGS)
+      if barrier > i or (barrier >= 0 and i < 0):
+        raise OpenTagNotFoundError()
+    i = max(i, 0)
+
     num_pres = 0
-    i = 0
-    for i, t in enumerate(self._tag_stack):
+    stack = self._tag_stack
+    for j in range(i, len(stack)):
+      t = stack[j]
+      positions[t[0]].pop()
       if t[1]:
         num_pres += 1
-      if t[0] == tag:
-        break
-
-      # Only the html tag can close out everything. Put on the brakes if
-      # we encounter a closing tag that we didn't recognize.
-      if tag != 'html' and t[0] in ('body', 'html', 'head'):
-        raise OpenTagNotFoundError()
-
-    self._tag_stack = self._tag_stack[i+1:]
+    del stack[i:]
 
     return num_pres
 
   def handle_starttag(self, tag, attrs):
+    if self._svg_drop >= 0:
+      self._push_tag((tag, False, self._tag_lang()))
+      return
+    omitted = None
+    if self._pending is not None:
+      omitted = self._resolve_pending('start', tag)
+    if tag in self._block_tags:
+      self._block_boundary(tag in TABLE_PART_TAGS and
+                           self._innermost(('table',)) < 0)
+    else:
+      self._after_block = False
     self._after_doctype = False
     if tag == 'head':
       self._in_head = True
@@ -265,36 +718,75 @@ class HTMLMinParser(HTMLParser):
       self._in_title = True
       self._title_newly_opened = True
 
-    for t in self._tag_stack:
-      closed_by_tags = TAG_SETS.get(t[0])
-      if closed_by_tags and (closed_by_tags == '*' or tag in closed_by_tags):
-        self._in_pre_tag -= self._close_tags_up_to(t[0])
-        break
+    closed = self._innermost(CLOSES.get(tag, CLOSES_ANY))
+    if closed >= 0:
+      try:
+        self._in_pre_tag -= self._close_tags_up_to(self._tag_stack[closed][0])
+      except OpenTagNotFoundError:
+        # The element would be closed from outside the body, html or head
+        # element it was opened in. Leave it open.
+        pass
+
+    if (self.minify_svg and not self._in_pre_tag and
+        (tag == 'svg' or self._innermost(('svg',)) >= 0)):
+      attrs = self._svg_starttag(tag, attrs)
+      if attrs is None:
+        self._svg_drop = len(self._tag_stack)
+        self._push_tag((tag, False, self._tag_lang()))
+        return
+    if tag == 'base' and self.base_url and not self._base_seen:
+      self._set_url_base(attrs)
 
     has_pre, data, lang = self.build_tag(tag, attrs, False)
+    if tag == 'script' and self.minify_json:
+      self._json_script = (not has_pre and not self._in_pre_tag and
+                           self._is_json_script(attrs))
+    elif tag == 'style' and self.minify_css:
+      self._css_style = not has_pre and not self._in_pre_tag
     start_pre = False
     if (has_pre or self._in_pre_tag > 0 or
         tag == 'script' or tag == 'style' or tag in self.pre_tags):
       self._in_pre_tag += 1
       start_pre = True
 
-    self._tag_stack.insert(0, (tag, start_pre, lang))
+    self._push_tag((tag, start_pre, lang))
     self._data_buffer.append(data)
+    if (tag in self._optional_start_tags and not self._in_pre_tag and
+        data == '<%s>' % tag):
+      self._pending = ('start', tag, omitted)
 
   def handle_endtag(self, tag):
+    if self._svg_drop >= 0:
+      tag_positions = self._tag_positions.get(tag)
+      i = tag_positions[-1] if tag_positions else -1
+      if i >= self._svg_drop:
+        self._truncate_tags(i)
+        if i == self._svg_drop:
+          self._svg_drop = -1
+        return
+      if i < 0:
+        return
+      # An element outside the one being dropped is closing, and closes it.
+      self._svg_drop = -1
+    if self._pending is not None:
+      self._resolve_pending('end', tag)
+    if tag in self._block_tags:
+      # A stray end tag is ignored, apart from these two.
+      self._block_boundary(
+        (not self._tag_positions.get(tag) and tag != 'p' and tag != 'br') or
+        (tag in TABLE_PART_TAGS and self._innermost(('table',)) < 0))
+    else:
+      self._after_block = False
+    self._json_script = self._css_style = False
     # According to the spec, <p> tags don't get closed when a parent a
     # tag closes them. Here's some logic that addresses this.
     if tag == 'a':
-      contains_p = False
-      for i, t in enumerate(self._tag_stack):
-        if t[0] == 'p':
-          contains_p = True
-        elif t[0] == 'a':
-          break
+      i = self._innermost(('a',))
+      contains_p = i >= 0 and self._innermost(('p',)) > i
       if contains_p: # the p tag, and all its children should be left open
-        a_tag = self._tag_stack.pop(i)
-        if a_tag[1]:
+        if self._tag_stack[i][1]:
           self._in_pre_tag -= 1
+        self._remove_tag(i)
     else:
       if tag == 'head':
         # TODO: Did we know that we were in an head tag?! If not, we need to
@@ -303,6 +795,10 @@ class HTMLMinParser(HTMLParser):
       elif tag == 'title':
         self._in_title = False
         self._title_newly_opened = False
+      stack = self._tag_stack
+      # Only end tags that close just their own element can be left out.
+      optional = (tag in self._optional_end_tags and len(stack) > 0 and
+                  stack[-1][0] == tag)
       try:
         self._in_pre_tag -= self._close_tags_up_to(tag)
       except OpenTagNotFoundError:
@@ -310,30 +806,82 @@ class HTMLMinParser(HTMLParser):
         # closing tags along since they affect output. For instance, a '</p>'
         # results in a '<p></p>' in Chrome.
         pass
+      if optional and not self._in_pre_tag:
+        self._pending = ('end', tag, stack[-1][0] if stack else None)
+        self._data_buffer.append('</%s>' % tag)
+        return
     if tag not in NO_CLOSE_TAGS:
       self._data_buffer.extend(['</', escape.escape_tag(tag), '>'])
 
   def handle_startendtag(self, tag, attrs):
+    if self._svg_drop >= 0:
+      return
+    if (self.minify_svg and not self._in_pre_tag and
+        (tag == 'svg' or self._innermost(('svg',)) >= 0)):
+      attrs = self._svg_starttag(tag, attrs)
+      if attrs is None:
+        return
+    if tag == 'base' and self.base_url and not self._base_seen:
+      self._set_url_base(attrs)
+    if self._pending is not None:
+      self._resolve_pending('start', tag)
+    if tag in self._block_tags:
+      self._block_boundary(tag in TABLE_PART_TAGS and
+                           self._innermost(('table',)) < 0)
+    else:
+      self._after_block = False
     self._after_doctype = False
     data = self.build_tag(tag, attrs, tag not in NO_CLOSE_TAGS)[1]
     self._data_buffer.append(data)
 
+  def _block_boundary(self, ignored=False):
+    """With remove_block_space, takes out the space in front of a block
+    start or end tag, and has handle_data take out the space after it. Tags
+    the HTML parser will ignore aren't boundaries."""
+    if ignored or self._in_pre_tag:
+      self._after_block = False
+      return
+    self._after_block = True
+    buf = self._data_buffer
+    # Only text can end with a space.
+    if buf and buf[-1][-1:] == ' ':
+      text = buf[-1][:-1]
+      if text:
+        buf[-1] = text
+      else:
+        buf.pop()
+
   def handle_comment(self, data):
-    if not self.remove_comments or re.match(r'^(?:!|\[if\s)', data):
+    if self._svg_drop >= 0:
+      return
+    if self._keep_comment(data):
+      if self._pending is not None:
+        self._resolve_pending('comment')
       self._data_buffer.append('<!--{}-->'.format(
           data[1:] if len(data) and data[0] == '!' else data))
 
   def handle_data(self, data):
+    if self._svg_drop >= 0:
+      return
     if self._in_pre_tag > 0:
+      if self._json_script:
+        data = self._compact_json(data)
+      elif self._css_style:
+        data = css.cached_minify(data)
       self._data_buffer.append(data)
     else:
+      if self.shorten_charrefs:
+        data = escape.shorten_charrefs(data, self.output_encoding)
       # remove_all_empty_space matches everything. remove_empty_space only
-      # matches if there's a newline involved.
-      if self.remove_all_empty_space or self._in_head or self._after_doctype:
+      # matches if there's a newline involved. See __init__.
+      if self._in_head or self._after_doctype:
         if HTML_ALL_SPACE_RE.match(data):
           return
-      elif (self.remove_empty_space and HTML_ALL_SPACE_RE.match(data) and
-            ('\n' in data or '\r' in data)):
+      elif self._empty_space_re.match(data):
+        return
+      elif (self._tag_stack and
+            self._tag_stack[-1][0] in self._space_ignoring_tags and
+            HTML_ALL_SPACE_RE.match(data)):
         return
 
       # if we're in the title, remove leading and trailing whitespace.
@@ -352,51 +900,180 @@ class HTMLMinParser(HTMLParser):
             '', HTML_LEADING_TRAILING_SPACE_RE.sub(' ', data))
 
       data = HTML_SPACE_RE.sub(' ', data)
+      if self._after_block and data[:1] == ' ':
+        data = data[1:]
       if not data:
         return
+      self._after_block = False
+      if self._pending is not None:
+        self._resolve_pending('space' if data[0] == ' ' else 'text')
 
       if self._in_pre_tag == 0 and self._data_buffer:
         # If we're not in a pre block, its possible that we append two spaces
         # together, which we want to avoid. For instance, if we remove a comment
         # from between two blocks of text: a <!-- B --> c => a  c.
-        if data[0] == ' ' and self._data_buffer[-1][-1] == ' ':
+        if data[0] == ' ' and self._data_buffer[-1][-1:] == ' ':
           data = data[1:]
           if not data:
             return
       self._data_buffer.append(data)
 
   def handle_entityref(self, data):
+    if self._svg_drop >= 0:
+      return
+    if self._pending is not None:
+      # The reference might stand for space.
+      self._resolve_pending('space')
+    self._after_block = False
     if self._in_title:
       if not self._title_newly_opened and self.__title_trailing_whitespace:
         self._data_buffer.append(' ')
         self.__title_trailing_whitespace = False
       self._title_newly_opened = False
-    self._data_buffer.append('&{};'.format(data))
+    ref = '&{};'.format(data)
+    if self.shorten_charrefs and not self._in_pre_tag:
+      ref = escape.shorten_charref(ref, self.output_encoding)
+    self._data_buffer.append(ref)
 
   def handle_charref(self, data):
+    if self._svg_drop >= 0:
+      return
+    if self._pending is not None:
+      self._resolve_pending('space')
+    self._after_block = False
     if self._in_title:
       if not self._title_newly_opened and self.__title_trailing_whitespace:
         self._data_buffer.append(' ')
         self.__title_trailing_whitespace = False
       self._title_newly_opened = False
-    self._data_buffer.append('&#{};'.format(data))
+    ref = '&#{};'.format(data)
+    if self.shorten_charrefs and not self._in_pre_tag:
+      ref = escape.shorten_charref(ref, self.output_encoding)
+    self._data_buffer.append(ref)
 
   def handle_pi(self, data):
+    if self._svg_drop >= 0:
+      return
+    if self._pending is not None:
+      self._resolve_pending('comment')
     self._data_buffer.append('<?' + data + '>')
 
   def unknown_decl(self, data):
+    if self._svg_drop >= 0:
+      return
+    if self._pending is not None:
+      self._resolve_pending('comment')
     self._data_buffer.append('<![' + data + ']>')
 
   def reset(self):
+    self._reset_state()
+    HTMLParser.reset(self)
+
+  def close(self):
+    HTMLParser.close(self)
+    if self._pending is not None:
+      self._resolve_pending(None)
+
+  def _reset_state(self):
     self._data_buffer = []
     self._in_pre_tag = 0
     self._in_head = False
     self._in_title = False
     self._after_doctype = False
     self._tag_stack = []
+    self._tag_positions = {}
     self._title_newly_opened = False
     self.__title_trailing_whitespace = False
-    HTMLParser.reset(self)
+    self._pending = None
+    self._json_script = False
+    self._css_style = False
+    self._svg_drop = -1
+    self._url_base = None  # base_url unless a base element changes it
+    self._base_seen = False
+    self._after_block = False
+
+  def _minify_fragments(self, fragments):
+    """Minifies each fragment independently and returns a list of results.
+
+    This skips the layers of reset() and the feed()/close() double pass,
+    which dominate the cost of minifying tiny fragments. The tokenizer fields
+    set here must match HTMLParser.reset().
+    """
+    results = []
+    append = results.append
+    reset_state = self._reset_state
+    goahead = self.goahead
+    for fragment in fragments:
+      reset_state()
+      self.rawdata = fragment
+      self.lasttag = '???'
+      self.interesting = interesting_normal
+      self.cdata_elem = None
+      self.lineno = 1
+      self.offset = 0
+      goahead(1)
+      if self._pending is not None:
+        self._resolve_pending(None)
+      append(''.join(self._data_buffer))
+    return results
+
+  def flush(self):
+    """Removes the output produced so far from the buffer and returns it.
+
+    The last chunk is held back, since the handlers look at it.
+    """
+    buf = self._data_buffer
+    if len(buf) < 2:
+      return ''
+    output = ''.join(buf[:-1])
+    # A placeholder keeps handle_decl from taking what is left for the start
+    # of the document.
+    buf[:-1] = ['']
+    return output
+
+  def _get_state(self):
+    """Returns the minification state that carries over from one token to
+    the next, not including the output or any tokenizer state."""
+    return (tuple(self._tag_stack), self._in_pre_tag, self._in_head,
+            self._in_title, self._after_doctype, self._title_newly_opened,
+            self.__title_trailing_whitespace, self._pending,
+            self._json_script, self._css_style, self._svg_drop,
+            self._url_base, self._base_seen, self._after_block)
+
+  def _set_state(self, state):
+    (tag_stack, self._in_pre_tag, self._in_head, self._in_title,
+     self._after_doctype, self._title_newly_opened,
+     self.__title_trailing_whitespace, self._pending,
+     self._json_script, self._css_style, self._svg_drop,
+     self._url_base, self._base_seen, self._after_block) = state
+    self._tag_stack = []
+    self._tag_positions = {}
+    for entry in tag_stack:
+      self._push_tag(entry)
+
+  def snapshot(self):
+    """Captures the complete state of the parser.
+
+    The snapshot holds everything needed to carry on where the parser left
+    off: the minification state, any input that has not been tokenized yet and
+    the output produced so far. It is immutable, so a single snapshot can be
+    passed to :meth:`restore` on any number of parsers with the same options.
+    """
+    buf = self._data_buffer
+    if len(buf) > 1:
+      # Joining all but the last chunk keeps restoring cheap while preserving
+      # what the handlers look at: the last chunk and whether there is more
+      # than one.
+      buf = (''.join(buf[:-1]), buf[-1])
+    return (self._get_state(), tuple(buf), self.rawdata, self.lasttag,
+            self.interesting, self.cdata_elem, self.getpos())
+
+  def restore(self, snapshot):
+    """Puts the parser back into the state captured by :meth:`snapshot`."""
+    (state, buf, self.rawdata, self.lasttag, self.interesting, self.cdata_elem,
+     (self.lineno, self.offset)) = snapshot
+    self._set_state(state)
+    self._data_buffer = list(buf)
 
   def unescape(self, val):
     """Override this method so that we can handle char ref conversion ourself.
@@ -0,0 +1,112 @@
+"""
+Copyright (c) 2013, Dave Mankoff
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Dave Mankoff nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL DAVE MANKOFF BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import division, unicode_literals
+import threading
+
+class _RouteState(object):
+  def __init__(self):
+    self.samples = 0
+    self.saved = 0.0    # moving averages, per response
+    self.seconds = 0.0
+    self.enabled = True
+    self.skipped = 0
+
+  def savings_per_ms(self):
+    if not self.seconds:
+      return float('inf') if self.saved > 0 else 0.0
+    return self.saved / (self.seconds * 1000)
+
+class AdaptivePolicy(object):
+  """Turns minification off for routes where it saves too little for the
+  time it takes.
+
+  The characters saved and the time taken are tracked per route as moving
+  averages. Once a route has ``samples`` minified responses behind it, it is
+  only minified while it saves at least ``min_savings_per_ms`` characters
+  per millisecond. Routes that have been turned off still have every
+  ``resample_every``-th response minified, so that they are turned back on if
+  their pages change.
+
+  :param min_savings_per_ms: The fewest characters a route must save per
+    millisecond spent minifying it.
+  :param samples: How many responses to minify before deciding.
+  :param resample_every: How often to minify a response from a route that
+    has been turned off.
+  :param weight: How much each new response counts towards the moving
+    averages, from 0 to 1.
+
+  Safe to use from several threads at once.
+  """
+
+  def __init__(self, min_savings_per_ms, samples=20, resample_every=100,
+               weight=0.1):
+    self.min_savings_per_ms = min_savings_per_ms
+    self.samples = samples
+    self.resample_every = resample_every
+    self.weight = weight
+    self._routes = {}
+    self._lock = threading.Lock()
+
+  def _route(self, route):
+    state = self._routes.get(route)
+    if state is None:
+      state = self._routes[route] = _RouteState()
+    return state
+
+  def should_minify(self, route):
+    """Returns whether the next response from ``route`` should be
+    minified."""
+    with self._lock:
+      state = self._route(route)
+      if state.enabled:
+        return True
+      state.skipped += 1
+      if state.skipped >= self.resample_every:
+        state.skipped = 0
+        return True
+      return False
+
+  def record(self, route, bytes_in, bytes_out, seconds):
+    """Records a minified response from ``route``."""
+    with self._lock:
+      state = self._route(route)
+      state.samples += 1
+      # Plain averages until there are enough samples, so the first few
+      # responses count as much as the rest.
+      weight = max(self.weight, 1 / state.samples)
+      state.saved += ((bytes_in - bytes_out) - state.saved) * weight
+      state.seconds += (seconds - state.seconds) * weight
+      if state.samples >= self.samples:
+        state.enabled = state.savings_per_ms() >= self.min_savings_per_ms
+
+  def snapshot(self):
+    """Returns ``{route: {'enabled': ..., 'savings_per_ms': ...}}``."""
+    with self._lock:
+      return dict((route, {'enabled': state.enabled,
+                           'savings_per_ms': state.savings_per_ms()})
+                  for route, state in self._routes.items())
@@ -7,10 +7,7 @@ try:
     from html.entities import html5 as _html5
     unichr = chr
 except ImportError:
-    import htmlentitydefs
-    _html5 = {'apos;':u"'"}
-    for k, v in htmlentitydefs.name2codepoint.iteritems():
-        _html5[k + ';'] = unichr(v)
+    from .entities import html5 as _html5
 
 
 __all__ = ['escape', 'unescape']
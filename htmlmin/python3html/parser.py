@@ -68,6 +68,9 @@ locatestarttagend_tolerant = re.compile(r"""
   \s*                                # trailing whitespace
 """, re.VERBOSE)
 endendtag = re.compile('>')
+declname = re.compile(r'[a-zA-Z][-_.a-zA-Z0-9]*\s*')
+markedsectionclose = re.compile(r']\s*]\s*>')
+msmarkedsectionclose = re.compile(r']\s*>')
 # the HTML 5 spec, section 8.1.2.2, doesn't allow spaces between
 # </ and the tag name, so maybe this should be fixed
 endtagfind = re.compile(r'</\s*([a-zA-Z][-.a-zA-Z0-9:_]*)\s*>')
@@ -147,6 +150,8 @@ class HTMLParser(markupbase.ParserBase):
     # true, force handling all data as if followed by EOF marker.
     def goahead(self, end):
         rawdata = self.rawdata
+        self.failed_searches = {}
+        self.last_gt = rawdata.rfind('>')
         i = 0
         n = len(rawdata)
         while i < n:
@@ -182,7 +187,14 @@ class HTMLParser(markupbase.ParserBase):
             startswith = rawdata.startswith
             if startswith('<', i):
                 if starttagopen.match(rawdata, i): # < + letter
-                    k = self.parse_starttag(i)
+                    if end and i >= self.last_gt:
+                        # Without a '>' this can't be a tag, only text, which
+                        # is what the code below makes of it. Parsing it as
+                        # a tag first would go through the rest of the input
+                        # again for every '<' in it.
+                        k = -1
+                    else:
+                        k = self.parse_starttag(i)
                 elif startswith("</", i):
                     k = self.parse_endtag(i)
                 elif startswith("<!--", i):
@@ -199,7 +211,7 @@ class HTMLParser(markupbase.ParserBase):
                 if k < 0:
                     if not end:
                         break
-                    k = rawdata.find('>', i + 1)
+                    k = self.find_gt(i + 1)
                     if k < 0:
                         k = rawdata.find('<', i + 1)
                         if k < 0:
@@ -264,6 +276,25 @@ class HTMLParser(markupbase.ParserBase):
             i = self.updatepos(i, n)
         self.rawdata = rawdata[i:]
 
+    # Internal -- search rawdata from i for the end of a construct. Searches
+    # that fail are remembered until goahead() returns, so that a run of
+    # unterminated constructs is not scanned to the end of the input once for
+    # each of them. find_gt() does the same for '>', using where the last one
+    # is.
+    def find_gt(self, i):
+        if i > self.last_gt:
+            return -1
+        return self.rawdata.find('>', i)
+
+    def search_end(self, pattern, i):
+        failed = self.failed_searches.get(pattern)
+        if failed is not None and i >= failed:
+            return None
+        match = pattern.search(self.rawdata, i)
+        if match is None:
+            self.failed_searches[pattern] = i
+        return match
+
     # Internal -- parse html declarations, return length or -1 if not terminated
     # See w3.org/TR/html5/tokenization.html#markup-declaration-open-state
     # See also parse_declaration in _markupbase
@@ -278,7 +309,7 @@ class HTMLParser(markupbase.ParserBase):
             return self.parse_marked_section(i)
         elif rawdata[i:i+9].lower() == '<!doctype':
             # find the closing >
-            gtpos = rawdata.find('>', i+9)
+            gtpos = self.find_gt(i+9)
             if gtpos == -1:
                 return -1
             self.handle_decl(rawdata[i+2:gtpos])
@@ -292,24 +323,60 @@ class HTMLParser(markupbase.ParserBase):
         rawdata = self.rawdata
         assert rawdata[i:i+2] in ('<!', '</'), ('unexpected call to '
                                                 'parse_comment()')
-        pos = rawdata.find('>', i+2)
+        pos = self.find_gt(i+2)
         if pos == -1:
             return -1
         if report:
             self.handle_comment(rawdata[i+2:pos])
         return pos + 1
 
+    # Internal -- parse comment, return length or -1 if not terminated
+    def parse_comment(self, i, report=1):
+        rawdata = self.rawdata
+        assert rawdata[i:i+4] == '<!--', 'unexpected call to parse_comment()'
+        match = self.search_end(commentclose, i+4)
+        if not match:
+            return -1
+        if report:
+            j = match.start(0)
+            self.handle_comment(rawdata[i+4: j])
+        return match.end(0)
+
+    # Internal -- parse marked section, return length or -1 if not terminated.
+    # Unlike the markupbase version, sections that aren't of a known type
+    # are treated as bogus comments rather than raising an error.
+    def parse_marked_section(self, i, report=1):
+        rawdata = self.rawdata
+        assert rawdata[i:i+3] == '<![', ('unexpected call to '
+                                         'parse_marked_section()')
+        match = declname.match(rawdata, i+3)
+        if match and match.end() == len(rawdata):
+            return -1  # end of buffer
+        name = match.group().strip().lower() if match else None
+        if name in ('temp', 'cdata', 'ignore', 'include', 'rcdata'):
+            # look for standard ]]> ending
+            match = self.search_end(markedsectionclose, i+3)
+        elif name in ('if', 'else', 'endif'):
+            # look for MS Office ]> ending
+            match = self.search_end(msmarkedsectionclose, i+3)
+        else:
+            return self.parse_bogus_comment(i, report)
+        if not match:
+            return -1
+        if report:
+            j = match.start(0)
+            self.unknown_decl(rawdata[i+3: j])
+        return match.end(0)
+
     # Internal -- parse processing instr, return end or -1 if not terminated
     def parse_pi(self, i):
         rawdata = self.rawdata
         assert rawdata[i:i+2] == '<?', 'unexpected call to parse_pi()'
-        match = piclose.search(rawdata, i+2) # >
-        if not match:
+        j = self.find_gt(i+2) # >
+        if j == -1:
             return -1
-        j = match.start()
         self.handle_pi(rawdata[i+2: j])
-        j = match.end()
-        return j
+        return j + 1
 
     # Internal -- handle starttag, return end or -1 if not terminated
     def parse_starttag(self, i):
@@ -400,6 +467,8 @@ class HTMLParser(markupbase.ParserBase):
     def parse_endtag(self, i):
         rawdata = self.rawdata
         assert rawdata[i:i+2] == "</", "unexpected call to parse_endtag"
+        if i + 1 > self.last_gt:
+            return -1
         match = endendtag.search(rawdata, i+1) # >
         if not match:
             return -1
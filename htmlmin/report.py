@@ -0,0 +1,355 @@
+"""
+Copyright (c) 2013, Dave Mankoff
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Dave Mankoff nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL DAVE MANKOFF BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import unicode_literals
+
+from . import parser as htmlmin_parser
+from .python3html.parser import attrfind_tolerant, tagfind_tolerant
+from .stats import timer
+
+# What the saved characters are attributed to, in the order they are listed.
+CATEGORIES = (
+  ('whitespace', 'Whitespace in text'),
+  ('title', 'Title trimming'),
+  ('comments', 'Comment removal'),
+  ('attribute_quotes', 'Attribute quote removal'),
+  ('attribute_values', 'Empty and boolean attribute reduction'),
+  ('lang', 'Repeated lang removal'),
+  ('start_tags', 'Other start tag rewriting'),
+  ('optional_tags', 'Optional tag removal'),
+  ('json', 'JSON compaction'),
+  ('css', 'CSS minification'),
+  ('svg', 'SVG elements left out'),
+  ('other', 'Everything else'),
+)
+# Categories worked out inside build_tag, whose time can't be told apart from
+# the rest of it.
+BUILD_TAG_CATEGORIES = ('attribute_quotes', 'attribute_values', 'lang')
+
+# No handler takes more than two chunks off the end of the output buffer, so
+# the length of the last few is enough to tell how much one added.
+TAIL = 4
+
+def _tail_length(buf, start):
+  return sum(len(chunk) for chunk in buf[start:])
+
+def _value_quoting(tag_text):
+  """Maps the name of each attribute with a value in a start tag to whether
+  the value is quoted. Where an attribute is repeated, the first counts."""
+  quoting = {}
+  match = tagfind_tolerant.match(tag_text, 1)
+  pos = match.end() if match else len(tag_text)
+  while pos < len(tag_text):
+    match = attrfind_tolerant.match(tag_text, pos)
+    if not match:
+      break
+    name, rest, value = match.group(1, 2, 3)
+    if rest:
+      quoting.setdefault(name.lower(), value[:1] in ('"', "'"))
+    pos = match.end()
+  return quoting
+
+def _data_category(parser):
+  if parser._svg_drop >= 0:
+    return 'svg'
+  if parser._in_pre_tag:
+    if parser._json_script:
+      return 'json'
+    if parser._css_style:
+      return 'css'
+    return 'other'
+  return 'title' if parser._in_title else 'whitespace'
+
+def _category(name):
+  def category(parser):
+    return 'svg' if parser._svg_drop >= 0 else name
+  return category
+
+# The handlers that are hooked, and what the characters they save count as.
+HANDLER_CATEGORIES = (
+  ('handle_data', _data_category),
+  ('handle_starttag', _category('start_tags')),
+  ('handle_startendtag', _category('start_tags')),
+  ('handle_endtag', _category('other')),
+  ('handle_comment', _category('comments')),
+  ('handle_decl', _category('other')),
+  ('handle_pi', _category('other')),
+  ('unknown_decl', _category('other')),
+  ('handle_charref', _category('other')),
+  ('handle_entityref', _category('other')),
+)
+
+class SavingsReport(object):
+  """Which transformations saved how many characters, and at what cost.
+
+  :meth:`to_dict` returns the report in this form, with times in seconds::
+
+    {
+      'bytes_in': 1024,          # characters of HTML fed in
+      'bytes_out': 512,          # characters of minified HTML
+      'categories': {            # by category, as in CATEGORIES
+        'whitespace': {'saved': 300, 'time': 0.001},
+        ...
+      },
+      'time': {
+        'total': 0.01,           # feeding, closing and joining the output
+        'tokenizer': 0.002,      # of that, outside of the handlers
+      },
+    }
+
+  The ``saved`` entries add up to ``bytes_in - bytes_out``. The characters a
+  token saves are counted under the transformation that handled it, and a
+  token's time under the same one. Quote removal counts two characters for
+  each attribute value that is quoted in the source and not in the output.
+  Attribute reduction and lang removal are measured by building each start
+  tag again without them, so each is what turning it off alone would cost.
+  The time of these three is included under ``start_tags`` and given as
+  None. Times include the overhead of measuring them.
+  """
+
+  def __init__(self):
+    self.bytes_in = 0
+    self.bytes_out = 0
+    self.saved = dict((name, 0) for name, _ in CATEGORIES)
+    self.times = dict((name, 0.0) for name, _ in CATEGORIES
+                      if name not in BUILD_TAG_CATEGORIES)
+    self.total_time = 0.0
+
+  def to_dict(self):
+    return {
+      'bytes_in': self.bytes_in,
+      'bytes_out': self.bytes_out,
+      'categories': dict(
+        (name, {'saved': self.saved[name], 'time': self.times.get(name)})
+        for name, _ in CATEGORIES),
+      'time': {
+        'total': self.total_time,
+        'tokenizer': max(self.total_time - sum(self.times.values()), 0.0),
+      },
+    }
+
+  def format_table(self):
+    """Returns the report as a plain text table, with the characters each
+    category saved, its share of all those saved, its time in milliseconds
+    and the characters it saved per millisecond."""
+    saved = self.bytes_in - self.bytes_out
+    rows = [('Transformation', 'Saved', 'Share', 'Time (ms)', 'Saved/ms')]
+
+    def row(label, chars, time):
+      if chars is None:
+        return (label, '-', '-', '%.2f' % (time * 1000), '-')
+      share = '%.1f%%' % (100.0 * chars / saved) if saved else '-'
+      if time is None:
+        return (label, '%d' % chars, share, '-', '-')
+      ms = time * 1000
+      rate = '%.1f' % (chars / ms) if ms else '-'
+      return (label, '%d' % chars, share, '%.2f' % ms, rate)
+
+    for name, label in CATEGORIES:
+      rows.append(row(label, self.saved[name], self.times.get(name)))
+    rows.append(row('Tokenizer', None, self.to_dict()['time']['tokenizer']))
+    rows.append(row('Total', saved, self.total_time))
+
+    widths = [max(len(r[i]) for r in rows) for i in range(len(rows[0]))]
+    lines = []
+    for r in rows:
+      lines.append('  '.join([r[0].ljust(widths[0])] +
+                             [c.rjust(w) for c, w in zip(r[1:], widths[1:])]))
+    lines.insert(1, '-' * len(lines[0]))
+    lines.insert(-1, '-' * len(lines[0]))
+    return '\n'.join(lines)
+
+class Attribution(object):
+  """Collects a :class:`SavingsReport` from an
+  :class:`htmlmin.parser.HTMLMinParser`.
+
+  Like :class:`htmlmin.stats.Instrumentation`, this replaces methods on the
+  parser instance only. Every token's span in the source is taken from
+  ``updatepos``, which the tokenizer calls once the token's handler is done,
+  and what the handler added to the output buffer is measured around it.
+  ``options`` are those the parser was made with; start tags are built again
+  by parsers that differ in one of them.
+  """
+
+  def __init__(self, parser, options):
+    self.parser = parser
+    self.report = SavingsReport()
+    self._mark = 0            # how far into rawdata tokens have been counted
+    self._token = None        # category of the token being handled
+    self._token_output = 0    # characters it added to the output
+    self._nested_output = 0   # of those, what nested hooks counted already
+    self._nested_time = 0.0   # time nested hooks counted already
+    self._variant_time = 0.0  # time spent building start tags again
+
+    for method, category in HANDLER_CATEGORIES:
+      handler = getattr(parser, method)
+      setattr(parser, method, self._wrap_handler(handler, category))
+    parser.updatepos = self._wrap_updatepos(parser.updatepos)
+    parser.goahead = self._wrap_goahead(parser.goahead)
+    parser._resolve_pending = self._wrap_nested(parser._resolve_pending,
+                                                'optional_tags')
+    # Space taken off the end of text is still whitespace.
+    parser._block_boundary = self._wrap_nested(parser._block_boundary,
+                                               'whitespace')
+
+    cls = parser.__class__
+    self._quotes = options.get('remove_optional_attribute_quotes', True)
+    self._variants = []
+    if (options.get('reduce_empty_attributes', True) or
+        options.get('reduce_boolean_attributes', False)):
+      self._variants.append(('attribute_values', cls(
+        **dict(options, reduce_empty_attributes=False,
+               reduce_boolean_attributes=False))))
+    # A parser with nothing open doesn't know the language in effect.
+    self._variants.append(('lang', cls(**options)))
+    parser.build_tag = self._wrap_build_tag(parser.build_tag)
+
+  def _wrap_handler(self, handler, category):
+    def wrapper(*args):
+      parser = self.parser
+      name = category(parser)
+      buf = parser._data_buffer
+      start = max(len(buf) - TAIL, 0)
+      before = _tail_length(buf, start)
+      self._nested_output = 0
+      self._nested_time = 0.0
+      began = timer()
+      handler(*args)
+      elapsed = timer() - began
+      if name == 'start_tags' and parser._svg_drop >= 0:
+        name = 'svg'  # the start of an element that is left out
+      added = _tail_length(parser._data_buffer, start) - before
+      self.report.times[name] += elapsed - self._nested_time
+      if self._token is None:
+        self._token = name
+      self._token_output += added - self._nested_output
+    return wrapper
+
+  def _wrap_nested(self, method, name):
+    def wrapper(*args):
+      buf = self.parser._data_buffer
+      start = max(len(buf) - TAIL, 0)
+      before = _tail_length(buf, start)
+      began = timer()
+      result = method(*args)
+      elapsed = timer() - began
+      added = _tail_length(self.parser._data_buffer, start) - before
+      self.report.saved[name] -= added
+      self.report.times[name] += elapsed
+      self._nested_output += added
+      self._nested_time += elapsed
+      return result
+    return wrapper
+
+  def _wrap_build_tag(self, build_tag):
+    parser = self.parser
+    saved = self.report.saved
+
+    def wrapper(tag, attrs, close_tag):
+      result = build_tag(tag, attrs, close_tag)
+      began = timer()
+      length = len(result[1])
+      claimed = 0
+      if self._quotes:
+        source = _value_quoting(parser.get_starttag_text())
+        unquoted = [name for name, quoted in
+                    _value_quoting(result[1]).items() if not quoted]
+        quotes = 2 * sum(1 for name in unquoted if source.get(name))
+        saved['attribute_quotes'] += quotes
+        claimed += quotes
+      for name, variant in self._variants:
+        variant._tag_stack = parser._tag_stack if name != 'lang' else []
+        variant._url_base = parser._url_base
+        difference = len(variant.build_tag(tag, attrs, close_tag)[1]) - length
+        saved[name] += difference
+        claimed += difference
+      # The rest of the start tag is counted as usual, so what was claimed
+      # here has to come off it.
+      self._token_output += claimed
+      elapsed = timer() - began
+      self._nested_time += elapsed
+      self._variant_time += elapsed
+      return result
+    return wrapper
+
+  def _wrap_updatepos(self, updatepos):
+    def wrapper(i, j):
+      # A few errors in declarations report part of a span twice.
+      length = j - max(i, self._mark)
+      if length > 0:
+        self._mark = j
+      else:
+        length = 0
+      self.report.saved[self._token or 'other'] += length - self._token_output
+      self._token = None
+      self._token_output = 0
+      return updatepos(i, j)
+    return wrapper
+
+  def _wrap_goahead(self, goahead):
+    def wrapper(end):
+      goahead(end)
+      # What was counted has been dropped from the front of rawdata.
+      self._mark = 0
+    return wrapper
+
+  def feed(self, data):
+    self.report.bytes_in += len(data)
+    began = timer()
+    self.parser.feed(data)
+    self.report.total_time += timer() - began - self._take_variant_time()
+
+  def close(self):
+    began = timer()
+    self.parser.close()
+    self.report.total_time += timer() - began - self._take_variant_time()
+
+  def result(self):
+    began = timer()
+    result = self.parser.result
+    self.report.total_time += timer() - began
+    self.report.bytes_out = len(result)
+    return result
+
+  def _take_variant_time(self):
+    variant_time = self._variant_time
+    self._variant_time = 0.0
+    return variant_time
+
+def minify(input, cls=htmlmin_parser.HTMLMinParser, **kwargs):
+  """Minifies HTML like :func:`htmlmin.minify`, and reports on it.
+
+  :param input: A string containing the HTML to be minified.
+  :param kwargs: The options of :func:`htmlmin.minify`, apart from
+    ``engine``; the fast engine has no handlers to measure.
+  :returns: The minified HTML and a :class:`SavingsReport`.
+  """
+  parser = cls(**kwargs)
+  attribution = Attribution(parser, kwargs)
+  attribution.feed(input)
+  attribution.close()
+  return attribution.result(), attribution.report
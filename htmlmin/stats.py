@@ -0,0 +1,215 @@
+"""
+Copyright (c) 2013, Dave Mankoff
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Dave Mankoff nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL DAVE MANKOFF BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import unicode_literals
+import time
+
+try:
+  timer = time.perf_counter
+except AttributeError:
+  timer = time.time
+
+# Handlers that are timed and counted, keyed by the token type they count.
+HANDLERS = (
+  ('data', 'handle_data'),
+  ('starttag', 'handle_starttag'),
+  ('startendtag', 'handle_startendtag'),
+  ('endtag', 'handle_endtag'),
+  ('comment', 'handle_comment'),
+  ('decl', 'handle_decl'),
+  ('pi', 'handle_pi'),
+  ('unknown_decl', 'unknown_decl'),
+  ('charref', 'handle_charref'),
+  ('entityref', 'handle_entityref'),
+)
+
+def _attrs_length(attrs):
+  return sum(len(k) + len(v or '') for k, v in attrs)
+
+class MinifyStats(object):
+  """Statistics about a single minification.
+
+  :meth:`to_dict` returns them in this form, with times in seconds::
+
+    {
+      'bytes_in': 1024,          # characters of HTML fed in
+      'bytes_out': 512,          # characters of minified HTML
+      'tokens': {                # tokens seen, by type
+        'data': 0, 'starttag': 0, 'startendtag': 0, 'endtag': 0,
+        'comment': 0, 'decl': 0, 'pi': 0, 'unknown_decl': 0,
+        'charref': 0, 'entityref': 0,
+      },
+      'attributes': 0,           # attributes passed to build_tag
+      'json_blocks': 0,          # script bodies compacted with minify_json
+      'json_saved': 0,           # characters that compacting them saved
+      'svg_dropped': 0,          # elements left out with minify_svg
+      'svg_saved': 0,            # characters minify_svg saved in attributes
+      'peak_buffer_items': 0,    # most chunks held in the output buffer
+      'time': {
+        'total': 0.0,            # feeding, closing and joining the output
+        'tokenizer': 0.0,        # feeding and closing, less the handlers
+        'handlers': {            # by handler, as in 'tokens'
+          'data': 0.0, ...
+        },
+        'build_tag': 0.0,        # also counted in the start tag handlers
+        'join': 0.0,             # joining the output buffer
+      },
+    }
+
+  Token and handler entries are only present for handlers the parser has;
+  the fast engine has none of them.
+  """
+
+  def __init__(self):
+    self.bytes_in = 0
+    self.bytes_out = 0
+    self.tokens = {}
+    self.attributes = 0
+    self.json_blocks = 0
+    self.json_saved = 0
+    self.svg_dropped = 0
+    self.svg_saved = 0
+    self.peak_buffer_items = 0
+    self.parse_time = 0.0
+    self.handler_times = {}
+    self.build_tag_time = 0.0
+    self.join_time = 0.0
+
+  def to_dict(self):
+    handlers = sum(self.handler_times.values())
+    return {
+      'bytes_in': self.bytes_in,
+      'bytes_out': self.bytes_out,
+      'tokens': dict(self.tokens),
+      'attributes': self.attributes,
+      'json_blocks': self.json_blocks,
+      'json_saved': self.json_saved,
+      'svg_dropped': self.svg_dropped,
+      'svg_saved': self.svg_saved,
+      'peak_buffer_items': self.peak_buffer_items,
+      'time': {
+        'total': self.parse_time + self.join_time,
+        'tokenizer': max(self.parse_time - handlers, 0.0),
+        'handlers': dict(self.handler_times),
+        'build_tag': self.build_tag_time,
+        'join': self.join_time,
+      },
+    }
+
+class Instrumentation(object):
+  """Collects :class:`MinifyStats` from a parser.
+
+  The handlers of the parser are replaced, on the instance only, by wrappers
+  that time and count them. Other instances, and the parser class itself,
+  are left alone, so there is no cost unless statistics are asked for.
+  """
+
+  def __init__(self, parser):
+    self.parser = parser
+    self.stats = MinifyStats()
+    for name, method in HANDLERS:
+      handler = getattr(parser, method, None)
+      if handler is not None:
+        self.stats.tokens[name] = 0
+        self.stats.handler_times[name] = 0.0
+        setattr(parser, method, self._wrap_handler(name, handler))
+    build_tag = getattr(parser, 'build_tag', None)
+    if build_tag is not None:
+      parser.build_tag = self._wrap_build_tag(build_tag)
+    compact_json = getattr(parser, '_compact_json', None)
+    if compact_json is not None:
+      parser._compact_json = self._wrap_compact_json(compact_json)
+    svg_starttag = getattr(parser, '_svg_starttag', None)
+    if svg_starttag is not None:
+      parser._svg_starttag = self._wrap_svg_starttag(svg_starttag)
+
+  def _wrap_handler(self, name, handler):
+    def wrapper(*args):
+      stats = self.stats
+      start = timer()
+      handler(*args)
+      stats.handler_times[name] += timer() - start
+      stats.tokens[name] += 1
+      buffer_items = len(self.parser._data_buffer)
+      if buffer_items > stats.peak_buffer_items:
+        stats.peak_buffer_items = buffer_items
+    return wrapper
+
+  def _wrap_build_tag(self, build_tag):
+    def wrapper(tag, attrs, close_tag):
+      stats = self.stats
+      stats.attributes += len(attrs)
+      start = timer()
+      result = build_tag(tag, attrs, close_tag)
+      stats.build_tag_time += timer() - start
+      return result
+    return wrapper
+
+  def _wrap_compact_json(self, compact_json):
+    def wrapper(text):
+      result = compact_json(text)
+      self.stats.json_blocks += 1
+      self.stats.json_saved += len(text) - len(result)
+      return result
+    return wrapper
+
+  def _wrap_svg_starttag(self, svg_starttag):
+    def wrapper(tag, attrs):
+      result = svg_starttag(tag, attrs)
+      if result is None:
+        self.stats.svg_dropped += 1
+      else:
+        self.stats.svg_saved += _attrs_length(attrs) - _attrs_length(result)
+      return result
+    return wrapper
+
+  def feed(self, data):
+    self.stats.bytes_in += len(data)
+    start = timer()
+    self.parser.feed(data)
+    self.stats.parse_time += timer() - start
+
+  def close(self):
+    start = timer()
+    self.parser.close()
+    self.stats.parse_time += timer() - start
+
+  def result(self):
+    start = timer()
+    result = self.parser.result
+    self.stats.join_time += timer() - start
+    return result
+
+  def reset(self):
+    """Starts collecting statistics for a new document and returns those
+    collected for the previous one."""
+    stats = self.stats
+    self.stats = MinifyStats()
+    for name in stats.tokens:
+      self.stats.tokens[name] = 0
+      self.stats.handler_times[name] = 0.0
+    return stats
@@ -0,0 +1,176 @@
+"""
+Copyright (c) 2013, Dave Mankoff
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Dave Mankoff nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL DAVE MANKOFF BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import unicode_literals
+import re
+
+# Elements that are dropped, with their content, from inside an svg element.
+DROPPED_ELEMENTS = ('metadata',)
+# Namespaces that drawing editors keep their own data in. Elements and
+# attributes in them, and the declarations of the namespaces, are dropped.
+EDITOR_PREFIXES = ('inkscape:', 'sodipodi:')
+EDITOR_NAMESPACE_DECLARATIONS = tuple('xmlns:' + prefix[:-1]
+                                      for prefix in EDITOR_PREFIXES)
+
+# Attribute names are as the parser gives them, in lower case.
+PATH_ATTRIBUTES = ('d',)
+NUMBER_LIST_ATTRIBUTES = ('points', 'viewbox')
+TRANSFORM_ATTRIBUTES = ('transform', 'gradienttransform', 'patterntransform')
+
+NUMBER_RE = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+FLAG_RE = re.compile(r'[01]')
+SPACE_RE = re.compile(r'[\x20\t\n\r\f]*')
+SEPARATOR_RE = re.compile(r'[\x20\t\n\r\f]*,?[\x20\t\n\r\f]*')
+COMMAND_RE = re.compile(r'[MmZzLlHhVvCcSsQqTtAa]')
+TRANSFORM_RE = re.compile(r'(matrix|translate|scale|rotate|skewX|skewY)'
+                          r'[\x20\t\n\r\f]*\(([^()]*)\)')
+
+# How many numbers each path command takes.
+PATH_ARGUMENTS = {'m': 2, 'z': 0, 'l': 2, 'h': 1, 'v': 1, 'c': 6, 's': 4,
+                  'q': 4, 't': 2, 'a': 7}
+# The arguments of an arc that are flags, a single 0 or 1.
+ARC_FLAGS = (3, 4)
+
+def is_editor_name(name):
+  """Returns whether an element or attribute belongs to a drawing editor."""
+  return (name.startswith(EDITOR_PREFIXES) or
+          name in EDITOR_NAMESPACE_DECLARATIONS)
+
+def format_number(text, precision=None):
+  """Writes a number out in as few characters as possible, after rounding it
+  to ``precision`` decimal places if that isn't None."""
+  if precision is not None:
+    text = '%.*f' % (precision, round(float(text), precision))
+  elif 'e' in text or 'E' in text:
+    return text.lstrip('+')
+  negative = text[:1] == '-'
+  text = text.lstrip('+-')
+  if '.' in text:
+    text = text.rstrip('0').rstrip('.')
+  text = text.lstrip('0') or '0'
+  if negative and text != '0':
+    text = '-' + text
+  return text
+
+def _join_numbers(out, numbers, previous=None):
+  """Adds ``numbers`` to ``out`` with only the separators that are needed
+  after the number ``previous``, if any, and returns the last one."""
+  for number in numbers:
+    if previous is not None and not (
+        number[0] == '-' or
+        (number[0] == '.' and '.' in previous and 'e' not in previous and
+         'E' not in previous)):
+      out.append(' ')
+    out.append(number)
+    previous = number
+  return previous
+
+def _read_numbers(text):
+  """Returns the numbers in a list of numbers separated by space or commas,
+  or None if ``text`` is something else."""
+  numbers = []
+  pos = SPACE_RE.match(text).end()
+  while pos < len(text):
+    if numbers:
+      pos = SEPARATOR_RE.match(text, pos).end()
+    match = NUMBER_RE.match(text, pos)
+    if not match:
+      return None
+    numbers.append(match.group())
+    pos = SPACE_RE.match(text, match.end()).end()
+  return numbers
+
+def compact_numbers(value, precision=None):
+  """Compacts a list of numbers, such as ``points`` or ``viewBox``. Anything
+  else is returned as is."""
+  numbers = _read_numbers(value)
+  if numbers is None:
+    return value
+  out = []
+  _join_numbers(out, [format_number(n, precision) for n in numbers])
+  return ''.join(out)
+
+def compact_transform(value, precision=None):
+  """Compacts a list of transform functions. Anything else is returned as
+  is."""
+  out = []
+  pos = SPACE_RE.match(value).end()
+  while pos < len(value):
+    if out:
+      pos = SEPARATOR_RE.match(value, pos).end()
+      out.append(' ')
+    match = TRANSFORM_RE.match(value, pos)
+    if not match:
+      return value
+    numbers = _read_numbers(match.group(2))
+    if numbers is None:
+      return value
+    out.extend([match.group(1), '('])
+    _join_numbers(out, [format_number(n, precision) for n in numbers])
+    out.append(')')
+    pos = SPACE_RE.match(value, match.end()).end()
+  return ''.join(out)
+
+def compact_path(value, precision=None):
+  """Compacts path data, as in the ``d`` attribute.
+
+  Space and commas are only kept where they are needed to tell numbers
+  apart, and a command letter that repeats the one before it is left out.
+  Path data that doesn't parse is returned as is.
+  """
+  out = []
+  command = None
+  written = None  # the command last written out
+  number = None    # the number last written out, if nothing came after it
+  pos = SPACE_RE.match(value).end()
+  while pos < len(value):
+    match = COMMAND_RE.match(value, pos)
+    if match:
+      command = match.group()
+      pos = SPACE_RE.match(value, match.end()).end()
+      # Numbers that follow a moveto without a command are linetos, so a
+      # repeated moveto has to stay.
+      if command != written or command in 'Mm':
+        out.append(command)
+        written = command
+        number = None
+    elif command is None or command in 'Zz':
+      return value
+    args = []
+    flags = ARC_FLAGS if command in 'Aa' else ()
+    for i in range(PATH_ARGUMENTS[command.lower()]):
+      if i:
+        pos = SEPARATOR_RE.match(value, pos).end()
+      match = (FLAG_RE if i in flags else NUMBER_RE).match(value, pos)
+      if not match:
+        return value
+      args.append(match.group() if i in flags else
+                  format_number(match.group(), precision))
+      pos = match.end()
+    number = _join_numbers(out, args, number)
+    pos = SEPARATOR_RE.match(value, pos).end()
+  return ''.join(out)
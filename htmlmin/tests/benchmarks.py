@@ -0,0 +1,357 @@
+"""
+Copyright (c) 2013, Dave Mankoff
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Dave Mankoff nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL DAVE MANKOFF BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+Benchmarks for htmlmin. Run with:
+
+  python -m htmlmin.tests.benchmarks [NAME ...]
+"""
+
+from __future__ import print_function, unicode_literals
+import codecs
+import gzip
+import io
+import itertools
+import multiprocessing
+import os
+import random
+import sys
+import timeit
+
+import htmlmin
+import htmlmin.middleware
+
+LARGE_TEST = os.path.join(os.path.dirname(__file__), 'large_test.html')
+
+# Input shapes known to have made parsers take time that grows faster than the
+# input, as functions of the approximate size in characters. Most are runs of
+# constructs that are never terminated, which tempt the tokenizer to search
+# to the end of the input for each one, or elements that are never closed,
+# which make the tag stack as deep as the input is long.
+ADVERSARIAL_INPUTS = {
+  'unterminated comments': lambda n: '<!--' * (n // 4),
+  'comments without --': lambda n: '<!--x>' * (n // 6),
+  'unterminated cdata': lambda n: '<![CDATA[x>' * (n // 11),
+  'bad marked sections': lambda n: '<![x' * (n // 4),
+  'unterminated pis': lambda n: '<?' * (n // 2),
+  'unterminated end tags': lambda n: '</' * (n // 2),
+  'unterminated decls': lambda n: '<!' * (n // 2),
+  'lone lts': lambda n: '<' * n,
+  'lts in text': lambda n: 'a < ' * (n // 4),
+  'one open tag': lambda n: '<a ' + 'b=c ' * (n // 4),
+  'open tags': lambda n: '<a ' * (n // 3),
+  'open tags with attrs': lambda n: '<a b=c ' * (n // 7),
+  'open tags with quotes': lambda n: '<a "' * (n // 4),
+  'open quoted values': lambda n: '<a b="' * (n // 6),
+  'quotes in a tag': lambda n: '<a ' + '"' * n,
+  'equals in a tag': lambda n: '<a ' + '=' * n,
+  'spaced equals': lambda n: '<a b' + ' =' * (n // 2),
+  'quote equals': lambda n: '<a ' + '="' * (n // 2),
+  'ampersands': lambda n: '&' * n,
+  'charref starts': lambda n: '&#' * (n // 2),
+  'script end tag starts': lambda n: '<script>' + '</' * (n // 2),
+  'long doctype': lambda n: '<!DOCTYPE' + ' a' * (n // 2),
+  'unclosed tags': lambda n: '<a>' * (n // 3),
+  'nested divs': lambda n: '<div>' * (n // 5),
+  'unmatched end tags': lambda n: '<div>' * (n // 10) + '</x>' * (n // 8),
+  'p in as': lambda n: '<a>' * (n // 6) + '<p>' + '</a>' * (n // 8),
+}
+
+def load_large_test():
+  with codecs.open(LARGE_TEST, encoding='utf-8') as inpf:
+    return inpf.read()
+
+def best_of(fn, number=3, repeat=3):
+  """Returns the best time, in seconds, of a single call to ``fn``."""
+  return min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+def bench_options():
+  """Minifies large_test.html across a matrix of option combinations."""
+  html = load_large_test()
+  flags = ('remove_comments', 'remove_empty_space', 'remove_all_empty_space',
+           'reduce_boolean_attributes', 'convert_charrefs')
+  print('%-60s %10s' % ('options', 'ms/call'))
+  for values in itertools.product((False, True), repeat=len(flags)):
+    options = dict(zip(flags, values))
+    minify = htmlmin.Minifier(**options).minify
+    enabled = ','.join(f for f in flags if options[f]) or '(none)'
+    print('%-60s %10.2f' % (enabled, best_of(lambda: minify(html)) * 1000))
+
+# Options that make the output smaller, each compared on its own against the
+# defaults by bench_savings.
+SAVINGS_OPTIONS = (
+  'remove_comments',
+  'remove_empty_space',
+  'remove_all_empty_space',
+  'reduce_boolean_attributes',
+  'remove_optional_tags',
+  'remove_redundant_attributes',
+  'minify_json',
+  'minify_css',
+  'minify_svg',
+  'shorten_charrefs',
+  'remove_block_space',
+)
+
+def bench_savings():
+  """How much each option shrinks large_test.html, beyond the defaults.
+  Characters and references aren't the same size in UTF-8, so bytes are
+  shown too."""
+  html = load_large_test()
+  minified = htmlmin.minify(html)
+  base = len(minified)
+  base_bytes = len(minified.encode('utf-8'))
+  print('%-30s %10s %10s %8s %12s' % ('option', 'chars', 'saved', 'saved%',
+                                      'bytes saved'))
+  print('%-30s %10d' % ('(input)', len(html)))
+  print('%-30s %10d %10d %7.2f%% %12d' % (
+    '(defaults)', base, len(html) - base, 100.0 * (len(html) - base) / len(html),
+    len(html.encode('utf-8')) - base_bytes))
+  for option in SAVINGS_OPTIONS:
+    minified = htmlmin.minify(html, **{option: True})
+    size = len(minified)
+    print('%-30s %10d %10d %7.2f%% %12d' % (
+      option, size, base - size, 100.0 * (base - size) / base,
+      base_bytes - len(minified.encode('utf-8'))))
+
+def bench_stages():
+  """Times tokenizing and minifying separately, and the one-pass engine."""
+  html = load_large_test()
+  minifier = htmlmin.Minifier()
+  stream = minifier.tokenize(html)
+  print('%-20s %10s' % ('stage', 'ms/call'))
+  for name, fn in (('tokenize', lambda: minifier.tokenize(html)),
+                   ('minify_tokens', lambda: minifier.minify_tokens(stream)),
+                   ('minify', lambda: minifier.minify(html))):
+    print('%-20s %10.2f' % (name, best_of(fn) * 1000))
+
+def bench_parallel():
+  """Compares serial and parallel minification of a ~10MB document."""
+  html = load_large_test() * 30
+  minifier = htmlmin.Minifier()
+  print('%-20s %10s' % ('mode', 'ms/call'))
+  print('%-20s %10.2f' % (
+    'serial', best_of(lambda: minifier.minify(html), number=1) * 1000))
+  pool = multiprocessing.Pool()
+  try:
+    print('%-20s %10.2f' % (
+      'parallel (%d cpus)' % multiprocessing.cpu_count(),
+      best_of(lambda: minifier.minify_parallel(html, pool=pool),
+              number=1) * 1000))
+  finally:
+    pool.close()
+    pool.join()
+
+def bench_snapshot():
+  """Minifies pages sharing a layout, with and without a layout snapshot."""
+  html = load_large_test()
+  layout, page = html[:300000], html[300000:]
+  minifier = htmlmin.Minifier()
+  minifier.input(layout)
+  snapshot = minifier.snapshot()
+  minifier.finalize()
+
+  def from_snapshot():
+    minifier.restore(snapshot)
+    minifier.input(page)
+    return minifier.finalize()
+
+  print('%-20s %10s' % ('mode', 'ms/call'))
+  print('%-20s %10.2f' % (
+    'full document', best_of(lambda: minifier.minify(html)) * 1000))
+  print('%-20s %10.2f' % ('from snapshot', best_of(from_snapshot) * 1000))
+
+def bench_fragments():
+  """Per-fragment cost of minify() versus minify_fragments()."""
+  html = load_large_test()
+  minifier = htmlmin.Minifier()
+  print('%-10s %15s %20s' % ('size', 'minify us', 'minify_fragments us'))
+  for size in (50, 200, 1000, 5000):
+    fragments = [html[i:i + size] for i in range(0, len(html) - size, size)]
+    fragments = fragments[:2000]
+    one_by_one = best_of(lambda: [minifier.minify(f) for f in fragments])
+    batched = best_of(lambda: minifier.minify_fragments(fragments))
+    print('%-10d %15.2f %20.2f' % (size, one_by_one / len(fragments) * 1e6,
+                                   batched / len(fragments) * 1e6))
+
+def bench_engines():
+  """Compares the full and fast engines, and the cost of verifying."""
+  html = load_large_test()
+  print('%-20s %10s' % ('engine', 'ms/call'))
+  for name, minifier in (
+      ('full', htmlmin.Minifier()),
+      ('fast', htmlmin.Minifier(engine='fast')),
+      ('fast, verify 10%', htmlmin.Minifier(engine='fast', verify_rate=0.1,
+                                            on_divergence=lambda *a: None))):
+    print('%-20s %10.2f' % (
+      name, best_of(lambda: minifier.minify(html), number=10) * 1000))
+
+def bench_skip():
+  """Cost of passing already minified HTML through minify() again."""
+  html = htmlmin.minify(
+    '<div class=row><p>Some text and <a href=/a/b>a link</a>.</p></div> '
+    * 5000)
+  print('%-20s %10s' % ('mode', 'ms/call'))
+  for name, minifier in (
+      ('minify', htmlmin.Minifier()),
+      ('minified_marker', htmlmin.Minifier(minified_marker=True)),
+      ('detect_minified', htmlmin.Minifier(detect_minified=True))):
+    inp = html + '<!--htmlmin-->' if name == 'minified_marker' else html
+    print('%-20s %10.3f' % (
+      name, best_of(lambda: minifier.minify(inp), number=10) * 1000))
+
+def bench_stats():
+  """Breaks down where the time goes, and what collecting that costs."""
+  html = load_large_test()
+  plain = htmlmin.Minifier()
+  minifier = htmlmin.Minifier(stats=True)
+  print('%-20s %10.2f' % ('without stats (ms)',
+                          best_of(lambda: plain.minify(html)) * 1000))
+  print('%-20s %10.2f' % ('with stats (ms)',
+                          best_of(lambda: minifier.minify(html)) * 1000))
+  times = minifier.last_stats.to_dict()['time']
+  for name in ('tokenizer', 'build_tag', 'join'):
+    print('  %-18s %10.2f' % (name, times[name] * 1000))
+  for name, value in sorted(times['handlers'].items()):
+    print('  %-18s %10.2f' % ('handle ' + name, value * 1000))
+
+def bench_gzip():
+  """Minifying then gzipping a response, versus the middleware's streaming
+  gzip."""
+  html = load_large_test()
+  chunks = [html[i:i + 8192] for i in range(0, len(html), 8192)]
+  def app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/html')])
+    return chunks
+  environ = {'HTTP_ACCEPT_ENCODING': 'gzip'}
+  start_response = lambda status, headers, exc_info=None: None
+  plain = htmlmin.middleware.HTMLMinMiddleware(app)
+  streaming = htmlmin.middleware.HTMLMinMiddleware(app, gzip=True)
+
+  def minify_then_gzip():
+    body = ''.join(plain(environ, start_response)).encode('utf-8')
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=6) as f:
+      f.write(body)
+    return out.getvalue()
+
+  print('%-20s %10s' % ('mode', 'ms/call'))
+  print('%-20s %10.2f' % ('minify, then gzip',
+                          best_of(minify_then_gzip) * 1000))
+  print('%-20s %10.2f' % ('streaming gzip', best_of(
+    lambda: b''.join(streaming(environ, start_response))) * 1000))
+
+def gzip_size(text):
+  out = io.BytesIO()
+  with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=6) as f:
+    f.write(text.encode('utf-8'))
+  return len(out.getvalue())
+
+def shuffled_cards(n=2000, seed=0):
+  """Repeated markup whose attributes and class names come in varying
+  orders, as from templates written by different hands."""
+  rng = random.Random(seed)
+  def tag(name, attrs):
+    attrs = list(attrs)
+    rng.shuffle(attrs)
+    return '<%s %s>' % (name, ' '.join('%s="%s"' % a for a in attrs))
+  def classes(*names):
+    names = list(names)
+    rng.shuffle(names)
+    return ' '.join(names)
+  cards = []
+  for i in range(n):
+    cards.append(
+      tag('div', [('class', classes('card', 'card-product', 'shadow')),
+                  ('id', 'p%d' % i), ('data-sku', str(1000 + i))]) +
+      tag('a', [('href', '/p/%d' % i), ('title', 'Product %d' % i),
+                ('class', classes('card-link', 'stretched'))]) +
+      tag('img', [('src', '/img/%d.jpg' % i), ('alt', 'Product %d' % i),
+                  ('width', '200'), ('height', '200'),
+                  ('loading', 'lazy')]) +
+      '</a>' + tag('span', [('class', classes('price', 'bold')),
+                            ('itemprop', 'price')]) +
+      '%d.99</span></div>\n' % i)
+  return ''.join(cards)
+
+def bench_canonical():
+  """Sizes before and after gzip with and without canonical attribute
+  order."""
+  print('%-20s %-42s %10s %10s' % ('input', 'options', 'chars', 'gzipped'))
+  for name, html in (('large_test.html', load_large_test()),
+                     ('shuffled cards', shuffled_cards())):
+    for options in ({}, {'canonicalize_attributes': True},
+                    {'canonicalize_attributes': True,
+                     'sort_class_names': True}):
+      out = htmlmin.minify(html, **options)
+      print('%-20s %-42s %10d %10d' % (
+        name, ','.join(sorted(options)) or '(defaults)', len(out),
+        gzip_size(out)))
+
+def bench_adversarial():
+  """How minification time grows with the size of adversarial input.
+
+  For each shape, prints the time per character at sizes from 1KB to 10MB.
+  Those should stay roughly the same; if they grow with the size, the shape
+  takes more than linear time. A shape is cut short once one size takes over
+  10 seconds.
+  """
+  sizes = (1000, 10000, 100000, 1000000, 10000000)
+  print('%-24s' % 'ns/char' + ''.join('%10s' % ('%dK' % (n // 1000))
+                                      for n in sizes))
+  for name, make in sorted(ADVERSARIAL_INPUTS.items()):
+    row = []
+    for n in sizes:
+      html = make(n)
+      seconds = best_of(lambda: htmlmin.minify(html), number=1,
+                        repeat=1 if n > 100000 else 3)
+      row.append('%10.0f' % (seconds / len(html) * 1e9))
+      if seconds > 10:
+        break
+    print('%-24s' % name + ''.join(row))
+
+BENCHMARKS = {
+  'adversarial': bench_adversarial,
+  'canonical': bench_canonical,
+  'engines': bench_engines,
+  'fragments': bench_fragments,
+  'gzip': bench_gzip,
+  'options': bench_options,
+  'parallel': bench_parallel,
+  'savings': bench_savings,
+  'skip': bench_skip,
+  'snapshot': bench_snapshot,
+  'stats': bench_stats,
+  'stages': bench_stages,
+}
+
+def main(argv=None):
+  names = (argv if argv is not None else sys.argv[1:]) or sorted(BENCHMARKS)
+  for name in names:
+    print('== %s ==' % name)
+    BENCHMARKS[name]()
+
+if __name__ == '__main__':
+  main()
@@ -31,6 +31,8 @@ import unittest
 import htmlmin
 from htmlmin.decorator import htmlmin as htmlmindecorator
 from htmlmin.middleware import HTMLMinMiddleware
+from htmlmin.metrics import Histogram
+from htmlmin import css, report, tokens
 
 from . import test_escape
 
@@ -181,6 +183,10 @@ FEATURES_TEXTS = {
     ('<body><div id=x> A </div>'
      '<div id="  y "> B </div><div> C </div> <div>D</div> </body>'),
   ),
+  'remove_empty_mixed_space': (
+    '<body><div>A</div> \t <div>B</div>\t\r\x0c<div>C</div> </body>',
+    '<body><div>A</div> <div>B</div><div>C</div> </body>',
+  ),
   'remove_all_empty': (
     ('<body>  \n  <div id=x  >  A </div>\r'
      '<div id="  y ">  B    </div>\r\n  <div> C </div>  <div>D</div> </body>'),
@@ -233,6 +239,158 @@ FEATURES_TEXTS = {
     '<input pre-value="&#34;&#39;&#39;&#39;&lt;&#46;&pi;&gt; &#34;">',
     '<input value=&#34;&#39;&#39;&#39;&lt;&#46;&pi;&gt; &#34;>',
   ),
+  'remove_optional_tags': (
+    (
+      '<!DOCTYPE html><html><head><title>x</title></head><body><p>a</p>'
+      '</body></html>',
+      '<!DOCTYPE html><title>x</title><p>a',
+    ),
+    (
+      '<ul><li>a</li><li>b</li></ul><dl><dt>c</dt><dd>d</dd></dl>',
+      '<ul><li>a<li>b</ul><dl><dt>c<dd>d</dl>',
+    ),
+    (
+      '<table><thead><tr><th>a</th></tr></thead><tbody><tr><td>1</td>'
+      '<td>2</td></tr></tbody><tbody><tr><td>3</td></tr></tbody></table>',
+      '<table><thead><tr><th>a<tbody><tr><td>1<td>2<tbody><tr><td>3</table>',
+    ),
+    (
+      '<select><option>a</option><optgroup><option>b</option></optgroup>'
+      '</select>',
+      '<select><option>a<optgroup><option>b</select>',
+    ),
+    # Space and comments that follow keep a tag, as do attributes.
+    (
+      '<html lang=en><body> <ul><li>a</li> <li>b</li><!--c--><li>d</li></ul>',
+      '<html lang=en><body> <ul><li>a</li> <li>b</li><!--c--><li>d</ul>',
+    ),
+    # p elements that end with an a element or are followed by inline content.
+    (
+      '<a><p>x</p></a><div><p>y</p><span>z</span><p>w</p></div>',
+      '<a><p>x</p></a><div><p>y</p><span>z</span><p>w</div>',
+    ),
+    # End tags that also close other elements, that close nothing, or that
+    # end the input.
+    (
+      '<li><b>x</li><li>y</li></p><li>z</li>',
+      '<li><b>x</li><li>y</li></p><li>z</li>',
+    ),
+    # The body start tag stays in front of noscript, and a caption's end tag
+    # in front of text.
+    (
+      '<html><head></head><body><noscript><p>x</p></noscript></body></html>',
+      '<body><noscript><p>x</p></noscript>',
+    ),
+    (
+      '<table><caption>c</caption>x</table>'
+      '<table><caption>c</caption><tr><td>y</td></tr></table>',
+      '<table><caption>c</caption>x</table>'
+      '<table><caption>c<tr><td>y</table>',
+    ),
+  ),
+  'remove_redundant_attributes': (
+    '<script type="text/javascript" language=JavaScript src=a.js></script>'
+    '<script type=module></script><script language=vbscript></script>'
+    '<style type=" TEXT/CSS ">p {}</style>'
+    '<form method="GET" enctype="application/x-www-form-urlencoded">'
+    '<input type="text" class="" id="" style name=a><input type=hidden>'
+    '<button type=submit pre-type=submit>x</button></form>'
+    '<table><tr><td colspan=1 rowspan=2>y</td></tr></table>',
+    '<script src=a.js></script>'
+    '<script type=module></script><script language=vbscript></script>'
+    '<style>p {}</style>'
+    '<form>'
+    '<input name=a><input type=hidden>'
+    '<button type=submit>x</button></form>'
+    '<table><tr><td rowspan=2>y</td></tr></table>',
+  ),
+  'canonicalize_attributes': (
+    '<a title=x data-b=1 href=y class=" b  a b" data-a=2 title=z>t</a>'
+    '<a class="b a" href=y title=x data-b=1 data-a=2>t</a>'
+    '<input value=a type=text value=b/ /><p pre-class=b>x</p>',
+    '<a class="b a" href=y title=x data-a=2 data-b=1>t</a>'
+    '<a class="b a" href=y title=x data-a=2 data-b=1>t</a>'
+    '<input type=text value=a><p class=b>x</p>',
+  ),
+  'minify_json': (
+    '<script type="application/ld+json">\n{\n  "name": "a  b </p>",\n'
+    '  "n": [1.50, 2e10],\n  "q": "x\\" y"\n}\n</script>'
+    '<script type="application/json; charset=utf-8">[ 1, 2 ]</script>'
+    '<script type=importmap pre>{ "imports": {} }</script>'
+    '<script type=application/json>{ "a": </script>'
+    '<script>var a = { "x" : 1 };</script><pre> [ 1 ] </pre>',
+    '<script type=application/ld+json>{"name":"a  b </p>",'
+    '"n":[1.50,2e10],"q":"x\\" y"}</script>'
+    '<script type="application/json; charset=utf-8">[1,2]</script>'
+    '<script type=importmap>{ "imports": {} }</script>'
+    '<script type=application/json>{ "a": </script>'
+    '<script>var a = { "x" : 1 };</script><pre> [ 1 ] </pre>',
+  ),
+  'minify_css': (
+    '<style>\n  /* nav */\n  a  >  b , .c::after { content : " ;  } " ; }\n'
+    '  .d\\; e { margin : 0 ; ; }\n</style>'
+    '<style pre> a { b : c } </style>'
+    '<pre><style> a { b : c } </style></pre>'
+    '<p style=" color : red ; ">x</p><p pre-style="a:b;">y</p>'
+    '<p style=" ">z</p>',
+    '<style>a > b,.c::after{content :" ;  } "}.d\\; e{margin :0}</style>'
+    '<style> a { b : c } </style>'
+    '<pre><style> a { b : c } </style></pre>'
+    '<p style=color:red>x</p><p style=a:b;>y</p><p style>z</p>',
+  ),
+  'minify_svg': (
+    '<svg xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape" '
+    'viewBox=" 0 0 24.000 24 " inkscape:version="1.0">\n'
+    '  <metadata><rdf:RDF><cc:Work>a &amp; b<br></cc:Work></rdf:RDF>'
+    '</metadata>\n'
+    '  <sodipodi:namedview pagecolor="#fff"><inkscape:grid/>'
+    '</sodipodi:namedview>\n'
+    '  <g transform="translate( 10.0000 , 20 ) scale(0.33333333)">'
+    '<path d="M 10.123456 -20 L 30,40 L .5 .5 A 1 1 0 0 1 2 2 Z" '
+    'inkscape:label="x"/><polygon points="0,0 10.55555,0 10,10"/>'
+    '<path pre d="M 1.00000 1"/><path d="M 1 2 3"/></g>\n'
+    '</svg><p>a</p><svg><metadata>x</svg><p>b</p>',
+    '<svg viewbox="0 0 24 24"> <g transform="translate(10 20) scale(.333)">'
+    '<path d="M10.123-20L30 40 .5.5A1 1 0 0 1 2 2Z"/>'
+    '<polygon points="0 0 10.556 0 10 10"/><path d="M 1.00000 1"/>'
+    '<path d="M 1 2 3"/></g> </svg><p>a</p><svg></svg><p>b</p>',
+  ),
+  'base_url': (
+    '<link rel=stylesheet href="https://example.com/static/a.css">'
+    '<a href="https://example.com/docs/intro?a=1&amp;b=2#c">a</a>'
+    '<a href="https://example.com/docs/page#top">b</a>'
+    '<a href="http://example.com/docs/x">c</a>'
+    '<img src="https://cdn.example.com/i.png" '
+    'srcset="https://example.com/docs/i.png 1x,https://example.com/i,2.png 2x">'
+    '<form action="https://example.com/docs/a:b"></form>'
+    '<a href="https://example.com/docs/../x">d</a>',
+    '<link rel=stylesheet href=/static/a.css>'
+    '<a href="intro?a=1&b=2#c">a</a><a href=#top>b</a>'
+    '<a href=http://example.com/docs/x>c</a>'
+    '<img src=//cdn.example.com/i.png srcset="i.png 1x,/i,2.png 2x">'
+    '<form action=./a:b></form>'
+    '<a href=//example.com/docs/../x>d</a>',
+  ),
+  'shorten_charrefs': (
+    '<title>It&rsquo;s</title><p>It&#8217;s &amp; &lt;b&gt; &#x27;&nbsp;'
+    '&hellip; &#60; &#32; &am&#112;; &foo; &notit;</p>'
+    '<pre>&#10;&rsquo;</pre><p title="&rsquo;">&eacute;</p>',
+    '<title>It\u2019s</title><p>It\u2019s &amp; &lt;b> \'\xa0'
+    '\u2026 &lt; &#32; &am&#112;; &foo; &notit;</p>'
+    '<pre>&#10;&rsquo;</pre><p title=\u2019>\xe9</p>',
+  ),
+  'remove_block_space': (
+    '<div>\n  <p> Some <b>bold</b> <i>text</i> here. </p>\n  <ul>\n'
+    '    <li> One </li>\n    <li>Two\n  </ul>\n'
+    '  <table> <tr> <td> a </td> <td>b</td> </tr> </table>\n'
+    '  <select> <option>x</option> </select>\n'
+    '  <pre> keep  </pre> <span> after </span> line<br> next\n'
+    '</div> </div> <td> x </td> tail',
+    '<div><p>Some <b>bold</b> <i>text</i> here.</p><ul><li>One</li><li>Two'
+    '</ul><table><tr><td>a</td><td>b</td></tr></table><select><option>x'
+    '</option></select><pre> keep  </pre> <span> after </span> line<br>next'
+    '</div></div> <td> x </td> tail',
+  ),
 }
 
 SELF_CLOSE_TEXTS = {
@@ -387,6 +545,69 @@ class TestMinifierObject(HTMLMinTestCase):
     self.assertEqual(self.minify(dangling_tag[0]), dangling_tag[1])
     self.assertEqual(self.minify(dangling_tag_followup[0]), dangling_tag_followup[1])
 
+  def test_minify_fragments(self):
+    fragments = [text[0] for text in self.__reference_texts__.values()]
+    self.minifier.input('<pre>  dangling ')
+    self.assertEqual(self.minifier.minify_fragments(fragments),
+                     [htmlmin.minify(fragment) for fragment in fragments])
+    self.assertEqual(self.minifier.minify_fragments(iter(['  a  ', ''])),
+                     [' a ', ''])
+
+  def test_minify_fragments_per_document_options(self):
+    fragments = ['<p>  a  </p>', '<p>b</p><!--htmlmin-->', '<p>c</p>']
+    for options in (dict(minified_marker=True), dict(detect_minified=True),
+                    dict(stats=True), dict(engine='fast', verify_rate=1)):
+      minifier = htmlmin.Minifier(**options)
+      reference = htmlmin.Minifier(**options)
+      self.assertEqual(minifier.minify_fragments(fragments),
+                       [reference.minify(fragment) for fragment in fragments])
+      self.assertEqual(minifier.counters, reference.counters)
+    minifier = htmlmin.Minifier(stats=True)
+    minifier.minify_fragments(fragments)
+    self.assertEqual(minifier.last_stats.bytes_in, len(fragments[-1]))
+
+  def test_flush(self):
+    import codecs
+    with codecs.open('htmlmin/tests/large_test.html', encoding='utf-8') as inpf:
+      inp = inpf.read()
+    output = []
+    for i in range(0, len(inp), 1000):
+      self.minifier.input(inp[i:i + 1000])
+      output.append(self.minifier.flush())
+    output.append(self.minifier.finalize())
+    self.assertEqual(''.join(output), htmlmin.minify(inp))
+    self.minifier.input('\n <!DOCTYPE html>')
+    self.assertEqual(self.minifier.flush(), '')
+    self.minifier.input('<p>  a  ')
+    self.assertEqual(self.minifier.flush(), '<!DOCTYPE html><p>')
+    self.minifier.input('  </p><!DOCTYPE html>')
+    self.assertEqual(self.minifier.finalize(), ' a </p><!DOCTYPE html>')
+
+  def test_deadline(self):
+    import functools
+    import itertools
+    import htmlmin.main
+    html = ('<p>  a  </p>  <pre>  b  </pre>   <p title="x">  c  </p>'
+            '  <p>  d </p>')
+    self.assertEqual(self.minifier.minify(html, deadline=60),
+                     self.minifier.minify(html))
+    self.assertEqual(self.minifier.minify(html, deadline=-1), html)
+    self.assertEqual(self.minifier.counters['deadline_exceeded'], 1)
+    self.assertRaises(TypeError, self.minifier.minify, html, deadlin=1)
+
+    # A clock that ticks once for each slice fed in.
+    timer, slice = htmlmin.main.timer, htmlmin.main.DEADLINE_SLICE
+    htmlmin.main.timer = functools.partial(next, itertools.count())
+    htmlmin.main.DEADLINE_SLICE = 10
+    try:
+      # Cut off inside the second <p> tag, part of which the parser holds.
+      self.assertEqual(
+        self.minifier.minify(html, deadline=4.5),
+        '<p> a </p> <pre>  b  </pre> <p title="x">  c  </p>  <p>  d </p>')
+    finally:
+      htmlmin.main.timer, htmlmin.main.DEADLINE_SLICE = timer, slice
+    self.assertEqual(self.minifier.minify(html), htmlmin.minify(html))
+
   def test_buffered_input(self):
     text = self.__reference_texts__['long_text']
     self.minifier.input(text[0][:len(text[0]) // 2])
@@ -458,6 +679,10 @@ class TestMinifyFeatures(HTMLMinTestCase):
     text = self.__reference_texts__['remove_empty']
     self.assertEqual(htmlmin.minify(text[0], remove_empty_space=True), text[1])
 
+  def test_remove_empty_mixed_space(self):
+    text = self.__reference_texts__['remove_empty_mixed_space']
+    self.assertEqual(htmlmin.minify(text[0], remove_empty_space=True), text[1])
+
   def test_remove_all_empty(self):
     text = self.__reference_texts__['remove_all_empty']
     self.assertEqual(htmlmin.minify(text[0], remove_all_empty_space=True),
@@ -479,11 +704,482 @@ class TestMinifyFeatures(HTMLMinTestCase):
     text = self.__reference_texts__['dont_minify_scripts_or_styles']
     self.assertEqual(htmlmin.minify(text[0], pre_tags=[]), text[1])
 
+  def test_remove_optional_tags(self):
+    texts = self.__reference_texts__['remove_optional_tags']
+    minifier = htmlmin.Minifier(remove_optional_tags=True)
+    for text in texts:
+      self.assertEqual(htmlmin.minify(text[0], remove_optional_tags=True),
+                       text[1])
+      self.assertEqual(minifier.minify_tokens(minifier.tokenize(text[0])),
+                       text[1])
+    self.assertEqual(minifier.minify_fragments([t[0] for t in texts]),
+                     [t[1] for t in texts])
+    self.assertEqual(
+      htmlmin.minify('<ul>\n  <li>a</li>\n  <li>b</li>\n</ul>',
+                     remove_optional_tags=True, remove_empty_space=True),
+      '<ul><li>a<li>b</ul>')
+    self.assertRaises(ValueError, htmlmin.Minifier, remove_optional_tags=True,
+                      engine='fast')
+
+  def test_remove_redundant_attributes(self):
+    text = self.__reference_texts__['remove_redundant_attributes']
+    self.assertEqual(
+      htmlmin.minify(text[0], remove_redundant_attributes=True), text[1])
+    self.assertEqual(
+      htmlmin.minify(text[0], remove_redundant_attributes=True, engine='fast'),
+      text[1])
+
+  def test_remove_redundant_script_type_with_language(self):
+    # A type has to stay when a language that isn't JavaScript does.
+    for engine in ('full', 'fast'):
+      minify = lambda html: htmlmin.minify(
+        html, remove_redundant_attributes=True, engine=engine)
+      self.assertEqual(
+        minify('<script type="text/javascript" language="vbscript"></script>'
+               '<script type="" language=VBScript></script>'),
+        '<script type=text/javascript language=vbscript></script>'
+        '<script type language=VBScript></script>')
+      self.assertEqual(
+        minify('<script type="text/javascript" language="JavaScript">'
+               '</script><script language=javascript></script>'),
+        '<script></script><script></script>')
+
+  def test_canonicalize_attributes(self):
+    text = self.__reference_texts__['canonicalize_attributes']
+    self.assertEqual(
+      htmlmin.minify(text[0], canonicalize_attributes=True), text[1])
+    self.assertEqual(
+      htmlmin.minify(text[0], canonicalize_attributes=True,
+                     sort_class_names=True),
+      text[1].replace('"b a"', '"a b"'))
+    self.assertEqual(
+      htmlmin.minify('<a title=x class=" b  a b">t</a>', sort_class_names=True),
+      '<a title=x class="a b">t</a>')
+
+  def test_minify_json(self):
+    text = self.__reference_texts__['minify_json']
+    self.assertEqual(htmlmin.minify(text[0], minify_json=True), text[1])
+    self.assertEqual(htmlmin.minify(text[0], minify_json=True, engine='fast'),
+                     text[1])
+
+  def test_minify_css(self):
+    text = self.__reference_texts__['minify_css']
+    self.assertEqual(htmlmin.minify(text[0], minify_css=True), text[1])
+    self.assertEqual(htmlmin.minify(text[0], minify_css=True, engine='fast'),
+                     text[1])
+    hits = css.CACHE.stats()['hits']
+    htmlmin.minify(text[0], minify_css=True)
+    self.assertGreater(css.CACHE.stats()['hits'], hits)
+
+  def test_minify_svg(self):
+    text = self.__reference_texts__['minify_svg']
+    self.assertEqual(htmlmin.minify(text[0], minify_svg=True), text[1])
+    self.assertEqual(
+      htmlmin.minify('<svg><path d="M 1.23456 0"/></svg>', minify_svg=True,
+                     svg_precision=None),
+      '<svg><path d="M1.23456 0"/></svg>')
+    self.assertEqual(htmlmin.minify('<metadata> a </metadata>',
+                                    minify_svg=True),
+                     '<metadata> a </metadata>')
+    self.assertRaises(ValueError, htmlmin.Minifier, minify_svg=True,
+                      engine='fast')
+
+  def test_base_url(self):
+    text = self.__reference_texts__['base_url']
+    base_url = 'https://example.com/docs/page'
+    self.assertEqual(htmlmin.minify(text[0], base_url=base_url), text[1])
+    self.assertEqual(
+      htmlmin.minify(text[0], base_url=base_url, engine='fast'), text[1])
+    for engine in ('full', 'fast'):
+      self.assertEqual(
+        htmlmin.minify('<!-- <base href="/x/"> --><base href="/static/">'
+                       '<a href="https://example.com/static/b.js">a</a>'
+                       '<base href="/y/"><a href="/z">b</a>',
+                       base_url=base_url, engine=engine),
+        '<!-- <base href="/x/"> --><base href=/static/ ><a href=b.js>a</a>'
+        '<base href=/y/ ><a href=/z>b</a>')
+
+  def test_shorten_charrefs(self):
+    text = self.__reference_texts__['shorten_charrefs']
+    for engine in ('full', 'fast'):
+      self.assertEqual(
+        htmlmin.minify(text[0], shorten_charrefs=True, engine=engine),
+        text[1])
+    self.assertEqual(
+      htmlmin.minify('<p>&#8217;&hellip;&#xe9;&eacute;</p>',
+                     shorten_charrefs=True, output_encoding='ascii'),
+      '<p>&#8217;&mldr;&#xe9;&#233;</p>')
+    self.assertEqual(
+      htmlmin.minify('<p>&hellip;&eacute;</p>', shorten_charrefs=True,
+                     convert_charrefs=False, output_encoding='latin-1'),
+      '<p>&mldr;\xe9</p>')
+
+  def test_remove_block_space(self):
+    text = self.__reference_texts__['remove_block_space']
+    self.assertEqual(htmlmin.minify(text[0], remove_block_space=True),
+                     text[1])
+    self.assertEqual(
+      htmlmin.minify('<head> <title>a</title> </head> <p>b <div>c</div>',
+                     remove_block_space=True),
+      '<head><title>a</title></head><p>b<div>c</div>')
+    self.assertRaises(ValueError, htmlmin.minify, '<p>a</p>',
+                      remove_block_space=True, engine='fast')
+
   def test_convert_charrefs_false(self):
     text = self.__reference_texts__['convert_charrefs_false']
     self.assertEqual(htmlmin.minify(text[0], convert_charrefs=False), text[1])
 
 
+class TestTokenStream(HTMLMinTestCase):
+  def setUp(self):
+    HTMLMinTestCase.setUp(self)
+    self.minifier = htmlmin.Minifier()
+
+  def test_reference_texts(self):
+    for texts in (MINIFY_FUNCTION_TEXTS, FEATURES_TEXTS, SELF_CLOSE_TEXTS,
+                  SELF_OPENING_TEXTS):
+      for text in texts.values():
+        if isinstance(text[0], tuple):
+          continue
+        stream = self.minifier.tokenize(text[0])
+        self.assertEqual(self.minifier.minify_tokens(stream),
+                         self.minifier.minify(text[0]))
+
+  def test_large_test(self):
+    import codecs
+    with codecs.open('htmlmin/tests/large_test.html', encoding='utf-8') as inpf:
+      inp = inpf.read()
+    stream = self.minifier.tokenize(inp)
+    for options in ({}, {'remove_comments': True},
+                    {'remove_all_empty_space': True}):
+      minifier = htmlmin.Minifier(**options)
+      self.assertEqual(minifier.minify_tokens(stream), minifier.minify(inp))
+
+  def test_token_spans(self):
+    stream = tokens.tokenize('<!-- a --><p class=x>b &amp; c</p>')
+    spans = [(kind, stream.source[start:end]) for kind, start, end in
+             zip(stream.kinds, stream.starts, stream.ends)]
+    self.assertEqual(spans, [
+      (tokens.COMMENT, ' a '),
+      (tokens.STARTTAG, '<p class=x>'),
+      (tokens.DATA, 'b &amp; c'),
+      (tokens.ENDTAG, '</p>'),
+    ])
+    self.assertEqual(stream.tags, [('p', [('class', 'x')]), ('p',)])
+
+  def test_convert_charrefs_mismatch(self):
+    stream = tokens.tokenize('<p>x</p>', convert_charrefs=False)
+    self.assertRaises(ValueError, self.minifier.minify_tokens, stream)
+
+class TestParallel(HTMLMinTestCase):
+  def assertParallelMatches(self, html, **kwargs):
+    minifier = htmlmin.Minifier(**kwargs)
+    self.assertEqual(
+      minifier.minify_parallel(html, processes=2, segment_size=500),
+      minifier.minify(html))
+
+  def test_large_test(self):
+    import codecs
+    with codecs.open('htmlmin/tests/large_test.html', encoding='utf-8') as inpf:
+      inp = inpf.read()
+    for options in ({}, {'remove_comments': True},
+                    {'remove_all_empty_space': True},
+                    {'convert_charrefs': False}):
+      minifier = htmlmin.Minifier(**options)
+      self.assertEqual(
+        minifier.minify_parallel(inp, processes=2, segment_size=20000),
+        minifier.minify(inp))
+
+  def test_split_inside_raw_text(self):
+    self.assertParallelMatches(
+      '<body>' + ('<div>  a  </div>\n' * 30 + '<script>\n<div>  b  </div>\n'
+                  '</script><!--\n<div>  c  </div>\n--><p title="\n<div>">'
+                  '  d\n') * 5)
+
+  def test_split_inside_svg_metadata(self):
+    self.assertParallelMatches(
+      ('<div>  a  </div>\n' * 30 + '<svg><metadata>\n<div>  b  </div>\n' +
+       '<p> c </p>\n' * 30 + '</metadata><path d="M 0 0"/></svg>') * 3,
+      minify_svg=True)
+
+  def test_split_inside_pre(self):
+    self.assertParallelMatches(
+      ('<div>  a  </div>\n' * 30 + '<section pre>\n<div>  b  </div>\n'
+       '</section><textarea>\n<div>  c  </div>\n</textarea>') * 5)
+
+  def test_title_whitespace_carries_over(self):
+    self.assertParallelMatches(
+      '<html><head><title>a </title></head><body>' +
+      '<div> x </div>\n' * 50 + '<head><title> b</title></head>' +
+      '<div> y </div>\n' * 50)
+
+  def test_fast_engine(self):
+    self.assertParallelMatches(
+      '<div>  a  </div>\n' * 100 + '<p title="x"> b </p>', engine='fast')
+
+class TestSnapshot(HTMLMinTestCase):
+  def assertResumes(self, prefix, suffix, **kwargs):
+    layout = htmlmin.Minifier(**kwargs)
+    layout.input(prefix)
+    snapshot = layout.snapshot()
+    for _ in range(2):
+      minifier = htmlmin.Minifier(**kwargs)
+      minifier.restore(snapshot)
+      minifier.input(suffix)
+      self.assertEqual(minifier.finalize(),
+                       htmlmin.minify(prefix + suffix, **kwargs))
+
+  def test_large_test(self):
+    import codecs
+    with codecs.open('htmlmin/tests/large_test.html', encoding='utf-8') as inpf:
+      inp = inpf.read()
+    # Cut in text, inside tags, inside scripts and inside comments.
+    for cut in (100, 5000, 5003, 20011, 100000):
+      self.assertResumes(inp[:cut], inp[cut:], remove_comments=True)
+
+  def test_leading_space_before_doctype(self):
+    self.assertResumes('\n\n', '<!DOCTYPE html>\n<body>  X  </body>')
+
+  def test_restore_discards_state(self):
+    layout = htmlmin.Minifier()
+    layout.input('<head>  <title> a  ')
+    snapshot = layout.snapshot()
+    self.minifier = htmlmin.Minifier()
+    self.minifier.input('<pre>  x  ')
+    self.minifier.restore(snapshot)
+    self.minifier.input(' b  </title></head>')
+    self.assertEqual(self.minifier.finalize(),
+                     '<head><title>a b</title></head>')
+
+class TestFastEngine(HTMLMinTestCase):
+  def assertSameAsFull(self, inp, **kwargs):
+    self.assertEqual(htmlmin.minify(inp, engine='fast', **kwargs),
+                     htmlmin.minify(inp, **kwargs))
+
+  def test_large_test(self):
+    import codecs
+    with codecs.open('htmlmin/tests/large_test.html', encoding='utf-8') as inpf:
+      # The fast engine doesn't track the parent's lang.
+      inp = inpf.read().replace(' lang="en"', '')
+    self.assertSameAsFull(inp)
+    self.assertSameAsFull(inp, remove_comments=True, remove_empty_space=True)
+    self.assertSameAsFull(inp, remove_all_empty_space=True,
+                          reduce_boolean_attributes=True)
+
+  def test_templates(self):
+    for inp in (
+        '\n <!DOCTYPE html>\n<html>\n <head>\n  <title>  A  title </title>'
+        '\n  <style>  p  { }  </style>\n </head>\n <body>\n',
+        '<p>a <!-- b -->  <!-- c --> d <br pre>  e  </br>  f</p>',
+        '<div class="x"  id=\'y\' hidden="hidden">  <PRE>  a  </pre>  </div>',
+        '<div pre><div>  a  </div>  b  </div>  c  <script pre>  d  </script>  ',
+        '<textarea>  <!--! a -->  </ textarea  >  <input value="a b"/>'):
+      self.assertSameAsFull(inp)
+      self.assertSameAsFull(inp, remove_comments=True,
+                            remove_all_empty_space=True)
+
+  def test_verify(self):
+    divergences = []
+    minifier = htmlmin.Minifier(
+      engine='fast', verify_rate=1,
+      on_divergence=lambda *args: divergences.append(args))
+    self.assertEqual(minifier.minify('<p>  a  </p>'), '<p> a </p>')
+    inp = '<body lang=en><p lang=en>  a  </p>'
+    self.assertEqual(minifier.minify(inp), htmlmin.minify(inp))
+    self.assertEqual(divergences, [
+      (inp, '<body lang=en><p lang=en> a </p>', htmlmin.minify(inp))])
+    self.assertEqual(minifier.counters['verified'], 2)
+    self.assertEqual(minifier.counters['diverged'], 1)
+
+  def test_verify_requires_fast_engine(self):
+    self.assertRaises(ValueError, htmlmin.Minifier, verify_rate=0.5)
+
+class TestSkipMinified(HTMLMinTestCase):
+  def test_minified_marker(self):
+    minifier = htmlmin.Minifier(minified_marker=True)
+    result = minifier.minify('<p>  a  </p>')
+    self.assertEqual(result, '<p> a </p><!--htmlmin-->')
+    self.assertEqual(minifier.minify(result), result)
+    self.assertEqual(minifier.minify('<p>  a', '  </p><!--htmlmin-->'),
+                     '<p>  a  </p><!--htmlmin-->')
+    self.assertEqual(minifier.counters['skipped_marker'], 2)
+
+  def test_detect_minified(self):
+    minifier = htmlmin.Minifier(detect_minified=True)
+    self.assertEqual(minifier.minify('<p class=a> a </p>'),
+                     '<p class=a> a </p>')
+    self.assertEqual(minifier.counters['skipped_detected'], 1)
+    for inp in ('<p> a  </p>', '<p class="a">a</p>', '<P>a</P>', '<br/>',
+                '<p> a </p><!-- b -->', '<head> <title>a</title></head>',
+                '<p lang=en><b lang=en>a</b></p>'):
+      self.assertEqual(minifier.minify(inp), htmlmin.minify(inp))
+    self.assertEqual(minifier.counters['skipped_detected'], 1)
+
+  def test_detect_minified_is_conservative(self):
+    texts = [text[0] for texts in (FEATURES_TEXTS, SELF_CLOSE_TEXTS,
+                                   SELF_OPENING_TEXTS)
+             for text in texts.values() if not isinstance(text[0], tuple)]
+    for options in ({}, {'remove_comments': True,
+                         'remove_all_empty_space': True,
+                         'reduce_boolean_attributes': True},
+                    {'remove_optional_attribute_quotes': False}):
+      minifier = htmlmin.Minifier(detect_minified=True, **options)
+      for text in texts:
+        text = htmlmin.minify(text, **options)
+        self.assertEqual(minifier.minify(text), htmlmin.minify(text, **options))
+
+class TestStats(HTMLMinTestCase):
+  def test_disabled(self):
+    minifier = htmlmin.Minifier()
+    self.assertEqual(minifier.minify('<p>  a  </p>'), '<p> a </p>')
+    self.assertEqual(minifier.last_stats, None)
+    self.assertFalse('handle_data' in minifier._parser.__dict__)
+
+  def test_stats(self):
+    minifier = htmlmin.Minifier(stats=True, remove_comments=True)
+    inp = '<!DOCTYPE html><p class="a" id=b>  a  <!-- c --> &amp; <br/></p>'
+    self.assertEqual(minifier.minify(inp), htmlmin.minify(inp,
+                                                          remove_comments=True))
+    stats = minifier.last_stats.to_dict()
+    self.assertEqual(stats['bytes_in'], len(inp))
+    self.assertEqual(stats['bytes_out'], len(minifier.minify(inp)))
+    self.assertEqual(stats['tokens'], {
+      'data': 2, 'starttag': 1, 'startendtag': 1, 'endtag': 1, 'comment': 1,
+      'decl': 1, 'pi': 0, 'unknown_decl': 0, 'charref': 0, 'entityref': 0})
+    self.assertEqual(stats['attributes'], 2)
+    self.assertEqual(stats['peak_buffer_items'], 8)
+    self.assertEqual(sorted(stats['time']), [
+      'build_tag', 'handlers', 'join', 'tokenizer', 'total'])
+    self.assertTrue(stats['time']['total'] >= stats['time']['build_tag'])
+
+  def test_json(self):
+    minifier = htmlmin.Minifier(stats=True, minify_json=True)
+    minifier.minify('<script type=application/json>[ 1, 2 ]</script>'
+                    '<script type=application/json>[ 1, </script>')
+    stats = minifier.last_stats.to_dict()
+    self.assertEqual(stats['json_blocks'], 2)
+    self.assertEqual(stats['json_saved'], 3)
+
+  def test_svg(self):
+    minifier = htmlmin.Minifier(stats=True, minify_svg=True)
+    minifier.minify('<svg inkscape:label=x><metadata></metadata>'
+                    '<path d="M 0 0"/></svg>')
+    stats = minifier.last_stats.to_dict()
+    self.assertEqual(stats['svg_dropped'], 1)
+    self.assertEqual(stats['svg_saved'], 16)
+
+  def test_input_and_tokens(self):
+    minifier = htmlmin.Minifier(stats=True)
+    minifier.input('<p>  a')
+    minifier.input('  </p>')
+    minifier.finalize()
+    self.assertEqual(minifier.last_stats.bytes_in, 12)
+    self.assertEqual(minifier.last_stats.tokens['data'], 2)
+    minifier.minify_tokens(minifier.tokenize('<b>x</b>'))
+    self.assertEqual(minifier.last_stats.tokens['starttag'], 1)
+    self.assertEqual(minifier.last_stats.bytes_out, 8)
+
+class TestReport(HTMLMinTestCase):
+  def test_report(self):
+    inp = ('<!DOCTYPE html><html lang=en><head><title> a  b </title></head>'
+           '<p lang="en" class="a"  id=b>  a  <!-- c --> <input disabled="">'
+           '</p><p>x</p></html>')
+    options = dict(remove_comments=True, remove_optional_tags=True)
+    result, savings = report.minify(inp, **options)
+    self.assertEqual(result, htmlmin.minify(inp, **options))
+    savings = savings.to_dict()
+    self.assertEqual(savings['bytes_in'], len(inp))
+    self.assertEqual(savings['bytes_out'], len(result))
+    self.assertEqual(
+      dict((k, v['saved']) for k, v in savings['categories'].items()), {
+        'whitespace': 3, 'title': 3, 'comments': 10, 'attribute_quotes': 2,
+        'attribute_values': 3, 'lang': 8, 'start_tags': 3,
+        'optional_tags': 24, 'json': 0, 'css': 0, 'svg': 0, 'other': 0})
+    self.assertEqual(savings['categories']['lang']['time'], None)
+    self.assertTrue(savings['time']['total'] >=
+                    savings['categories']['start_tags']['time'])
+
+  def test_adds_up(self):
+    inp = ('<svg><metadata>x</metadata></svg><script type=application/json>'
+           '[ 1 ]</script><style> a { } </style><pre>  a  </pre>'
+           '<p style="a : b">&amp;&#32; </p>\n\n<br/>')
+    result, savings = report.minify(inp, minify_json=True, minify_css=True,
+                                    minify_svg=True, remove_empty_space=True)
+    self.assertEqual(sum(savings.saved.values()), len(inp) - len(result))
+    self.assertEqual(savings.saved['json'], 2)
+    self.assertEqual(savings.saved['css'], 4)
+    self.assertEqual(savings.saved['svg'], 22)
+
+  def test_table(self):
+    savings = report.minify('<p>  a  </p>')[1]
+    table = savings.format_table().splitlines()
+    self.assertEqual(len(table), len(report.CATEGORIES) + 5)
+    self.assertTrue(table[2].startswith('Whitespace in text'))
+    self.assertEqual(table[2].split()[3:5], ['2', '100.0%'])
+
+class TestCommand(HTMLMinTestCase):
+  def run_command(self, inp, *args):
+    import io, os, shutil, sys, tempfile
+    from htmlmin import command
+    directory = tempfile.mkdtemp()
+    try:
+      in_path = os.path.join(directory, 'in.html')
+      out_path = os.path.join(directory, 'out.html')
+      with io.open(in_path, 'w', encoding='utf-8') as f:
+        f.write(inp)
+      argv = sys.argv
+      sys.argv = ['htmlmin'] + list(args) + [in_path, out_path]
+      try:
+        command.main()
+      finally:
+        sys.argv = argv
+      with io.open(out_path, encoding='utf-8') as f:
+        return f.read()
+    finally:
+      shutil.rmtree(directory)
+
+  def test_engines(self):
+    inp = '<html>\n  <body>\n    <p class="a">  b  </p>\n  </body>\n</html>\n'
+    for engine in ('full', 'fast'):
+      self.assertEqual(self.run_command(inp, '--engine', engine),
+                       htmlmin.minify(inp, engine=engine))
+
+  def test_finalized(self):
+    # Text at the very end is only handled once the input is closed.
+    self.assertEqual(self.run_command('<ul><li>a</li></ul>  b',
+                                      '--remove-optional-tags'),
+                     '<ul><li>a</ul> b')
+
+class TestAdversarialInput(HTMLMinTestCase):
+  def test_linear_time(self):
+    import timeit
+    from .benchmarks import ADVERSARIAL_INPUTS
+
+    def seconds(html, convert_charrefs):
+      return min(timeit.repeat(
+        lambda: htmlmin.minify(html, convert_charrefs=convert_charrefs),
+        number=1, repeat=3))
+
+    for convert_charrefs in (True, False):
+      for name, make in ADVERSARIAL_INPUTS.items():
+        small = seconds(make(5000), convert_charrefs)
+        large = seconds(make(50000), convert_charrefs)
+        # Ten times the input may take a bit over ten times as long, but
+        # nowhere near the hundred times a quadratic shape would.
+        self.assertLess(large, small * 30 + 0.05,
+                        (name, convert_charrefs))
+
+  def test_malformed_input(self):
+    for html, out in (
+        ('<p><body><div>x</div>', '<p><body><div>x</div>'),
+        ('<![x] y>z', '<!--[x] y-->z'),
+        ('<![if]>a', '<![if]>a'),
+        ('<a>  <b>x</a>  y', '<a> <b>x</a> y'),
+        ('<p>x</a> <a>y</a>', '<p>x</a> <a>y</a>'),
+        ('<a <b c', '<a <b c'),
+        ('<!-- a', '<!-- a')):
+      self.assertEqual(htmlmin.minify(html), out)
+
 class TestSelfClosingTags(HTMLMinTestCase):
   __reference_texts__ = SELF_CLOSE_TEXTS
 
@@ -526,6 +1222,13 @@ class TestMiddleware(HTMLMinTestCase):
                                 start_response))
     return response_status[0], response_headers[0], response_body
 
+  def call_raw(self, app, environ):
+    response_headers = []
+    def start_response(status, headers, exc_info=None):
+      response_headers.append(headers)
+    response_body = list(app(environ, start_response))
+    return response_headers[0], response_body
+
   def test_middlware(self):
     app = HTMLMinMiddleware(self.wsgi_app)
     status, headers, body = self.call_app(
@@ -587,6 +1290,218 @@ class TestMiddleware(HTMLMinTestCase):
       '    X    Y   ')
     self.assertTrue(any((h == 'X-HTML-Min-Enable' for h, v in headers)))
 
+  def test_middleware_metrics(self):
+    events = []
+    app = HTMLMinMiddleware(self.wsgi_app, route=lambda e: e['status'][:3],
+                            on_minify=events.append)
+    self.call_app(app, '200 OK', (('Content-Type', 'text/html'),),
+                  '    X    Y   ')
+    self.call_app(app, '404 Not Found', (('Content-Type', 'text/plain'),),
+                  '    X    Y   ')
+    self.call_app(app, '404 Not Found', (
+      ('Content-Type', 'text/html'), ('X-HTML-Min-Enable', 'False')), 'X')
+    snapshot = app.metrics.snapshot()
+    self.assertEqual(snapshot['200']['minified'], 1)
+    self.assertEqual(snapshot['200']['bytes_in'], 13)
+    self.assertEqual(snapshot['200']['bytes_out'], 5)
+    self.assertEqual(snapshot['200']['seconds']['count'], 1)
+    self.assertEqual(snapshot['404']['minified'], 0)
+    self.assertEqual(snapshot['404']['skipped'], {'not_html': 1, 'header': 1})
+    self.assertEqual(snapshot['404']['seconds']['p50'], None)
+    self.assertEqual([(e['route'], e['minified'], e['reason'], e['bytes_out'])
+                      for e in events],
+                     [('200', True, None, 5), ('404', False, 'not_html', 13),
+                      ('404', False, 'header', 1)])
+
+  def test_middleware_metrics_endpoint(self):
+    app = HTMLMinMiddleware(self.wsgi_app, metrics_path='/metrics')
+    self.call_app(app, '200 OK', (('Content-Type', 'text/html'),), '  X  ')
+    status, headers, body = self.call_app(
+      app, '200 OK', (('Content-Type', 'text/html'),), '')
+    self.assertEqual(body, '')
+    headers, body = self.call_raw(app, {'PATH_INFO': '/metrics'})
+    self.assertTrue(headers[0][1].startswith('text/plain'))
+    lines = ''.join(body).splitlines()
+    self.assertTrue('# TYPE htmlmin_minify_seconds histogram' in lines)
+    self.assertTrue('htmlmin_minified_total{route=""} 2' in lines)
+    self.assertTrue('htmlmin_input_bytes_total{route=""} 5' in lines)
+    self.assertTrue('htmlmin_output_bytes_total{route=""} 3' in lines)
+    self.assertTrue(
+      'htmlmin_minify_seconds_bucket{route="",le="+Inf"} 2' in lines)
+
+  def test_middleware_gzip(self):
+    import gzip
+    import io
+    def wsgi_app(environ, start_response):
+      start_response('200 OK', [('Content-Type', 'text/html'),
+                                ('Content-Length', '26')])
+      for chunk in ('<p>  X  ', '<!-- Y -->  ', '  Z  </p>'):
+        yield chunk
+    app = HTMLMinMiddleware(wsgi_app, gzip=True, remove_comments=True)
+
+    headers, body = self.call_raw(
+      app, {'HTTP_ACCEPT_ENCODING': 'deflate, gzip;q=0.5'})
+    self.assertEqual(sorted(headers), [
+      ('Content-Encoding', 'gzip'), ('Content-Type', 'text/html'),
+      ('Vary', 'Accept-Encoding')])
+    body = b''.join(body)
+    self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(body)).read(),
+                     b'<p> X Z </p>')
+    self.assertEqual(app.metrics.snapshot()['']['bytes_out'], 12)
+
+    for accept_encoding in ('', 'gzip;q=0, identity'):
+      headers, body = self.call_raw(
+        app, {'HTTP_ACCEPT_ENCODING': accept_encoding})
+      self.assertEqual(body, ['<p> X Z </p>'])
+      self.assertTrue(('Vary', 'Accept-Encoding') in headers)
+
+  def test_middleware_etag(self):
+    import hashlib
+    def wsgi_app(environ, start_response):
+      start_response('200 OK', [('Content-Type', 'text/html'),
+                                ('ETag', '"upstream"'),
+                                ('Cache-Control', 'max-age=60')])
+      return ['<p>  X  </p>']
+    app = HTMLMinMiddleware(wsgi_app, etag=True, gzip=True)
+    etag = '"%s"' % hashlib.sha1(b'<p> X </p>').hexdigest()
+
+    headers, body = self.call_raw(app, {})
+    self.assertTrue(('ETag', etag) in headers)
+    self.assertFalse(('ETag', '"upstream"') in headers)
+    self.assertEqual(body, ['<p> X </p>'])
+
+    headers, body = self.call_raw(app, {'HTTP_ACCEPT_ENCODING': 'gzip'})
+    self.assertTrue(('ETag', etag[:-1] + '-gzip"') in headers)
+    self.assertTrue(('Content-Encoding', 'gzip') in headers)
+
+    statuses = []
+    def start_response(status, headers, exc_info=None):
+      statuses.append((status, sorted(headers)))
+    for if_none_match in ('"x", W/' + etag, '*'):
+      body = app({'HTTP_IF_NONE_MATCH': if_none_match}, start_response)
+      self.assertEqual(body, [])
+      self.assertEqual(statuses.pop(), ('304 Not Modified', [
+        ('Cache-Control', 'max-age=60'), ('ETag', etag),
+        ('Vary', 'Accept-Encoding')]))
+    for environ in ({'HTTP_IF_NONE_MATCH': '"upstream"'},
+                    {'HTTP_IF_NONE_MATCH': etag, 'REQUEST_METHOD': 'POST'}):
+      self.assertEqual(app(environ, start_response), ['<p> X </p>'])
+      self.assertEqual(statuses.pop()[0], '200 OK')
+
+  def test_middleware_cache(self):
+    calls = []
+    def wsgi_app(environ, start_response):
+      start_response('200 OK', [('Content-Type', 'text/html'),
+                                ('ETag', environ.get('upstream', '"v1"'))])
+      calls.append(environ.get('PATH_INFO'))
+      return ['<p>  X  </p>' * environ.get('repeat', 1)]
+    for gzip in (False, True):
+      app = HTMLMinMiddleware(wsgi_app, gzip=gzip, cache_bytes=40)
+      for environ in ({}, {'HTTP_ACCEPT_ENCODING': 'gzip'}):
+        first = self.call_raw(app, dict(environ))[1]
+        app.minifier.minify = None  # a cache hit must not minify again
+        self.assertEqual(self.call_raw(app, dict(environ))[1], first)
+        del app.minifier.minify
+      # Without gzip, both requests get the same representation.
+      hits = 2 if gzip else 3
+      self.assertEqual(app.metrics.snapshot()['']['cached'], hits)
+      self.assertEqual(app.cache.stats()['hits'], hits)
+
+      self.assertEqual(self.call_raw(app, {'upstream': '"v2"'})[1],
+                       ['<p> X </p>'])
+      for path in ('/a', '/b', '/c'):
+        self.call_raw(app, {'PATH_INFO': path})
+      self.assertEqual(app.cache.stats()['hits'], hits)
+      self.assertTrue(app.cache.stats()['evictions'] > 0)
+      self.assertTrue(app.cache.stats()['bytes'] <= 40)
+      self.call_raw(app, {'repeat': 10, 'upstream': '"big"'})
+      self.assertEqual(app.cache.get(
+        ('', '', ('etag', '"big"'), False, app._options_key)), None)
+
+  def test_middleware_skip_reasons(self):
+    app = HTMLMinMiddleware(self.wsgi_app, min_size=5, max_size=20)
+    for headers, content, reason in (
+        ((('Content-Encoding', 'gzip'),), '  X  ', 'encoded'),
+        ((('Content-Encoding', 'identity'),), '  X  ', None),
+        ((('Content-Length', '4'),), '  X  ', 'too_small'),
+        ((('Content-Length', '21'),), '  X  ', 'too_large'),
+        ((), '  X', 'too_small'),
+        ((), '  X  ' * 5, 'too_large')):
+      status, _, body = self.call_app(
+        app, '200 OK', (('Content-Type', 'text/html'),) + headers, content)
+      self.assertEqual(body == content, reason is not None)
+    self.assertEqual(app.metrics.snapshot()['']['skipped'], {
+      'encoded': 1, 'too_small': 2, 'too_large': 2})
+
+  def test_middleware_policy(self):
+    def wsgi_app(environ, start_response):
+      start_response('200 OK', [('Content-Type', 'text/html')])
+      return [environ['content']]
+    app = HTMLMinMiddleware(wsgi_app, min_savings_per_ms=1e9,
+                            route=lambda environ: environ['content'][0])
+    policy = app.policy
+    policy.samples, policy.resample_every = 2, 3
+    call = lambda content: self.call_raw(app, {'content': content})[1]
+    self.assertEqual([call('a  b'), call('a  b')], [['a b'], ['a b']])
+    self.assertEqual([call('a  b') for i in range(3)],
+                     [['a  b'], ['a  b'], ['a b']])
+    self.assertEqual(call('b  c'), ['b c'])
+    self.assertEqual(app.metrics.snapshot()['a']['skipped'], {'policy': 2})
+    self.assertFalse(policy.snapshot()['a']['enabled'])
+    self.assertTrue(policy.snapshot()['b']['enabled'])
+
+    policy.min_savings_per_ms = 0
+    call('a  b')
+    call('a  b')
+    self.assertEqual(call('a  b'), ['a b'])
+    self.assertTrue(policy.snapshot()['a']['enabled'])
+
+  def test_middleware_deadline(self):
+    def wsgi_app(environ, start_response):
+      start_response('200 OK', [('Content-Type', 'text/html')])
+      return ['<p>  X  </p>', '  <p>  Y  </p>']
+    import zlib
+    for engine in ('full', 'fast'):
+      for gzip in (False, True):
+        app = HTMLMinMiddleware(wsgi_app, deadline=-1, gzip=gzip,
+                                engine=engine)
+        body = self.call_raw(app, {'HTTP_ACCEPT_ENCODING': 'gzip'})[1]
+        if gzip:
+          body = [zlib.decompress(b''.join(body), 16 + zlib.MAX_WBITS)
+                  .decode('utf-8')]
+        # The fast engine can't stop part way through, so it ignores the
+        # deadline.
+        if engine == 'fast':
+          self.assertEqual(''.join(body), '<p> X </p> <p> Y </p>')
+        else:
+          self.assertEqual(body, ['<p>  X  </p>  <p>  Y  </p>'])
+        self.assertEqual(app.metrics.snapshot()['']['deadline_exceeded'],
+                         int(engine == 'full'))
+
+  def test_middleware_deadline_not_cached(self):
+    def wsgi_app(environ, start_response):
+      start_response('200 OK', [('Content-Type', 'text/html'),
+                                ('ETag', '"v1"')])
+      return ['<p>  X  </p>', '  <p>  Y  </p>']
+    for etag in (False, True):
+      for gzip in (False, True):
+        app = HTMLMinMiddleware(wsgi_app, deadline=-1, gzip=gzip, etag=etag,
+                                cache_bytes=1000)
+        for environ in ({}, {'HTTP_ACCEPT_ENCODING': 'gzip'}):
+          self.call_raw(app, environ)
+        self.assertEqual(app.cache.stats()['bytes'], 0)
+        self.assertEqual(app.metrics.snapshot()['']['deadline_exceeded'], 2)
+
+  def test_histogram_quantile(self):
+    histogram = Histogram(buckets=(1, 2, 4))
+    self.assertEqual(histogram.quantile(0.5), None)
+    for value in (0.5, 1.5, 1.5, 3, 10):
+      histogram.observe(value)
+    self.assertEqual(histogram.quantile(0.2), 1)
+    self.assertEqual(histogram.quantile(0.5), 1.75)
+    self.assertEqual(histogram.quantile(1), 4)
+    self.assertEqual(histogram.counts, [1, 2, 1, 1])
+
 def suite():
     minify_function_suite = unittest.TestLoader().\
         loadTestsFromTestCase(TestMinifyFunction)
@@ -594,6 +1509,24 @@ def suite():
         loadTestsFromTestCase(TestMinifierObject)
     minify_features_suite = unittest.TestLoader().\
         loadTestsFromTestCase(TestMinifyFeatures)
+    token_stream_suite = unittest.TestLoader().\
+        loadTestsFromTestCase(TestTokenStream)
+    parallel_suite = unittest.TestLoader().\
+        loadTestsFromTestCase(TestParallel)
+    snapshot_suite = unittest.TestLoader().\
+        loadTestsFromTestCase(TestSnapshot)
+    fast_engine_suite = unittest.TestLoader().\
+        loadTestsFromTestCase(TestFastEngine)
+    skip_minified_suite = unittest.TestLoader().\
+        loadTestsFromTestCase(TestSkipMinified)
+    stats_suite = unittest.TestLoader().\
+        loadTestsFromTestCase(TestStats)
+    report_suite = unittest.TestLoader().\
+        loadTestsFromTestCase(TestReport)
+    command_suite = unittest.TestLoader().\
+        loadTestsFromTestCase(TestCommand)
+    adversarial_input_suite = unittest.TestLoader().\
+        loadTestsFromTestCase(TestAdversarialInput)
     self_closing_tags_suite = unittest.TestLoader().\
         loadTestsFromTestCase(TestSelfClosingTags)
     self_opening_tags_suite = unittest.TestLoader().\
@@ -606,6 +1539,15 @@ def suite():
         minify_function_suite,
         minifier_object_suite,
         minify_features_suite,
+        token_stream_suite,
+        parallel_suite,
+        snapshot_suite,
+        fast_engine_suite,
+        skip_minified_suite,
+        stats_suite,
+        report_suite,
+        command_suite,
+        adversarial_input_suite,
         self_closing_tags_suite,
         self_opening_tags_suite,
         decorator_suite,
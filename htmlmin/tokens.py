@@ -0,0 +1,208 @@
+"""
+Copyright (c) 2013, Dave Mankoff
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Dave Mankoff nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL DAVE MANKOFF BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import unicode_literals
+from array import array
+
+try:
+  from itertools import izip as zip
+except ImportError:
+  pass
+
+from .python3html.parser import HTMLParser
+
+# Token type codes stored in TokenStream.kinds.
+DATA = 0
+STARTTAG = 1
+STARTENDTAG = 2
+ENDTAG = 3
+COMMENT = 4
+DECL = 5
+PI = 6
+UNKNOWN_DECL = 7
+CHARREF = 8
+ENTITYREF = 9
+
+class TokenStream(object):
+  """A tokenized HTML document in compact, columnar form.
+
+  Token ``n`` has the type code ``kinds[n]`` and covers
+  ``source[starts[n]:ends[n]]``. For data tokens that span is the data itself.
+  For comments, declarations, processing instructions and character references
+  it is the text that would be passed to the matching ``handle_*`` method of
+  the parser. For tags it is the full tag as it appears in the source, and the
+  parsed tag name (and attributes for start tags) are kept, in order, in
+  ``tags``.
+
+  Streams do not depend on minification options other than
+  ``convert_charrefs``, so they can be cached and replayed through any
+  :class:`htmlmin.Minifier` with a matching ``convert_charrefs`` setting.
+  """
+
+  def __init__(self, source, convert_charrefs=True):
+    self.source = source
+    self.convert_charrefs = convert_charrefs
+    self.kinds = array('B')
+    self.starts = array('l')
+    self.ends = array('l')
+    self.tags = []
+
+  def __len__(self):
+    return len(self.kinds)
+
+class Tokenizer(HTMLParser):
+  """Splits HTML into a :class:`TokenStream` without minifying it.
+
+  This runs the same tokenizer that :class:`htmlmin.parser.HTMLMinParser` is
+  built on, but records token positions instead of acting on them.
+  """
+
+  def __init__(self, convert_charrefs=True):
+    HTMLParser.__init__(self, convert_charrefs=convert_charrefs)
+
+  def reset(self):
+    self.stream = None
+    self._offset = 0
+    self._pending = None
+    HTMLParser.reset(self)
+
+  def tokenize(self, source):
+    self.reset()
+    self.stream = TokenStream(source, self.convert_charrefs)
+    self.feed(source)
+    self.close()
+    stream = self.stream
+    self.reset()
+    return stream
+
+  def goahead(self, end):
+    # goahead() drops consumed input from the front of rawdata. Track how much
+    # so that token offsets stay relative to the full source.
+    length = len(self.rawdata)
+    HTMLParser.goahead(self, end)
+    self._offset += length - len(self.rawdata)
+
+  def updatepos(self, i, j):
+    # goahead() calls this after every token with the span the token covered,
+    # right after the token's handler was called. We don't need line numbers.
+    if self._pending is not None:
+      kind, payload = self._pending
+      self._pending = None
+      start, end = i, j
+      if payload is not None:
+        # Most handlers only receive part of the span, e.g. the text inside
+        # <!-- -->.
+        start = self.rawdata.find(payload, i, j)
+        end = start + len(payload)
+      stream = self.stream
+      stream.kinds.append(kind)
+      stream.starts.append(self._offset + start)
+      stream.ends.append(self._offset + end)
+    return j
+
+  def unescape(self, val):
+    return val
+
+  def handle_data(self, data):
+    self._pending = (DATA, None)
+
+  def handle_starttag(self, tag, attrs):
+    self._pending = (STARTTAG, None)
+    self.stream.tags.append((tag, attrs))
+
+  def handle_startendtag(self, tag, attrs):
+    self._pending = (STARTENDTAG, None)
+    self.stream.tags.append((tag, attrs))
+
+  def handle_endtag(self, tag):
+    self._pending = (ENDTAG, None)
+    self.stream.tags.append((tag,))
+
+  def handle_comment(self, data):
+    self._pending = (COMMENT, data)
+
+  def handle_decl(self, decl):
+    self._pending = (DECL, decl)
+
+  def handle_pi(self, data):
+    self._pending = (PI, data)
+
+  def unknown_decl(self, data):
+    self._pending = (UNKNOWN_DECL, data)
+
+  def handle_charref(self, name):
+    self._pending = (CHARREF, name)
+
+  def handle_entityref(self, name):
+    self._pending = (ENTITYREF, name)
+
+def tokenize(source, convert_charrefs=True):
+  """Tokenizes an HTML string into a :class:`TokenStream`.
+
+  :param source: A string containing the HTML to be tokenized.
+  :param convert_charrefs: Must match the ``convert_charrefs`` option of the
+    minifier the stream will be replayed through.
+  """
+  return Tokenizer(convert_charrefs=convert_charrefs).tokenize(source)
+
+def replay(stream, parser):
+  """Feeds the tokens of ``stream`` to the handlers of ``parser``.
+
+  The parser's tokenizer is bypassed entirely; only its ``handle_*`` methods
+  are called. The parser should be freshly reset.
+  """
+  if stream.convert_charrefs != parser.convert_charrefs:
+    raise ValueError(
+      'Token stream was tokenized with convert_charrefs={}'.format(
+        stream.convert_charrefs))
+
+  source = stream.source
+  tags = iter(stream.tags)
+  handle_data = parser.handle_data
+  handle_starttag = parser.handle_starttag
+  handle_endtag = parser.handle_endtag
+  for kind, start, end in zip(stream.kinds, stream.starts, stream.ends):
+    if kind == DATA:
+      handle_data(source[start:end])
+    elif kind == STARTTAG:
+      handle_starttag(*next(tags))
+    elif kind == ENDTAG:
+      handle_endtag(*next(tags))
+    elif kind == STARTENDTAG:
+      parser.handle_startendtag(*next(tags))
+    elif kind == COMMENT:
+      parser.handle_comment(source[start:end])
+    elif kind == CHARREF:
+      parser.handle_charref(source[start:end])
+    elif kind == ENTITYREF:
+      parser.handle_entityref(source[start:end])
+    elif kind == DECL:
+      parser.handle_decl(source[start:end])
+    elif kind == PI:
+      parser.handle_pi(source[start:end])
+    else:
+      parser.unknown_decl(source[start:end])
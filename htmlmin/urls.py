@@ -0,0 +1,137 @@
+"""
+Copyright (c) 2013, Dave Mankoff
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Dave Mankoff nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL DAVE MANKOFF BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import unicode_literals
+import re
+
+try:
+  from urllib.parse import urljoin, urlsplit
+except ImportError:
+  from urlparse import urljoin, urlsplit
+
+# The attributes of each tag that hold a URL. srcset holds a list of them.
+URL_ATTRIBUTES = {
+  'a': ('href',),
+  'area': ('href',),
+  'audio': ('src',),
+  'blockquote': ('cite',),
+  'button': ('formaction',),
+  'del': ('cite',),
+  'embed': ('src',),
+  'form': ('action',),
+  'frame': ('src',),
+  'iframe': ('src',),
+  'img': ('src', 'srcset'),
+  'input': ('src', 'formaction'),
+  'ins': ('cite',),
+  'link': ('href',),
+  'object': ('data',),
+  'q': ('cite',),
+  'script': ('src',),
+  'source': ('src', 'srcset'),
+  'track': ('src',),
+  'video': ('src', 'poster'),
+}
+URL_ATTRIBUTE_SETS = dict((tag, frozenset(attrs))
+                          for tag, attrs in URL_ATTRIBUTES.items())
+
+# Only absolute http and https URLs are shortened, and only those without
+# space, backslashes or control characters, which browsers and urljoin might
+# not treat alike.
+ABSOLUTE_URL_RE = re.compile(r'https?://[^\x00-\x20\x7f\\]*$', re.I)
+DOT_SEGMENT_RE = re.compile(r'/\.\.?(?:/|$)')
+SRCSET_URL_RE = re.compile(r'[\x20\t\n\r\f,]*([^\x20\t\n\r\f]+)')
+SRCSET_DESCRIPTORS_RE = re.compile(r'[^,]*')
+
+def shorten(url, base):
+  """Returns the shortest of the scheme relative, path absolute and path
+  relative forms of ``url`` that resolves to the same URL against ``base``,
+  or ``url`` itself if none is shorter.
+
+  An empty URL, which images treat as an error, is never returned. Every
+  candidate is resolved with ``urljoin`` and must come back as ``url``
+  exactly. Paths with ``.`` or ``..`` segments, which only some versions of
+  urljoin remove, are only ever made scheme relative.
+  """
+  if not ABSOLUTE_URL_RE.match(url):
+    return url
+  parts = urlsplit(url)
+  base_parts = urlsplit(base)
+  if parts.scheme != base_parts.scheme:
+    return url
+
+  network_path = url[len(parts.scheme) + 1:]  # //host/path?query#fragment
+  candidates = [network_path]
+  if (parts.netloc == base_parts.netloc and
+      not DOT_SEGMENT_RE.search(parts.path)):
+    path = parts.path
+    absolute_path = network_path[2 + len(parts.netloc):]
+    suffix = absolute_path[len(path):]  # ?query#fragment
+    if path:
+      candidates.append(absolute_path)
+      base_dir = base_parts.path[:base_parts.path.rfind('/') + 1]
+      if base_dir and path.startswith(base_dir):
+        relative = path[len(base_dir):]
+        # Keep a colon in the first segment from reading as a scheme.
+        if not relative or ':' in relative.split('/')[0]:
+          relative = './' + relative
+        candidates.append(relative + suffix)
+    if path == base_parts.path and (
+        suffix[:1] == '?' or
+        (suffix[:1] == '#' and parts.query == base_parts.query)):
+      candidates.append(suffix)
+
+  for candidate in sorted(candidates, key=len):
+    if len(candidate) >= len(url):
+      break
+    if candidate and urljoin(base, candidate) == url:
+      return candidate
+  return url
+
+def shorten_srcset(value, base):
+  """Shortens each URL in a ``srcset`` attribute with :func:`shorten`."""
+  out = []
+  pos = 0
+  while True:
+    match = SRCSET_URL_RE.match(value, pos)
+    if not match:
+      break
+    out.append(value[pos:match.start(1)])
+    url = match.group(1)
+    pos = match.end()
+    # A URL can hold commas, but those it ends with end the candidate.
+    stripped = url.rstrip(',')
+    out.extend([shorten(stripped, base), url[len(stripped):]])
+    if stripped == url:
+      descriptors = SRCSET_DESCRIPTORS_RE.match(value, pos).group()
+      if '(' in descriptors:
+        # Descriptors with parentheses can hold commas too.
+        return value
+      out.append(descriptors)
+      pos += len(descriptors)
+  out.append(value[pos:])
+  return ''.join(out)